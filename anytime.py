@@ -0,0 +1,201 @@
+""" Module which solves routing models in anytime mode: every improving
+solution is published as soon as the search finds it, instead of only
+the final one when SolveWithParameters returns.
+
+    for improvement in anytime.iter_solutions(data, time_limit=30):
+        show(improvement.routes)
+        if improvement.objective <= good_enough:
+            break   # stops the search
+
+The search runs in a worker process for iter_solutions and
+aiter_solutions, since the routing solver holds the GIL while it runs.
+solve_with_callback runs it in the calling process.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+import asyncio
+import json
+import multiprocessing
+import queue
+import time
+import condensed_matrix
+import optops
+import route_set
+
+
+# routes is a list with the nodes of every vehicle, timestamp the
+# time.time() the solution was found at and elapsed the seconds since
+# the search started.
+Improvement = namedtuple('Improvement', ['objective', 'routes', 'timestamp',
+                                         'elapsed'])
+
+# seconds the worker gets to stop after the consumer is done before it
+# is terminated.
+SHUTDOWN_GRACE = 1.0
+
+
+def solve_with_callback(data, on_solution, scale=optops.DEFAULT_DISTANCE_SCALE,
+                        max_route_distance=None,
+                        first_solution_strategy='PATH_CHEAPEST_ARC',
+                        local_search_metaheuristic='GUIDED_LOCAL_SEARCH',
+                        time_limit=10, should_stop=None):
+    """ Method to solve a model and hand every improving solution to a
+    callback while the search runs.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model (distance_matrix, num_vehicles, depot).
+    on_solution : callable
+        Called with an Improvement for every improving solution. If it
+        returns True the search is stopped.
+    scale, max_route_distance
+        See optops.create_routing_model.
+    first_solution_strategy, local_search_metaheuristic, time_limit
+        See optops.create_search_parameters.
+    should_stop : callable
+        Polled at every solution, the search is stopped once it returns
+        True.
+
+    Returns
+    -------
+    Improvement
+        The best solution found, None if there was none.
+    """
+    data = dict(data)
+    data['distance_matrix'] = condensed_matrix.as_matrix(
+        data['distance_matrix'])
+    manager, routing, _ = optops.create_routing_model(
+        data, scale=scale, max_route_distance=max_route_distance)
+    best = [None]
+    start = time.time()
+
+    def on_assignment():
+        objective = routing.CostVar().Max()
+        stop = should_stop is not None and should_stop()
+        if best[0] is None or objective < best[0].objective:
+            routes = route_set.RouteSet.from_solution(data, manager, routing)
+            now = time.time()
+            best[0] = Improvement(objective,
+                                  [route.tolist() for route in routes],
+                                  now, now - start)
+            stop = on_solution(best[0]) or stop
+        if stop:
+            routing.solver().FinishCurrentSearch()
+
+    routing.AddAtSolutionCallback(on_assignment)
+    search_parameters = optops.create_search_parameters(
+        first_solution_strategy, local_search_metaheuristic, time_limit)
+    routing.SolveWithParameters(search_parameters)
+    return best[0]
+
+
+def iter_solutions(data, **kwargs):
+    """ Generator of the improving solutions of a model.
+
+    The search runs in a worker process and every Improvement is
+    yielded as soon as it is found. Closing the generator (e.g. a break
+    in the consuming loop) stops the search.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model.
+    kwargs
+        See solve_with_callback.
+    """
+    ctx = multiprocessing.get_context()
+    messages = ctx.Queue()
+    stop_event = ctx.Event()
+    process = ctx.Process(target=_anytime_worker,
+                          args=(data, kwargs, messages, stop_event),
+                          daemon=True)
+    process.start()
+    try:
+        while True:
+            try:
+                kind, payload = messages.get(timeout=0.1)
+            except queue.Empty:
+                if not process.is_alive():
+                    raise RuntimeError('the anytime search exited with '
+                                       'code %s' % process.exitcode)
+                continue
+            if kind == 'solution':
+                yield Improvement(*payload)
+            elif kind == 'error':
+                raise RuntimeError(payload)
+            else:
+                return
+    finally:
+        stop_event.set()
+        process.join(SHUTDOWN_GRACE)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+
+async def aiter_solutions(data, **kwargs):
+    """ Async generator version of iter_solutions, the queue of the
+    worker is read in the default executor so the event loop is never
+    blocked.
+    """
+    loop = asyncio.get_running_loop()
+    solutions = iter_solutions(data, **kwargs)
+    done = object()
+    try:
+        while True:
+            improvement = await loop.run_in_executor(None, next, solutions,
+                                                     done)
+            if improvement is done:
+                return
+            yield improvement
+    finally:
+        await loop.run_in_executor(None, solutions.close)
+
+
+class JsonLinesWriter(object):
+    """ Solution callback which appends every improvement to a file as
+    one json line ({"objective", "routes", "timestamp", "elapsed"}),
+    flushed at once so readers can tail the file.
+
+    Parameters
+    ----------
+    a_file : str
+    target_objective : int
+        If given, the search is stopped once an objective not above it
+        is written.
+    """
+
+    def __init__(self, a_file, target_objective=None):
+        self.a_file = a_file
+        self.target_objective = target_objective
+
+    def __call__(self, improvement):
+        with open(self.a_file, 'a') as outfile:
+            outfile.write(json.dumps(improvement._asdict()) + '\n')
+        return (self.target_objective is not None
+                and improvement.objective <= self.target_objective)
+
+
+def read_solutions_from_file(a_file):
+    """ Method to read the improvements written by JsonLinesWriter."""
+    with open(a_file) as infile:
+        return [Improvement(**json.loads(line)) for line in infile
+                if line.strip()]
+
+
+def _anytime_worker(data, kwargs, messages, stop_event):
+    """ Runs solve_with_callback and streams its improvements."""
+    def publish(improvement):
+        messages.put(('solution', tuple(improvement)))
+
+    try:
+        solve_with_callback(data, publish, should_stop=stop_event.is_set,
+                            **kwargs)
+    except Exception as exc:
+        messages.put(('error', repr(exc)))
+        return
+    messages.put(('done', None))
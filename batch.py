@@ -0,0 +1,173 @@
+""" Module which solves many city scenarios in a process pool and writes
+all results into a single output file.
+
+A scenario file holds one scenario per line (comma separated city
+names, as cities.csv), or named blocks:
+
+    [athens-north]
+    Athens,Thebes,Lamia
+    Volos,Kozani
+
+where every line until the next header belongs to the block.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import time
+import city_ops
+import optops
+
+
+def read_scenarios_from_file(a_file):
+    """ Method to read the scenarios of a file.
+
+    Parameters
+    ----------
+    a_file : str
+        The filepath of the scenarios.
+
+    Returns
+    -------
+    scenarios : list
+        A list of (name, city_names) pairs in the order of the file.
+    """
+    scenarios = []
+    block = None
+    with open(a_file, 'r') as f:
+        for line_num, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('[') and line.endswith(']'):
+                block = (line[1:-1].strip(), [])
+                scenarios.append(block)
+                continue
+            cities = [c.strip() for c in line.split(',') if c.strip()]
+            if block is not None:
+                block[1].extend(cities)
+            else:
+                scenarios.append(('line-%d' % line_num, cities))
+    return scenarios
+
+
+def run_batch(scenarios, num_vehicles=1, time_limit=30, num_workers=None,
+              geocoder=None, method=city_ops.DEFAULT_DISTANCE_METHOD,
+              max_route_distance=None, local_search_metaheuristic=None):
+    """ Method to solve independent scenarios in parallel.
+
+    All the distinct city names are geocoded once, in the calling
+    process, so the workers never touch the network or the cache.
+
+    Parameters
+    ----------
+    scenarios : list
+        A list of (name, city_names) pairs.
+    num_vehicles : int
+        The number of vehicles of every scenario.
+    time_limit : float
+        The search time limit (seconds) of every scenario.
+    num_workers : int
+        Number of worker processes, defaults to the cpu count.
+    geocoder : object
+        See city_ops.modify_data_for_google_or.
+    method : str
+        The distance tier, see city_ops.DISTANCE_METHODS.
+    max_route_distance : float
+        If given, the maximum distance (km) of every vehicle.
+    local_search_metaheuristic : str
+        See optops.create_search_parameters.
+
+    Returns
+    -------
+    results : list
+        One dictionary per scenario, in the order of scenarios.
+    """
+    if geocoder is None:
+        geocoder = city_ops.get_default_geocoder()
+    start = time.time()
+    names = sorted(set(c for _, cities in scenarios for c in cities))
+    locations = dict(zip(names, city_ops.geocode_cities(names, geocoder)))
+    geocode_time = time.time() - start
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(
+            solve_scenario, name, cities, [locations[c] for c in cities],
+            num_vehicles, time_limit, method, max_route_distance,
+            local_search_metaheuristic) for name, cities in scenarios]
+        results = [future.result() for future in futures]
+    for result in results:
+        result['timings']['geocode_shared'] = geocode_time
+    return results
+
+
+def solve_scenario(name, city_names, locations, num_vehicles=1,
+                   time_limit=30, method=city_ops.DEFAULT_DISTANCE_METHOD,
+                   max_route_distance=None, local_search_metaheuristic=None):
+    """ Method to solve a single scenario, run inside the workers.
+
+    Returns
+    -------
+    result : dictionary
+        name, status, objective, routes (vehicle_id: city names) and
+        timings (seconds) of the scenario.
+    """
+    result = {'name': name, 'cities': city_names, 'status': 'no solution',
+              'objective': None, 'routes': None, 'timings': {}}
+    start = time.time()
+    missing = [c for c, loc in zip(city_names, locations) if loc is None]
+    if missing:
+        result['status'] = 'geocoding failed for %s' % ', '.join(missing)
+        return result
+    data = optops.create_data_model(
+        city_ops.create_distance_matrix(locations, method=method),
+        num_vehicles)
+    result['timings']['matrix'] = time.time() - start
+    start = time.time()
+    manager, routing, _ = optops.create_routing_model(
+        data, max_route_distance=max_route_distance)
+    search_parameters = optops.create_search_parameters(
+        local_search_metaheuristic=local_search_metaheuristic,
+        time_limit=time_limit)
+    result['timings']['model'] = time.time() - start
+    start = time.time()
+    solution = routing.SolveWithParameters(search_parameters)
+    result['timings']['solve'] = time.time() - start
+    if solution:
+        routes = optops.get_all_routes(data, manager, routing, solution)
+        result['status'] = 'solved'
+        result['objective'] = solution.ObjectiveValue()
+        result['routes'] = dict((vehicle_id, [city_names[n] for n in nodes])
+                                for vehicle_id, nodes in routes.items())
+    return result
+
+
+def write_results_to_file(results, output_file):
+    """ Method to write the results of a batch to one json file."""
+    with open(output_file, 'w') as outfile:
+        json.dump(results, outfile, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Solve every scenario of a city file in parallel.')
+    parser.add_argument('scenario_file')
+    parser.add_argument('-o', '--output', default='batch_results.json')
+    parser.add_argument('-v', '--vehicles', type=int, default=1)
+    parser.add_argument('-t', '--time-limit', type=float, default=30)
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    args = parser.parse_args()
+    results = run_batch(read_scenarios_from_file(args.scenario_file),
+                        num_vehicles=args.vehicles,
+                        time_limit=args.time_limit,
+                        num_workers=args.workers)
+    write_results_to_file(results, args.output)
+    for result in results:
+        print('{}: {} objective {}'.format(result['name'], result['status'],
+                                           result['objective']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+""" Module which benchmarks the whole pipeline (matrix build, model
+construction, solve, route extraction and plotting) over seeded
+instances of growing size.
+
+Usage:
+
+    python benchmark.py run -o results.json --sizes 50 200 1000
+    python benchmark.py compare old.json new.json --threshold 0.1
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import city_ops
+import geocache
+import optops
+
+
+INSTANCE_KINDS = ('uniform', 'clustered', 'grid')
+DEFAULT_SIZES = (50, 200, 1000, 5000, 20000)
+STAGES = ('matrix', 'city_matrix', 'model', 'solve', 'routes', 'plot')
+# dense stages are skipped above this many nodes (a float64 matrix of
+# 20k nodes alone needs 3.2 GB), only the condensed matrix is built.
+DEFAULT_MAX_DENSE_NODES = 5000
+# a regression is only reported if it is worse by more than the
+# relative threshold and by more than this many seconds or bytes.
+MIN_REGRESSION_SECONDS = 0.005
+MIN_REGRESSION_BYTES = 1 << 20
+REGRESSION_METRICS = (('seconds', MIN_REGRESSION_SECONDS),
+                      ('peak_bytes', MIN_REGRESSION_BYTES))
+
+
+def generate_instance(kind, num_nodes, seed=0):
+    """ Method to generate the coordinates of a seeded instance.
+
+    Parameters
+    ----------
+    kind : str
+        'uniform' points in a 1000x1000 square, 'clustered' points
+        around a few gaussian centres or a 'grid' of unit spacing (the
+        closest grid with at least num_nodes points, cut to size).
+    num_nodes : int
+    seed : int
+
+    Returns
+    -------
+    numpy.ndarray
+        The (num_nodes, 2) coordinates.
+    """
+    rng = np.random.RandomState(seed)
+    if kind == 'uniform':
+        return rng.uniform(0, 1000, size=(num_nodes, 2))
+    if kind == 'clustered':
+        num_centres = max(1, int(np.sqrt(num_nodes) / 2))
+        centres = rng.uniform(0, 1000, size=(num_centres, 2))
+        labels = rng.randint(num_centres, size=num_nodes)
+        return centres[labels] + rng.normal(0, 25, size=(num_nodes, 2))
+    if kind == 'grid':
+        side = int(np.ceil(np.sqrt(num_nodes)))
+        return np.array(optops.create_simple_grid(side, side),
+                        dtype=np.float64)[:num_nodes]
+    raise ValueError("Unknown instance kind '%s'. Choose one of %s."
+                     % (kind, ', '.join(INSTANCE_KINDS)))
+
+
+def _fixture_geocoder(points):
+    """ Returns an offline geocoder which places the points inside a
+    10x10 degree box, named by their index.
+    """
+    span = np.ptp(points, axis=0)
+    span[span == 0] = 1
+    scaled = (points - points.min(axis=0)) / span * 10
+    return geocache.FixtureGeocoder(dict(
+        (str(i), (35 + lat, 15 + lon))
+        for i, (lat, lon) in enumerate(scaled.tolist())))
+
+
+class _Stage(object):
+    """ Context manager which records the wall time of a stage into a
+    results dictionary.
+    """
+
+    def __init__(self, stages, name):
+        self.stages = stages
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stages[self.name] = {'seconds': time.perf_counter() - self.start}
+        return False
+
+
+class _MemoryStage(_Stage):
+    """ Context manager which records the peak traced memory of a stage,
+    for the untimed pass of run_instance.
+    """
+
+    def __enter__(self):
+        tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _, peak = tracemalloc.get_traced_memory()
+        self.stages.setdefault(self.name, {})['peak_bytes'] = peak
+        return False
+
+
+def run_instance(kind, num_nodes, seed=0, num_vehicles=1, time_limit=2,
+                 max_dense_nodes=DEFAULT_MAX_DENSE_NODES,
+                 measure_memory=True):
+    """ Method to time every stage of the pipeline on one instance.
+
+    The stages are timed first, then, if measure_memory, run again under
+    tracemalloc for their peak memory, so the tracing does not slow the
+    timed pass. Above max_dense_nodes only the matrix stage runs, with a
+    condensed matrix (see optops.calc_condensed_distance_matrix), the
+    dense stages are skipped.
+
+    Returns
+    -------
+    result : dictionary
+        kind, num_nodes, seed, objective and a stages dictionary with
+        seconds and peak_bytes (or 'skipped') per stage, plus 'error'
+        if a stage failed.
+    """
+    points = generate_instance(kind, num_nodes, seed)
+    stages = {}
+    result = {'kind': kind, 'num_nodes': num_nodes, 'seed': seed,
+              'num_vehicles': num_vehicles, 'objective': None,
+              'stages': stages}
+    dense = num_nodes <= max_dense_nodes
+    if not dense:
+        for name in STAGES[1:]:
+            stages[name] = 'skipped'
+    try:
+        result['objective'] = _run_stages(points, num_vehicles, time_limit,
+                                          dense, stages, _Stage)
+        if measure_memory:
+            tracemalloc.start()
+            try:
+                _run_stages(points, num_vehicles, time_limit, dense, stages,
+                            _MemoryStage)
+            finally:
+                tracemalloc.stop()
+    except Exception as exc:
+        result['error'] = repr(exc)
+    return result
+
+
+def _run_stages(points, num_vehicles, time_limit, dense, stages, stage):
+    """ Runs the stages of the pipeline, each inside stage(stages, name).
+
+    Returns
+    -------
+    int
+        The objective of the solve stage, None if it did not run or
+        found no solution.
+    """
+    if not dense:
+        with stage(stages, 'matrix'):
+            optops.calc_condensed_distance_matrix(points)
+        return None
+    with stage(stages, 'matrix'):
+        matrix = optops.calc_matrix_euclidean_distance(points)
+    geocoder = _fixture_geocoder(points)
+    names = [str(i) for i in range(len(points))]
+    with stage(stages, 'city_matrix'):
+        city_ops.modify_data_for_google_or(names, geocoder)
+    data = optops.create_data_model(matrix, num_vehicles)
+    with stage(stages, 'model'):
+        manager, routing, _ = optops.create_routing_model(data, scale=100)
+        search_parameters = optops.create_search_parameters(
+            time_limit=time_limit)
+    with stage(stages, 'solve'):
+        solution = routing.SolveWithParameters(search_parameters)
+    if not solution:
+        return None
+    with stage(stages, 'routes'):
+        routes = optops.get_all_routes(data, manager, routing, solution)
+    with stage(stages, 'plot'):
+        optops.render_routes_to_file(points, routes, _NullWriter(),
+                                     file_format='png')
+    return solution.ObjectiveValue()
+
+
+class _NullWriter(object):
+    """ File-like sink so plotting can be timed without touching disk."""
+
+    def write(self, data):
+        return len(data)
+
+
+def run_suite(sizes=DEFAULT_SIZES, kinds=INSTANCE_KINDS, seed=0,
+              num_vehicles=1, time_limit=2,
+              max_dense_nodes=DEFAULT_MAX_DENSE_NODES, measure_memory=True):
+    """ Method to run every kind and size of instance.
+
+    Returns
+    -------
+    report : dictionary
+        The environment and the list of run_instance results.
+    """
+    results = []
+    for kind in kinds:
+        for num_nodes in sizes:
+            print('{} {} nodes'.format(kind, num_nodes), file=sys.stderr)
+            results.append(run_instance(kind, num_nodes, seed, num_vehicles,
+                                        time_limit, max_dense_nodes,
+                                        measure_memory))
+    return {'python': platform.python_version(),
+            'machine': platform.machine(),
+            'time_limit': time_limit,
+            'results': results}
+
+
+def compare_results(old_report, new_report, threshold=0.1):
+    """ Method to find the stages that got slower or used more memory
+    between two reports.
+
+    Parameters
+    ----------
+    old_report, new_report : dictionary
+        Reports of run_suite.
+    threshold : float
+        Relative increase above which a stage is flagged.
+
+    Returns
+    -------
+    regressions : list
+        (kind, num_nodes, stage, metric, old value, new value) tuples,
+        metric is 'seconds' or 'peak_bytes'.
+    """
+    def index(report):
+        return dict(((r['kind'], r['num_nodes'], r['seed']), r['stages'])
+                    for r in report['results'])
+    old, new = index(old_report), index(new_report)
+    regressions = []
+    for key in sorted(set(old) & set(new)):
+        for stage in STAGES:
+            before, after = old[key].get(stage), new[key].get(stage)
+            if not isinstance(before, dict) or not isinstance(after, dict):
+                continue
+            for metric, minimum in REGRESSION_METRICS:
+                if metric not in before or metric not in after:
+                    continue
+                if (after[metric] - before[metric] > minimum
+                        and after[metric] > before[metric] * (1 + threshold)):
+                    regressions.append((key[0], key[1], stage, metric,
+                                        before[metric], after[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    run = commands.add_parser('run', help='run the benchmark suite')
+    run.add_argument('-o', '--output', default='bench_results.json')
+    run.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    run.add_argument('--kinds', nargs='+', default=INSTANCE_KINDS,
+                     choices=INSTANCE_KINDS)
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--vehicles', type=int, default=1)
+    run.add_argument('--time-limit', type=float, default=2)
+    run.add_argument('--max-dense-nodes', type=int,
+                     default=DEFAULT_MAX_DENSE_NODES)
+    run.add_argument('--no-memory', action='store_true',
+                     help='skip the untimed peak memory pass')
+    compare = commands.add_parser('compare', help='compare two result files')
+    compare.add_argument('old')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+    if args.command == 'run':
+        report = run_suite(args.sizes, args.kinds, args.seed, args.vehicles,
+                           args.time_limit, args.max_dense_nodes,
+                           not args.no_memory)
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+    elif args.command == 'compare':
+        with open(args.old) as old_file, open(args.new) as new_file:
+            regressions = compare_results(json.load(old_file),
+                                          json.load(new_file), args.threshold)
+        for kind, num_nodes, stage, metric, before, after in regressions:
+            if metric == 'seconds':
+                change = '{:.4f}s -> {:.4f}s'.format(before, after)
+            else:
+                change = '{:.1f} MB -> {:.1f} MB peak'.format(before / 1e6,
+                                                             after / 1e6)
+            print('REGRESSION {} {} nodes {}: {}'.format(
+                kind, num_nodes, stage, change))
+        sys.exit(1 if regressions else 0)
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
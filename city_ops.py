@@ -2,10 +2,25 @@
 
 from geopy.geocoders import Nominatim
 from geopy.distance import geodesic
+import condensed_matrix
+import geocache
+import tracing
+import numpy as np
 import time
 import pdb
 
 
+# mean earth radius (km) for the spherical tier.
+EARTH_RADIUS_KM = 6371.0088
+# WGS-84 ellipsoid, semi-major axis (km) and flattening.
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+# accuracy tiers of the distance matrix, cheapest first.
+DISTANCE_METHODS = ('haversine', 'ellipsoidal', 'geodesic')
+# tier used when none is given: Lambert's ellipsoidal formula, within
+# about 1e-4 of the geodesic at a fraction of its cost.
+DEFAULT_DISTANCE_METHOD = 'ellipsoidal'
+
 def read_city_names(city_names_file):
     """ method to read a file full of city names and returns them as
     geolocator objects.
@@ -14,25 +29,34 @@ def read_city_names(city_names_file):
     return locations
 
 
-def modify_data_for_google_or(city_names):
+def get_default_geocoder(cache_file=geocache.DEFAULT_CACHE_FILE):
+    """ Method which returns Nominatim behind the persistent geocode
+    cache, so that only names never seen before reach the network.
+    """
+    backend = Nominatim(user_agent="babis", timeout=10)
+    return geocache.CachedGeocoder(backend, geocache.GeocodeCache(cache_file))
+
+
+def modify_data_for_google_or(city_names, geocoder=None,
+                              method=DEFAULT_DISTANCE_METHOD):
     """ Method which computes the distance of each city with the others
     and creates a dictionary according to the specs of or_tools.
     :param city_names: list of city names
+    :param geocoder: object with a geocode_many(names) or geocode(name)
+        method. Defaults to the cached Nominatim geocoder.
+    :param method: accuracy tier of the distances, one of
+        DISTANCE_METHODS ('haversine', 'ellipsoidal' or the exact but
+        slow 'geodesic').
     """
-    # create a list for the geolocator objects and a matrix containing
-    # all distances between the cities
-    cities = []
-    distance_matrix = []
-    geolocator = Nominatim(user_agent="babis", timeout=10)
+    # create a list for the geolocator objects
+    if geocoder is None:
+        geocoder = get_default_geocoder()
 
     # create a list of cities instead of city names
-    for name in city_names:
-        #time.sleep(1)
-        city = geolocator.geocode(name)
-        cities.append(city)
+    cities = geocode_cities(city_names, geocoder)
 
     # create the distances between cities and have a complex dictionary
-    create_distance_matrix(cities, distance_matrix)
+    distance_matrix = create_distance_matrix(cities, method=method)
     # read for use with or_tools
     # TODO here
 
@@ -40,16 +64,190 @@ def modify_data_for_google_or(city_names):
     return distance_matrix
 
 
-def create_distance_matrix(cities, distance_matrix):
-    """ fills the distance matrix with the distances between the cities.
+@tracing.traced('geocode')
+def geocode_cities(city_names, geocoder):
+    """ Returns the locations of the city names, using the bulk
+    geocode_many of the geocoder when it has one.
+    """
+    if hasattr(geocoder, 'geocode_many'):
+        return geocoder.geocode_many(city_names)
+    return [geocoder.geocode(name) for name in city_names]
+
+
+@tracing.traced('matrix.city')
+def create_distance_matrix(cities, distance_matrix=None,
+                           method=DEFAULT_DISTANCE_METHOD):
+    """ Computes the distances (km) between the cities.
+
+    Parameters
+    ----------
+    cities : list
+        Locations with latitude and longitude attributes.
+    distance_matrix : list
+        If given, it is filled with one list of distances per city.
+    method : str
+        One of DISTANCE_METHODS.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (n, n) matrix of distances.
+    """
+    latitudes = np.array([city.latitude for city in cities], dtype=np.float64)
+    longitudes = np.array([city.longitude for city in cities],
+                          dtype=np.float64)
+    matrix = great_circle_matrix(latitudes, longitudes, method)
+    if distance_matrix is not None:
+        distance_matrix.extend(matrix.tolist())
+    return matrix
+
+
+@tracing.traced('matrix.city')
+def create_condensed_distance_matrix(cities, method=DEFAULT_DISTANCE_METHOD,
+                                     dtype=np.float32):
+    """ Computes the distances (km) between the cities in condensed
+    form, see condensed_matrix.CondensedMatrix. Only the upper triangle
+    is computed, one row at a time.
+
+    Parameters
+    ----------
+    cities : list
+        Locations with latitude and longitude attributes.
+    method : str
+        One of DISTANCE_METHODS.
+    dtype : numpy dtype
+
+    Returns
+    -------
+    condensed_matrix.CondensedMatrix
     """
-    one_city_distances = []
-    for city in cities:
-        for another_city in cities:
-            dist = compute_distance(city, another_city)
-            one_city_distances.append(dist)
-        distance_matrix.append(one_city_distances)
-        one_city_distances = []
+    latitudes = np.array([city.latitude for city in cities], dtype=np.float64)
+    longitudes = np.array([city.longitude for city in cities],
+                          dtype=np.float64)
+    matrix = condensed_matrix.CondensedMatrix.empty(len(cities), dtype)
+    for i in range(len(cities) - 1):
+        matrix.upper_row(i)[:] = distances_to_point(
+            latitudes[i + 1:], longitudes[i + 1:], latitudes[i],
+            longitudes[i], method)
+    return matrix
+
+
+def great_circle_matrix(latitudes, longitudes, method=DEFAULT_DISTANCE_METHOD,
+                        block_size=256):
+    """ Computes the symmetric matrix of distances (km) between points
+    given in degrees. Only the upper triangle is computed, in blocks of
+    rows, and then mirrored to the lower one.
+
+    Parameters
+    ----------
+    latitudes : numpy.ndarray
+    longitudes : numpy.ndarray
+    method : str
+        'haversine' for a spherical earth, 'ellipsoidal' for Lambert's
+        approximation on the WGS-84 ellipsoid (relative error below
+        1e-4) or 'geodesic' for the exact (and slow) geopy geodesic.
+    block_size : int
+        Number of rows computed at once.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (n, n) matrix of distances.
+    """
+    if method not in DISTANCE_METHODS:
+        raise ValueError("Unknown method '%s'. Choose one of %s."
+                         % (method, ', '.join(DISTANCE_METHODS)))
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    num_points = len(latitudes)
+    matrix = np.zeros((num_points, num_points), dtype=np.float64)
+    if method == 'geodesic':
+        for i in range(num_points):
+            for j in range(i + 1, num_points):
+                matrix[i, j] = geodesic((latitudes[i], longitudes[i]),
+                                        (latitudes[j], longitudes[j])).km
+        return matrix + matrix.T
+    if method == 'haversine':
+        phi = np.radians(latitudes)
+    else:
+        # Lambert works on the reduced (parametric) latitudes.
+        phi = np.arctan((1 - WGS84_F) * np.tan(np.radians(latitudes)))
+    lam = np.radians(longitudes)
+    for start in range(0, num_points, block_size):
+        stop = min(start + block_size, num_points)
+        phi_1 = phi[start:stop, None]
+        phi_2 = phi[None, start:]
+        sigma = _central_angle(phi_1, lam[start:stop, None], phi_2,
+                               lam[None, start:])
+        if method == 'haversine':
+            block = EARTH_RADIUS_KM * sigma
+        else:
+            block = _lambert_distance(phi_1, phi_2, sigma)
+        # keep only the strict upper triangle of the block.
+        block = np.triu(block, k=1)
+        matrix[start:stop, start:] = block
+    return matrix + matrix.T
+
+
+def distances_to_point(latitudes, longitudes, latitude, longitude,
+                       method=DEFAULT_DISTANCE_METHOD):
+    """ Computes the distances (km) of the points to one point, i.e. one
+    row of great_circle_matrix without building the matrix.
+
+    Parameters
+    ----------
+    latitudes, longitudes : numpy.ndarray
+        The points, in degrees.
+    latitude, longitude : float
+        The point the distances are measured to.
+    method : str
+        One of DISTANCE_METHODS.
+
+    Returns
+    -------
+    numpy.ndarray
+        The distances, one per point.
+    """
+    if method not in DISTANCE_METHODS:
+        raise ValueError("Unknown method '%s'. Choose one of %s."
+                         % (method, ', '.join(DISTANCE_METHODS)))
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    if method == 'geodesic':
+        return np.array([geodesic((lat, lon), (latitude, longitude)).km
+                         for lat, lon in zip(latitudes, longitudes)],
+                        dtype=np.float64)
+    if method == 'haversine':
+        phi = np.radians(latitudes)
+        phi_0 = np.radians(latitude)
+    else:
+        phi = np.arctan((1 - WGS84_F) * np.tan(np.radians(latitudes)))
+        phi_0 = np.arctan((1 - WGS84_F) * np.tan(np.radians(latitude)))
+    sigma = _central_angle(phi, np.radians(longitudes), phi_0,
+                           np.radians(longitude))
+    if method == 'haversine':
+        return EARTH_RADIUS_KM * sigma
+    return _lambert_distance(phi, phi_0, sigma)
+
+
+def _central_angle(phi_1, lam_1, phi_2, lam_2):
+    """ Haversine formula for the central angle (radians)."""
+    hav = (np.sin((phi_2 - phi_1) / 2) ** 2
+           + np.cos(phi_1) * np.cos(phi_2) * np.sin((lam_2 - lam_1) / 2) ** 2)
+    return 2 * np.arcsin(np.sqrt(np.clip(hav, 0, 1)))
+
+
+def _lambert_distance(beta_1, beta_2, sigma):
+    """ Lambert's formula for long lines on the WGS-84 ellipsoid."""
+    p = (beta_1 + beta_2) / 2
+    q = (beta_2 - beta_1) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = ((sigma - np.sin(sigma)) * np.sin(p) ** 2 * np.cos(q) ** 2
+             / np.cos(sigma / 2) ** 2)
+        y = ((sigma + np.sin(sigma)) * np.cos(p) ** 2 * np.sin(q) ** 2
+             / np.sin(sigma / 2) ** 2)
+        distance = WGS84_A_KM * (sigma - WGS84_F / 2 * (x + y))
+    return np.where(sigma > 0, distance, 0.0)
 
 
 def compute_distance(city_a, city_b):
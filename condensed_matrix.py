@@ -0,0 +1,269 @@
+""" Module which contains compact storages of distance matrices.
+
+CondensedMatrix keeps only the strict upper triangle of a symmetric
+matrix, row after row (the scipy pdist layout), in float32 or int32:
+n * (n - 1) / 2 values instead of the n * n python floats of a list of
+lists, which makes a 20k node matrix take 0.8 GB instead of over 12 GB.
+DenseMatrix is the explicit mode for asymmetric matrices, with the same
+interface.
+
+Both support matrix[i, j] (also with index arrays and np.ix_), row(i),
+len() and numpy conversion (np.asarray gives the dense (n, n) array).
+optops.create_routing_model registers them row by row, and a condensed
+matrix of more than optops.MAX_TRANSIT_MATRIX_NODES nodes through a
+callback over its storage, so it is never made dense.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+import numpy as np
+
+
+class CondensedMatrix(object):
+    """ A symmetric matrix with a zero diagonal, stored condensed.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The n * (n - 1) / 2 values of the strict upper triangle, row by
+        row, as returned by scipy.spatial.distance.pdist.
+    size : int
+        n, deduced from len(values) if None.
+    """
+
+    symmetric = True
+
+    def __init__(self, values, size=None):
+        self.values = np.asarray(values)
+        if self.values.ndim != 1:
+            raise ValueError('condensed values must be one dimensional')
+        if size is None:
+            size = int(round((1 + np.sqrt(1 + 8 * len(self.values))) / 2))
+        if size * (size - 1) // 2 != len(self.values):
+            raise ValueError('%d values do not form the upper triangle of a '
+                             'square matrix' % len(self.values))
+        self.size = size
+
+    @classmethod
+    def empty(cls, size, dtype=np.float32):
+        """ Returns a zero matrix of size nodes."""
+        return cls(np.zeros(size * (size - 1) // 2, dtype=dtype), size)
+
+    @classmethod
+    def from_dense(cls, matrix, dtype=np.float32):
+        """ Method to condense a dense symmetric matrix (the lower
+        triangle is ignored).
+        """
+        matrix = np.asarray(matrix)
+        rows, cols = np.triu_indices(len(matrix), k=1)
+        return cls(matrix[rows, cols].astype(dtype), len(matrix))
+
+    @property
+    def shape(self):
+        return (self.size, self.size)
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def __len__(self):
+        return self.size
+
+    def row_offset(self, i):
+        """ Returns the position of the value (i, i + 1) in values."""
+        return i * self.size - i * (i + 1) // 2
+
+    def upper_row(self, i):
+        """ Returns the values (i, i + 1..n) as a view of the storage,
+        e.g. to fill the matrix row by row.
+        """
+        start = self.row_offset(i)
+        return self.values[start:start + self.size - i - 1]
+
+    def _positions(self, i, j):
+        """ Returns the storage positions of the pairs (i, j), -1 on the
+        diagonal.
+        """
+        i, j = np.broadcast_arrays(np.asarray(i, dtype=np.int64),
+                                   np.asarray(j, dtype=np.int64))
+        low, high = np.minimum(i, j), np.maximum(i, j)
+        positions = low * self.size - low * (low + 1) // 2 + high - low - 1
+        return np.where(low == high, -1, positions)
+
+    def __getitem__(self, key):
+        i, j = key
+        if isinstance(i, (int, np.integer)) and isinstance(j, (int,
+                                                               np.integer)):
+            if i == j:
+                return self.values.dtype.type(0)
+            if i > j:
+                i, j = j, i
+            return self.values[self.row_offset(i) + j - i - 1]
+        positions = self._positions(i, j)
+        values = self.values[np.maximum(positions, 0)]
+        values[positions < 0] = 0
+        return values
+
+    def __setitem__(self, key, value):
+        i, j = key
+        positions = self._positions(i, j)
+        if np.any(positions < 0):
+            raise ValueError('the diagonal of a condensed matrix is zero')
+        self.values[positions] = value
+
+    def row(self, i):
+        """ Returns row i (a new array, the part right of the diagonal is
+        a contiguous slice of the storage).
+        """
+        row = np.zeros(self.size, dtype=self.values.dtype)
+        before = np.arange(i)
+        row[:i] = self.values[before * self.size - before * (before + 1) // 2
+                              + i - before - 1]
+        row[i + 1:] = self.upper_row(i)
+        return row
+
+    def to_dense(self, dtype=None):
+        """ Returns the (n, n) array."""
+        dense = np.zeros(self.shape, dtype=dtype or self.values.dtype)
+        rows, cols = np.triu_indices(self.size, k=1)
+        dense[rows, cols] = self.values
+        dense[cols, rows] = self.values
+        return dense
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_dense(dtype)
+
+    def astype(self, dtype):
+        return CondensedMatrix(self.values.astype(dtype), self.size)
+
+    def quantize(self, scale, dtype=np.int32):
+        """ Returns the matrix multiplied by scale and rounded, as used
+        by the routing solver (see optops.quantize_matrix).
+        """
+        return CondensedMatrix(np.rint(self.values * scale).astype(dtype),
+                               self.size)
+
+    def transit_callback(self, manager, scale):
+        """ Returns a transit callback of a routing model over the
+        storage: the quantized distance of two routing indices, read
+        from values on every call (see optops.create_routing_model).
+        """
+        values = self.values
+        size = self.size
+        index_to_node = manager.IndexToNode
+
+        def distance_callback(from_index, to_index):
+            i = index_to_node(from_index)
+            j = index_to_node(to_index)
+            if i == j:
+                return 0
+            if i > j:
+                i, j = j, i
+            position = i * size - i * (i + 1) // 2 + j - i - 1
+            return int(round(float(values[position]) * scale))
+
+        return distance_callback
+
+
+class DenseMatrix(object):
+    """ The dense mode, for matrices which are not symmetric, with the
+    interface of CondensedMatrix.
+    """
+
+    symmetric = False
+
+    def __init__(self, values, dtype=np.float32):
+        self.values = np.ascontiguousarray(values, dtype=dtype)
+        if self.values.ndim != 2 or \
+                self.values.shape[0] != self.values.shape[1]:
+            raise ValueError('a dense matrix must be square, got shape %s'
+                             % (self.values.shape,))
+        self.size = len(self.values)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __setitem__(self, key, value):
+        self.values[key] = value
+
+    def row(self, i):
+        return self.values[i]
+
+    def to_dense(self, dtype=None):
+        return self.values if dtype is None else self.values.astype(dtype)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_dense(dtype)
+
+    def astype(self, dtype):
+        return DenseMatrix(self.values, dtype)
+
+    def quantize(self, scale, dtype=np.int32):
+        return DenseMatrix(np.rint(self.values * scale), dtype)
+
+
+def is_implicit(matrix):
+    """ Returns True for a matrix without storage, one which computes its
+    distances (e.g. grid_distances.GridDistanceMatrix).
+    """
+    return hasattr(matrix, 'transit_callback') and \
+        not isinstance(matrix, CondensedMatrix)
+
+
+def compact_matrix(matrix, dtype=np.float32, symmetric=None, atol=1e-6):
+    """ Method to store a distance matrix compactly.
+
+    Parameters
+    ----------
+    matrix : list or numpy.ndarray
+        The (n, n) distances.
+    dtype : numpy dtype
+        float32 or, for quantized distances, int32.
+    symmetric : bool
+        Condense the matrix. None checks whether it is symmetric.
+    atol : float
+        Absolute tolerance of the symmetry check.
+
+    Returns
+    -------
+    CondensedMatrix or DenseMatrix
+    """
+    if isinstance(matrix, (CondensedMatrix, DenseMatrix)):
+        return matrix.astype(dtype)
+    matrix = np.asarray(matrix)
+    if symmetric is None:
+        symmetric = np.allclose(matrix, matrix.T, rtol=0, atol=atol)
+    if symmetric:
+        return CondensedMatrix.from_dense(matrix, dtype)
+    return DenseMatrix(matrix, dtype)
+
+
+def as_matrix(matrix):
+    """ Returns a list of lists as a numpy array and any other matrix
+    (numpy, compact or implicit) as it is, so that matrix[i, j] and
+    np.ix_ indexing work on all of them without building the dense form
+    of a compact one.
+    """
+    if isinstance(matrix, (list, tuple)):
+        return np.asarray(matrix)
+    return matrix
@@ -0,0 +1,275 @@
+""" Module which solves big VRP instances cluster-first, route-second.
+
+The customers are split into one cluster per vehicle (sweep around the
+depot, k-means or, when only the matrix is known, nearest of spread out
+medoids), every cluster is solved as an independent TSP in a worker
+process, and the routes are stitched back together. An optional bounded
+improvement pass over the whole model polishes the stitched solution.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from concurrent.futures import ProcessPoolExecutor
+from scipy.cluster.vq import kmeans2
+import time
+import numpy as np
+import condensed_matrix
+import optops
+
+
+CLUSTER_METHODS = ('sweep', 'kmeans', 'medoids')
+
+
+def cluster_nodes(data, num_clusters, method='sweep', points=None, seed=0):
+    """ Method to partition the customers (every node but the depot).
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model (distance_matrix, num_vehicles, depot).
+    num_clusters : int
+    method : str
+        'sweep' and 'kmeans' need the coordinates of the nodes,
+        'medoids' only uses the distance matrix.
+    points : numpy.ndarray
+        (n, 2) coordinates of the nodes. Defaults to data['points'].
+    seed : int
+        Seed of k-means.
+
+    Returns
+    -------
+    clusters : list
+        num_clusters lists of node ids (some may be empty, e.g. when
+        there are fewer customers than clusters).
+    """
+    if method not in CLUSTER_METHODS:
+        raise ValueError("Unknown method '%s'. Choose one of %s."
+                         % (method, ', '.join(CLUSTER_METHODS)))
+    depot = data['depot']
+    num_nodes = len(data['distance_matrix'])
+    customers = np.array([n for n in range(num_nodes) if n != depot])
+    if points is None:
+        points = data.get('points')
+    if method != 'medoids' and points is None:
+        raise ValueError("method '%s' needs the coordinates of the nodes"
+                         % method)
+    if len(customers) == 0:
+        return [[] for _ in range(num_clusters)]
+    if method == 'sweep':
+        points = np.asarray(points, dtype=np.float64)
+        offsets = points[customers] - points[depot]
+        order = customers[np.argsort(np.arctan2(offsets[:, 1],
+                                                offsets[:, 0]),
+                                     kind='stable')]
+        return [chunk.tolist() for chunk in
+                np.array_split(order, num_clusters)]
+    if method == 'kmeans':
+        points = np.asarray(points, dtype=np.float64)
+        _, labels = kmeans2(points[customers],
+                            min(num_clusters, len(customers)), minit='++',
+                            seed=seed)
+    else:
+        labels = _medoid_labels(
+            condensed_matrix.as_matrix(data['distance_matrix']), customers,
+            num_clusters)
+    return [customers[labels == c].tolist() for c in range(num_clusters)]
+
+
+def _medoid_labels(matrix, customers, num_clusters):
+    """ Assigns every customer to the nearest of num_clusters medoids
+    picked farthest-first.
+    """
+    distances = matrix[np.ix_(customers, customers)]
+    medoids = [int(np.argmax(distances.sum(axis=1)))]
+    while len(medoids) < min(num_clusters, len(customers)):
+        nearest = distances[:, medoids].min(axis=1)
+        medoids.append(int(np.argmax(nearest)))
+    return np.argmin(distances[:, medoids], axis=1)
+
+
+def solve_decomposed(data, method='sweep', points=None, time_limit=10,
+                     num_workers=None, scale=optops.DEFAULT_DISTANCE_SCALE,
+                     max_route_distance=None, polish_time=0,
+                     local_search_metaheuristic='GUIDED_LOCAL_SEARCH'):
+    """ Method to solve a VRP cluster-first, route-second.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model (distance_matrix, num_vehicles, depot).
+    method : str
+        See cluster_nodes.
+    points : numpy.ndarray
+        See cluster_nodes.
+    time_limit : float
+        Search time limit (seconds) of every cluster.
+    num_workers : int
+        Number of worker processes, defaults to the cpu count.
+    scale, max_route_distance
+        See optops.create_routing_model.
+    polish_time : float
+        If positive, the stitched routes are improved by a search over
+        the whole model limited to this many seconds.
+    local_search_metaheuristic : str
+        See optops.create_search_parameters.
+
+    Returns
+    -------
+    result : dictionary
+        'routes' (vehicle_id: nodes), 'distance' (total route length in
+        the units of the matrix), 'clusters', 'timings' (seconds) and
+        'infeasible', the vehicles whose route is longer than
+        max_route_distance (a cluster no feasible route was found for
+        is visited in order).
+    """
+    timings = {}
+    start = time.time()
+    clusters = cluster_nodes(data, data['num_vehicles'], method, points)
+    timings['cluster'] = time.time() - start
+    matrix = condensed_matrix.as_matrix(data['distance_matrix'])
+    depot = data['depot']
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = []
+        for cluster in clusters:
+            nodes = [depot] + cluster
+            futures.append(executor.submit(
+                _solve_cluster, matrix[np.ix_(nodes, nodes)], scale,
+                max_route_distance, time_limit, local_search_metaheuristic))
+        routes = {}
+        for vehicle_id, (cluster, future) in enumerate(zip(clusters,
+                                                           futures)):
+            nodes = [depot] + cluster
+            local_route = future.result()
+            if local_route is None:
+                # the cluster alone is infeasible, visit it in order.
+                local_route = list(range(len(nodes))) + [0]
+            routes[vehicle_id] = [nodes[n] for n in local_route]
+    timings['solve'] = time.time() - start
+    if polish_time > 0:
+        start = time.time()
+        polished = _polish(data, routes, scale, max_route_distance,
+                           polish_time, local_search_metaheuristic)
+        if polished is not None:
+            routes = polished
+        timings['polish'] = time.time() - start
+    infeasible = []
+    if max_route_distance is not None:
+        infeasible = [vehicle_id for vehicle_id, route in sorted(
+            routes.items()) if routes_distance(data, {vehicle_id: route})
+            > max_route_distance]
+    return {'routes': routes, 'distance': routes_distance(data, routes),
+            'clusters': clusters, 'timings': timings,
+            'infeasible': infeasible}
+
+
+def _solve_cluster(matrix, scale, max_route_distance, time_limit,
+                   local_search_metaheuristic):
+    """ Solves one cluster (depot at 0) as a TSP, run in the workers.
+
+    Returns
+    -------
+    list
+        The route in local node ids, None if no solution was found.
+    """
+    if len(matrix) <= 2:
+        return list(range(len(matrix))) + [0]
+    data = optops.create_data_model(matrix, 1)
+    manager, routing, _ = optops.create_routing_model(
+        data, scale=scale, max_route_distance=max_route_distance)
+    search_parameters = optops.create_search_parameters(
+        local_search_metaheuristic=local_search_metaheuristic,
+        time_limit=time_limit)
+    solution = routing.SolveWithParameters(search_parameters)
+    if not solution:
+        return None
+    index = routing.Start(0)
+    route = []
+    while not routing.IsEnd(index):
+        route.append(manager.IndexToNode(index))
+        index = solution.Value(routing.NextVar(index))
+    route.append(manager.IndexToNode(index))
+    return route
+
+
+def _polish(data, routes, scale, max_route_distance, polish_time,
+            local_search_metaheuristic):
+    """ Improves the stitched routes with a time bounded search over the
+    whole model, returns None if the routes could not be loaded.
+    """
+    manager, routing, _ = optops.create_routing_model(
+        data, scale=scale, max_route_distance=max_route_distance)
+    search_parameters = optops.create_search_parameters(
+        local_search_metaheuristic=local_search_metaheuristic,
+        time_limit=polish_time)
+    routing.CloseModelWithParameters(search_parameters)
+    initial = routing.ReadAssignmentFromRoutes(
+        [route[1:-1] for _, route in sorted(routes.items())], True)
+    if initial is None:
+        return None
+    solution = routing.SolveFromAssignmentWithParameters(initial,
+                                                         search_parameters)
+    if not solution:
+        return None
+    return optops.get_all_routes(data, manager, routing, solution)
+
+
+def routes_distance(data, routes):
+    """ Returns the total length of the routes in the units of the
+    matrix.
+    """
+    matrix = condensed_matrix.as_matrix(data['distance_matrix'])
+    total = 0.0
+    for route in routes.values():
+        route = np.asarray(route)
+        total += float(matrix[route[:-1], route[1:]].sum())
+    return total
+
+
+def compare_with_monolithic(data, time_limit=10, **kwargs):
+    """ Method to measure the objective gap of the decomposition against
+    a monolithic solve, on instances small enough for both.
+
+    The monolithic search gets the same time limit as one cluster plus
+    the polish time.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model.
+    time_limit : float
+        See solve_decomposed.
+    kwargs
+        Passed to solve_decomposed.
+
+    Returns
+    -------
+    report : dictionary
+        'decomposed' and 'monolithic' distances and wall times, and
+        'gap', the relative excess of the decomposed distance.
+    """
+    start = time.time()
+    decomposed = solve_decomposed(data, time_limit=time_limit, **kwargs)
+    decomposed_time = time.time() - start
+    start = time.time()
+    manager, routing, _ = optops.create_routing_model(
+        data, scale=kwargs.get('scale', optops.DEFAULT_DISTANCE_SCALE),
+        max_route_distance=kwargs.get('max_route_distance'))
+    search_parameters = optops.create_search_parameters(
+        local_search_metaheuristic=kwargs.get('local_search_metaheuristic',
+                                              'GUIDED_LOCAL_SEARCH'),
+        time_limit=time_limit + kwargs.get('polish_time', 0))
+    solution = routing.SolveWithParameters(search_parameters)
+    monolithic_time = time.time() - start
+    report = {'decomposed': decomposed['distance'],
+              'decomposed_time': decomposed_time,
+              'monolithic': None, 'monolithic_time': monolithic_time,
+              'gap': None}
+    if solution:
+        routes = optops.get_all_routes(data, manager, routing, solution)
+        report['monolithic'] = routes_distance(data, routes)
+        if report['monolithic'] > 0:
+            report['gap'] = (report['decomposed'] / report['monolithic']
+                             - 1)
+    return report
@@ -0,0 +1,244 @@
+""" Module which keeps a routing instance alive between changes, for
+dispatching where stops are added and removed all day.
+
+A DynamicSession holds the stops, their distance matrix and the current
+routes. Adding a stop computes one row of distances, removing one moves
+the last stop into its slot, and every solve starts from the previous
+routes (with new stops inserted at their cheapest position) under a
+short time limit.
+
+    session = DynamicSession((0, 0), num_vehicles=3)
+    session.add_stop('order-1', (3, 4))
+    session.solve()
+    session.remove_stop('order-1')
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+import time
+import numpy as np
+import city_ops
+import optops
+
+
+# metrics of the stop locations: planar (x, y) or (latitude, longitude)
+# in degrees with one of the city_ops distance methods.
+SESSION_METRICS = ('euclidean',) + city_ops.DISTANCE_METHODS
+
+
+class DynamicSession(object):
+    """ A routing instance which is changed and re-solved in place.
+
+    Parameters
+    ----------
+    depot : tuple
+        Location of the depot (node 0).
+    num_vehicles : int
+    metric : str
+        One of SESSION_METRICS.
+    geocoder : object
+        Used by add_stop to locate stops given by name only (see
+        city_ops.geocode_cities).
+    scale, max_route_distance
+        See optops.create_routing_model.
+    time_limit : float
+        Default search time limit (seconds) of solve.
+    local_search_metaheuristic : str
+        See optops.create_search_parameters.
+    """
+
+    def __init__(self, depot, num_vehicles, metric='euclidean', geocoder=None,
+                 scale=optops.DEFAULT_DISTANCE_SCALE, max_route_distance=None,
+                 time_limit=0.2,
+                 local_search_metaheuristic='GUIDED_LOCAL_SEARCH'):
+        if metric not in SESSION_METRICS:
+            raise ValueError("Unknown metric '%s'. Choose one of %s."
+                             % (metric, ', '.join(SESSION_METRICS)))
+        self.num_vehicles = num_vehicles
+        self.metric = metric
+        self.geocoder = geocoder
+        self.scale = scale
+        self.max_route_distance = max_route_distance
+        self.time_limit = time_limit
+        self.local_search_metaheuristic = local_search_metaheuristic
+        self.keys = ['depot']
+        self.index = {'depot': 0}
+        self.coords = np.zeros((16, 2), dtype=np.float64)
+        self.coords[0] = depot
+        self.matrix = np.zeros((16, 16), dtype=np.float64)
+        # routes without the depot, node ids of the current stops.
+        self.routes = [[] for _ in range(num_vehicles)]
+        self.objective = None
+        self.last_solve = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @property
+    def distance_matrix(self):
+        """ The (n, n) distances of the current stops (a view)."""
+        size = len(self.keys)
+        return self.matrix[:size, :size]
+
+    @property
+    def locations(self):
+        return self.coords[:len(self.keys)]
+
+    def add_stop(self, key, location=None):
+        """ Method to add a stop, which is inserted into the current
+        routes where it lengthens them the least.
+
+        Parameters
+        ----------
+        key : hashable
+            Name of the stop, geocoded if location is None.
+        location : tuple
+            (x, y) or (latitude, longitude) of the stop.
+
+        Returns
+        -------
+        int
+            The node id of the stop.
+        """
+        if key in self.index:
+            raise ValueError('stop %r already exists' % (key,))
+        if location is None:
+            if self.geocoder is None:
+                raise ValueError('stop %r has no location and the session '
+                                 'has no geocoder' % (key,))
+            found = city_ops.geocode_cities([key], self.geocoder)[0]
+            if found is None:
+                raise ValueError('could not geocode %r' % (key,))
+            location = (found.latitude, found.longitude)
+        size = len(self.keys)
+        self._reserve(size + 1)
+        distances = self._distances_to(location)
+        self.coords[size] = location
+        self.matrix[size, :size] = distances
+        self.matrix[:size, size] = distances
+        self.matrix[size, size] = 0
+        self.keys.append(key)
+        self.index[key] = size
+        self._insert_cheapest(size)
+        return size
+
+    def add_stops(self, stops):
+        """ Method to add (key, location) pairs, see add_stop."""
+        return [self.add_stop(key, location) for key, location in stops]
+
+    def remove_stop(self, key):
+        """ Method to remove a stop from the instance and its route. The
+        last stop takes over the node id of the removed one.
+        """
+        if key == 'depot':
+            raise ValueError('the depot can not be removed')
+        node = self.index.pop(key)
+        last = len(self.keys) - 1
+        for route in self.routes:
+            if node in route:
+                route.remove(node)
+                break
+        if node != last:
+            self.coords[node] = self.coords[last]
+            self.matrix[node, :last] = self.matrix[last, :last]
+            self.matrix[:last, node] = self.matrix[:last, last]
+            self.matrix[node, node] = 0
+            moved = self.keys[last]
+            self.keys[node] = moved
+            self.index[moved] = node
+            for route in self.routes:
+                if last in route:
+                    route[route.index(last)] = node
+                    break
+        self.keys.pop()
+        self.objective = None
+
+    def solve(self, time_limit=None):
+        """ Method to re-plan the routes, starting from the current ones.
+
+        Returns
+        -------
+        route_set.RouteSet
+            The new routes (node ids, see keys for the stops), None if
+            no solution was found; the current routes are then kept.
+        """
+        start = time.time()
+        data = optops.create_data_model(self.distance_matrix,
+                                        self.num_vehicles)
+        manager, routing, _ = optops.create_routing_model(
+            data, scale=self.scale,
+            max_route_distance=self.max_route_distance)
+        search_parameters = optops.create_search_parameters(
+            local_search_metaheuristic=self.local_search_metaheuristic,
+            time_limit=self.time_limit if time_limit is None else time_limit)
+        routing.CloseModelWithParameters(search_parameters)
+        initial = routing.ReadAssignmentFromRoutes(self.routes, True)
+        if initial is None:
+            solution = routing.SolveWithParameters(search_parameters)
+        else:
+            solution = routing.SolveFromAssignmentWithParameters(
+                initial, search_parameters)
+        self.last_solve = {'seconds': time.time() - start,
+                           'warm_start': initial is not None,
+                           'stops': len(self.keys) - 1}
+        if not solution:
+            return None
+        routes = optops.get_route_set(data, manager, routing, solution)
+        self.routes = [route[1:-1].tolist() for route in routes]
+        self.objective = routes.objective
+        return routes
+
+    def named_routes(self):
+        """ Returns the current routes as lists of stop keys, depot
+        included at both ends.
+        """
+        return [['depot'] + [self.keys[n] for n in route] + ['depot']
+                for route in self.routes]
+
+    def _reserve(self, size):
+        """ Grows the buffers (doubling) so they hold size stops."""
+        capacity = len(self.coords)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        coords = np.zeros((capacity, 2), dtype=np.float64)
+        coords[:len(self.coords)] = self.coords
+        matrix = np.zeros((capacity, capacity), dtype=np.float64)
+        old = len(self.matrix)
+        matrix[:old, :old] = self.matrix
+        self.coords, self.matrix = coords, matrix
+
+    def _distances_to(self, location):
+        points = self.coords[:len(self.keys)]
+        if self.metric == 'euclidean':
+            offsets = points - np.asarray(location, dtype=np.float64)
+            return np.hypot(offsets[:, 0], offsets[:, 1])
+        return city_ops.distances_to_point(points[:, 0], points[:, 1],
+                                           location[0], location[1],
+                                           self.metric)
+
+    def _insert_cheapest(self, node):
+        """ Inserts node into the current routes at the position which
+        lengthens them the least, keeping max_route_distance if it can.
+        """
+        matrix = self.matrix
+        best = None
+        for vehicle_id, route in enumerate(self.routes):
+            path = np.array([0] + route + [0])
+            before, after = path[:-1], path[1:]
+            extra = matrix[before, node] + matrix[node, after] - \
+                matrix[before, after]
+            position = int(np.argmin(extra))
+            length = matrix[before, after].sum() + extra[position]
+            feasible = (self.max_route_distance is None
+                        or length <= self.max_route_distance)
+            candidate = (not feasible, extra[position], vehicle_id, position)
+            if best is None or candidate < best:
+                best = candidate
+        self.routes[best[2]].insert(best[3], node)
+        self.objective = None
@@ -0,0 +1,196 @@
+""" Module which solves one instance for a range of fleet sizes (and
+maximum route distances) in parallel, to pick the fleet from the Pareto
+frontier of total distance, longest route and vehicles used.
+
+The model is quantized once (see optops.quantize_model) and written to
+a binary model file, every worker maps its matrix read-only (see
+optops.read_model_from_binary) instead of receiving a pickled copy per
+run, and registers it without float or int copies. A condensed matrix
+stays condensed (int32) in the file, and an implicit one (e.g.
+grid_distances.GridDistanceMatrix), which has no storage, is passed to
+the workers as it is. Each worker still builds the python list of
+lists RegisterTransitMatrix takes for a matrix of up to
+optops.MAX_TRANSIT_MATRIX_NODES nodes, and or tools keeps its own dense
+copy, so the memory of such a sweep still grows with the number of
+workers times n * n.
+
+    sweep = fleet_sweep.sweep_fleet(data, range(1, 9), [3000, 6000])
+    print(fleet_sweep.format_frontier(sweep['frontier']))
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import itertools
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import condensed_matrix
+import optops
+import search_budget
+
+
+# the objectives of the frontier, all minimized.
+FRONTIER_KEYS = ('total_distance', 'max_distance', 'vehicles_used')
+# the model of the sweep inside a worker, loaded by its initializer.
+_worker_model = None
+
+
+def sweep_fleet(data, vehicle_counts, max_route_distances=(None,),
+                num_workers=None, scale=optops.DEFAULT_DISTANCE_SCALE,
+                time_limit=10, stagnation_window=2,
+                local_search_metaheuristic='GUIDED_LOCAL_SEARCH'):
+    """ Method to solve a model for every combination of a fleet size and
+    a maximum route distance.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model, its num_vehicles is ignored.
+    vehicle_counts : iterable
+        The fleet sizes to solve for.
+    max_route_distances : iterable
+        The caps of the distance dimension, None for no cap.
+    num_workers : int
+        Number of worker processes, defaults to the cpu count.
+    scale : float
+        See optops.create_routing_model.
+    time_limit, stagnation_window
+        The search budget of every run, see search_budget.SearchBudget.
+    local_search_metaheuristic : str
+        See optops.create_search_parameters.
+
+    Returns
+    -------
+    sweep : dictionary
+        'runs', one dictionary per combination (vehicles,
+        max_route_distance, status, objective, total_distance,
+        max_distance, vehicles_used, routes, stop_reason, solve_time),
+        'frontier', the non-dominated solved runs sorted by vehicles
+        used, and 'wall_time' (s).
+    """
+    start = time.time()
+    combinations = list(itertools.product(vehicle_counts,
+                                          max_route_distances))
+    model_dir = tempfile.mkdtemp(prefix='fleet_sweep_')
+    model_file = os.path.join(model_dir, 'model.lpm')
+    try:
+        model = optops.quantize_model(data, scale)
+        if not condensed_matrix.is_implicit(model['distance_matrix']):
+            optops.write_model_to_binary(model, model_file)
+            model = model_file
+        with ProcessPoolExecutor(max_workers=num_workers,
+                                 initializer=_load_worker_model,
+                                 initargs=(model,)) as executor:
+            futures = [executor.submit(
+                _solve_fleet, vehicles, max_route_distance, scale,
+                time_limit, stagnation_window, local_search_metaheuristic)
+                for vehicles, max_route_distance in combinations]
+            runs = [future.result() for future in futures]
+    finally:
+        shutil.rmtree(model_dir, ignore_errors=True)
+    return {'runs': runs, 'frontier': pareto_frontier(runs),
+            'wall_time': time.time() - start}
+
+
+def pareto_frontier(runs, keys=FRONTIER_KEYS):
+    """ Method to keep the solved runs no other run dominates: none is at
+    least as good in all the keys and better in one. Of runs with equal
+    values (e.g. fleets larger than the vehicles they use) the first
+    one is kept.
+
+    Returns
+    -------
+    frontier : list
+        The runs of the frontier, sorted by the keys.
+    """
+    solved, seen = [], set()
+    for run in runs:
+        if run['status'] != 'solved':
+            continue
+        point = tuple(run[key] for key in keys)
+        if point not in seen:
+            seen.add(point)
+            solved.append(run)
+    if not solved:
+        return []
+    values = np.array([[run[key] for key in keys] for run in solved],
+                      dtype=np.float64)
+    no_worse = (values[:, None, :] <= values[None, :, :]).all(axis=2)
+    better = (values[:, None, :] < values[None, :, :]).any(axis=2)
+    dominated = (no_worse & better).any(axis=0)
+    frontier = [run for run, out in zip(solved, dominated) if not out]
+    return sorted(frontier, key=lambda run: tuple(run[key] for key in keys))
+
+
+def format_frontier(frontier, unit='m'):
+    """ Method to build a printable table of the frontier."""
+    lines = ['{:>8} {:>10} {:>14} {:>14}'.format(
+        'vehicles', 'cap', 'total ({})'.format(unit),
+        'longest ({})'.format(unit))]
+    for run in frontier:
+        cap = run['max_route_distance']
+        lines.append('{:>8} {:>10} {:>14.2f} {:>14.2f}'.format(
+            run['vehicles_used'], '-' if cap is None else cap,
+            run['total_distance'], run['max_distance']))
+    return '\n'.join(lines)
+
+
+def write_sweep_to_file(runs, a_file):
+    """ Method to write the runs of a sweep to a csv file, one line per
+    combination, with a column telling whether it is on the frontier.
+    """
+    frontier = set(id(run) for run in pareto_frontier(runs))
+    fields = ['vehicles', 'max_route_distance', 'status', 'objective',
+              'total_distance', 'max_distance', 'vehicles_used',
+              'stop_reason', 'solve_time']
+    with open(a_file, 'w', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(fields + ['pareto'])
+        for run in runs:
+            writer.writerow([run[field] for field in fields]
+                            + [id(run) in frontier])
+
+
+def _load_worker_model(model):
+    """ Initializer of the workers, maps the model file of the sweep, or
+    keeps the model itself when its matrix is implicit.
+    """
+    global _worker_model
+    if isinstance(model, str):
+        model = optops.read_model_from_binary(model, mmap=True)
+    _worker_model = model
+
+
+def _solve_fleet(vehicles, max_route_distance, scale, time_limit,
+                 stagnation_window, local_search_metaheuristic):
+    """ Solves the model of the worker for one combination."""
+    data = dict(_worker_model)
+    data['num_vehicles'] = vehicles
+    run = {'vehicles': vehicles, 'max_route_distance': max_route_distance,
+           'status': 'no solution', 'objective': None,
+           'total_distance': None, 'max_distance': None,
+           'vehicles_used': None, 'routes': None, 'stop_reason': None}
+    start = time.time()
+    manager, routing, _ = optops.create_routing_model(
+        data, scale=scale, max_route_distance=max_route_distance)
+    search_parameters = optops.create_search_parameters(
+        local_search_metaheuristic=local_search_metaheuristic)
+    budget = search_budget.SearchBudget(time_limit=time_limit,
+                                        stagnation_window=stagnation_window)
+    solution = budget.solve(routing, search_parameters)
+    run['solve_time'] = time.time() - start
+    run['stop_reason'] = budget.stop_reason
+    if solution:
+        routes = optops.get_route_set(data, manager, routing, solution)
+        stats = routes.stats()
+        run.update(status='solved', objective=solution.ObjectiveValue(),
+                   total_distance=stats['total_distance'],
+                   max_distance=stats['max_distance'],
+                   vehicles_used=stats['vehicles_used'],
+                   routes=routes.to_dict())
+    return run
@@ -0,0 +1,250 @@
+""" Module which contains a persistent geocoding cache for the city
+operations, so that repeated runs over the same city names need no
+network round-trips.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+import csv
+import os
+import sqlite3
+import time
+
+
+# default location of the on-disk cache, can be overridden through the
+# environment.
+DEFAULT_CACHE_FILE = os.environ.get('LP_GEOCODE_CACHE',
+                                    'geocode_cache.sqlite')
+
+# a minimal stand-in for geopy's Location, enough for city_ops.
+Location = namedtuple('Location', ['address', 'latitude', 'longitude'])
+
+
+def normalize_name(name):
+    """ Method to normalize a city name so it can be used as a key.
+
+    Parameters
+    ----------
+    name : str
+        The city name as read from a file (may contain newlines etc).
+
+    Returns
+    -------
+    str
+        The name stripped, with collapsed whitespace and casefolded.
+    """
+    return ' '.join(name.split()).casefold()
+
+
+class GeocodeCache(object):
+    """ SQLite store of geocoded locations keyed by normalized name.
+
+    Parameters
+    ----------
+    path : str
+        The sqlite file. ':memory:' keeps the cache in memory only.
+    ttl : float
+        Seconds after which an entry is considered stale. None means
+        that entries never expire.
+    max_entries : int
+        Maximum number of entries kept. The least recently used ones
+        are evicted first. None means no limit.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_FILE, ttl=None, max_entries=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS locations ("
+            " name TEXT PRIMARY KEY,"
+            " address TEXT,"
+            " latitude REAL NOT NULL,"
+            " longitude REAL NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)")
+        self.conn.commit()
+
+    def get_many(self, names):
+        """ Method to look up many names with a single query.
+
+        Parameters
+        ----------
+        names : list
+            A list of city names (not necessarily normalized).
+
+        Returns
+        -------
+        found : dictionary
+            normalized name: Location pairs for the fresh entries only.
+        """
+        keys = sorted(set(normalize_name(n) for n in names))
+        if not keys:
+            return {}
+        now = time.time()
+        found = {}
+        # sqlite limits the number of host parameters per statement.
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.conn.execute(
+                "SELECT name, address, latitude, longitude, created"
+                " FROM locations WHERE name IN (%s)"
+                % ','.join('?' * len(chunk)), chunk).fetchall()
+            for name, address, lat, lon, created in rows:
+                if self.ttl is not None and now - created > self.ttl:
+                    continue
+                found[name] = Location(address, lat, lon)
+        if found:
+            self.conn.executemany(
+                "UPDATE locations SET accessed = ? WHERE name = ?",
+                [(now, name) for name in found])
+            self.conn.commit()
+        return found
+
+    def get(self, name):
+        """ Method to look up a single name, returns None on a miss."""
+        return self.get_many([name]).get(normalize_name(name))
+
+    def put_many(self, locations):
+        """ Method to store many locations at once.
+
+        Parameters
+        ----------
+        locations : dictionary
+            name: location pairs. A location is any object with
+            latitude and longitude attributes (and optionally address).
+        """
+        now = time.time()
+        rows = [(normalize_name(name), getattr(loc, 'address', None),
+                 loc.latitude, loc.longitude, now, now)
+                for name, loc in locations.items() if loc is not None]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO locations"
+            " (name, address, latitude, longitude, created, accessed)"
+            " VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+        if self.max_entries is not None:
+            self.evict()
+
+    def put(self, name, location):
+        """ Method to store a single location."""
+        self.put_many({name: location})
+
+    def evict(self):
+        """ Method to remove the expired entries and, if the cache is
+        over max_entries, the least recently used ones.
+
+        Returns
+        -------
+        int
+            The number of removed entries.
+        """
+        removed = 0
+        if self.ttl is not None:
+            removed += self.conn.execute(
+                "DELETE FROM locations WHERE created < ?",
+                (time.time() - self.ttl,)).rowcount
+        if self.max_entries is not None:
+            removed += self.conn.execute(
+                "DELETE FROM locations WHERE name NOT IN ("
+                " SELECT name FROM locations"
+                " ORDER BY accessed DESC LIMIT ?)",
+                (self.max_entries,)).rowcount
+        self.conn.commit()
+        return removed
+
+    def clear(self):
+        """ Method to remove every entry of the cache."""
+        self.conn.execute("DELETE FROM locations")
+        self.conn.commit()
+
+    def __len__(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM locations").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class FixtureGeocoder(object):
+    """ Offline geocoder which answers from a fixed name: (lat, lon)
+    table. It can replace Nominatim in tests and offline runs.
+
+    Parameters
+    ----------
+    locations : dictionary
+        name: (latitude, longitude) pairs.
+    """
+
+    def __init__(self, locations):
+        self.locations = {}
+        for name, (lat, lon) in locations.items():
+            self.locations[normalize_name(name)] = Location(
+                name.strip(), float(lat), float(lon))
+
+    @classmethod
+    def from_csv(cls, a_file):
+        """ Method to build the geocoder from a csv file with lines of
+        the form name,latitude,longitude.
+        """
+        locations = {}
+        with open(a_file, 'r') as f:
+            for row in csv.reader(f):
+                if len(row) >= 3:
+                    locations[row[0]] = (row[1], row[2])
+        return cls(locations)
+
+    def geocode(self, name):
+        """ Returns the Location of name or None if it is unknown."""
+        return self.locations.get(normalize_name(name))
+
+
+class CachedGeocoder(object):
+    """ Geocoder which answers from a GeocodeCache and only asks the
+    backend geocoder for the misses, writing them through to the cache.
+
+    Parameters
+    ----------
+    backend : object
+        Any object with a geocode(name) method (Nominatim,
+        FixtureGeocoder, ...). It is only called on cache misses.
+    cache : GeocodeCache
+        The persistent store.
+    """
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+
+    def geocode_many(self, names):
+        """ Method to geocode many names, hitting the backend only once
+        per distinct missing name.
+
+        Parameters
+        ----------
+        names : list
+            A list of city names.
+
+        Returns
+        -------
+        locations : list
+            The locations in the order of names (None where the backend
+            could not resolve a name).
+        """
+        found = self.cache.get_many(names)
+        missing = {}
+        for name in names:
+            key = normalize_name(name)
+            if key not in found and key not in missing:
+                missing[key] = self.backend.geocode(name.strip())
+        if missing:
+            self.cache.put_many(missing)
+            found.update(missing)
+        return [found.get(normalize_name(name)) for name in names]
+
+    def geocode(self, name):
+        """ Method to geocode a single name."""
+        return self.geocode_many([name])[0]
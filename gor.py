@@ -2,13 +2,13 @@
 """Simple travelling salesman problem between cities."""
 
 from __future__ import print_function
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
 import pdb
 import os
 import sys
 #sys.path.append("../LP_projects")
 import city_ops
+import optops
+import tracing
 import csv
 
 
@@ -21,26 +21,16 @@ def create_data_model(city_names):
     return data
 
 
-def print_solution(manager, routing, solution, city_names):
+def print_solution(data, manager, routing, solution, city_names):
     """Prints solution on console."""
-    path_list = []
-    print('Objective: {} miles'.format(solution.ObjectiveValue()))
-    index = routing.Start(0)
-    plan_output = 'Route for vehicle 0:\n'
-    route_distance = 0
+    routes = optops.get_route_set(data, manager, routing, solution)
+    print('Objective: {} miles'.format(routes.objective))
     city_names_dict = create_city_names_dict(city_names)
-    while not routing.IsEnd(index):
-        plan_output += ' {} ->'.format(city_names_dict[manager.IndexToNode(index)])
-        path_list.append(city_names_dict[manager.IndexToNode(index)])
-        previous_index = index
-        index = solution.Value(routing.NextVar(index))
-        route_distance += routing.GetArcCostForVehicle(previous_index, index, 0)
-    plan_output += ' {}\n'.format(city_names_dict[manager.IndexToNode(index)])
-    print(plan_output)
-    plan_output += 'Route distance: {}miles\n'.format(route_distance)
-    path_list.append(city_names_dict[manager.IndexToNode(index)])
+    path_list = [city_names_dict[n] for n in routes.route(0).tolist()]
+    print('Route for vehicle 0:\n {}\n'.format(' ->'.join(path_list)))
     print(path_list)
     write_results_to_csv(path_list)
+    return routes
 
 
 def write_results_to_csv(path_list):
@@ -67,43 +57,38 @@ def read_cities_from_file(a_file):
     return cities_list
 
 
-def main():
-    """Entry point of the program."""
+def main(local_search_metaheuristic=None, budget=None):
+    """Entry point of the program.
+
+    The search stops at the first local optimum unless a
+    local_search_metaheuristic (e.g. 'GUIDED_LOCAL_SEARCH') is given,
+    which then needs a budget (a search_budget.SearchBudget) to stop.
+    """
     # Instantiate the data problem.
     city_names = read_cities_from_file(sys.argv[1])
     data = create_data_model(city_names)
 
-    # Create the routing index manager.
-    manager = pywrapcp.RoutingIndexManager(len(data['distance_matrix']),
-                                           data['num_vehicles'], data['depot'])
-
-    # Create Routing Model.
-    routing = pywrapcp.RoutingModel(manager)
-
-
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-
-    # Define cost of each arc.
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    # Create the routing index manager and model.
+    manager, routing, transit_callback_index = optops.create_routing_model(
+        data)
 
-    # Setting first solution heuristic.
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+    # Setting first solution heuristic, and the metaheuristic if any.
+    search_parameters = optops.create_search_parameters(
+        'PATH_CHEAPEST_ARC', local_search_metaheuristic)
 
-    # Solve the problem.
-    solution = routing.SolveWithParameters(search_parameters)
+    # Solve the problem, under the budget if one is given.
+    if budget is None:
+        with tracing.span('search'):
+            solution = routing.SolveWithParameters(search_parameters)
+            tracing.record_solver_stats(routing)
+    else:
+        solution = budget.solve(routing, search_parameters)
+        print(budget.describe())
 
     # Print solution on console.
     if solution:
-        print_solution(manager, routing, solution, city_names)
+        with tracing.span('report'):
+            print_solution(data, manager, routing, solution, city_names)
 
 
 if __name__ == '__main__':
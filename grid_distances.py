@@ -0,0 +1,242 @@
+""" Module which contains the implicit distance matrix of a regular grid.
+
+On the lattice of optops.create_simple_grid node k sits at
+(k // y_dim, k % y_dim) * spacing, so the distance of two nodes is a
+closed form of their ids and nothing needs to be stored. A
+GridDistanceMatrix can stand in for data['distance_matrix'] (see
+optops.create_routing_model), which lets grid experiments grow to
+hundreds of thousands of cells.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+import functools
+import numpy as np
+import optops
+
+
+GRID_METRICS = ('euclidean', 'manhattan')
+# distinct (dx, dy) offsets kept by the cache of the transit callback.
+DEFAULT_CACHE_SIZE = 1 << 16
+# lattice distance (in rows/columns) of the successors solve_implicit_grid
+# allows every node.
+DEFAULT_NEIGHBOR_RADIUS = 2
+
+
+class GridDistanceMatrix(object):
+    """ Distances between the nodes of an x_dim by y_dim grid, computed
+    from the node ids on demand.
+
+    Parameters
+    ----------
+    x_dim, y_dim : int
+        Dimensions of the grid, see optops.create_simple_grid.
+    spacing : float
+        Distance of two neighbouring nodes.
+    metric : str
+        One of GRID_METRICS.
+    cache_size : int
+        Size of the LRU cache of the transit callback.
+    """
+
+    dtype = np.dtype(np.float64)
+
+    def __init__(self, x_dim, y_dim, spacing=1.0, metric='euclidean',
+                 cache_size=DEFAULT_CACHE_SIZE):
+        if metric not in GRID_METRICS:
+            raise ValueError("Unknown metric '%s'. Choose one of %s."
+                             % (metric, ', '.join(GRID_METRICS)))
+        self.x_dim = x_dim
+        self.y_dim = y_dim
+        self.spacing = spacing
+        self.metric = metric
+        self.cache_size = cache_size
+        self.size = x_dim * y_dim
+
+    @property
+    def shape(self):
+        return (self.size, self.size)
+
+    @property
+    def nbytes(self):
+        return 0
+
+    def __len__(self):
+        return self.size
+
+    def coordinates(self, nodes):
+        """ Returns the x and y of the nodes (scalars or arrays)."""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        return nodes // self.y_dim, nodes % self.y_dim
+
+    def points(self):
+        """ Returns the (n, 2) coordinates of all nodes, as
+        create_simple_grid times the spacing.
+        """
+        x, y = self.coordinates(np.arange(self.size))
+        return np.column_stack([x, y]) * float(self.spacing)
+
+    def lattice_neighbors(self, node, radius=DEFAULT_NEIGHBOR_RADIUS):
+        """ Returns the nodes at most radius rows and columns away from
+        node, node itself excluded.
+        """
+        x, y = divmod(int(node), self.y_dim)
+        xs = np.arange(max(0, x - radius), min(self.x_dim, x + radius + 1))
+        ys = np.arange(max(0, y - radius), min(self.y_dim, y + radius + 1))
+        nodes = (xs[:, None] * self.y_dim + ys[None, :]).ravel()
+        return nodes[nodes != node]
+
+    def offset_distance(self, dx, dy):
+        """ Returns the distance of nodes dx rows and dy columns apart."""
+        if self.metric == 'euclidean':
+            return np.hypot(dx, dy) * self.spacing
+        return (np.abs(dx) + np.abs(dy)) * self.spacing
+
+    def __getitem__(self, key):
+        i, j = key
+        x_1, y_1 = self.coordinates(i)
+        x_2, y_2 = self.coordinates(j)
+        distances = self.offset_distance(x_1 - x_2, y_1 - y_2)
+        return distances if np.ndim(distances) else float(distances)
+
+    def row(self, i):
+        """ Returns the distances of node i to every node."""
+        return self[i, np.arange(self.size)]
+
+    def to_dense(self, dtype=None):
+        """ Returns the (n, n) array, for small grids only."""
+        nodes = np.arange(self.size)
+        return self[nodes[:, None], nodes[None, :]].astype(
+            dtype or self.dtype)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.to_dense(dtype)
+
+    def transit_callback(self, manager, scale):
+        """ Returns the transit callback of a routing model over the
+        grid: the quantized distance of two routing indices, cached per
+        (dx, dy) offset.
+        """
+        y_dim = self.y_dim
+
+        @functools.lru_cache(maxsize=self.cache_size)
+        def quantized(dx, dy):
+            return int(round(float(self.offset_distance(dx, dy)) * scale))
+
+        # a list lookup is much cheaper than a call into or tools.
+        index_to_node = [manager.IndexToNode(index)
+                         for index in range(manager.GetNumberOfIndices())]
+
+        def distance_callback(from_index, to_index):
+            from_x, from_y = divmod(index_to_node[from_index], y_dim)
+            to_x, to_y = divmod(index_to_node[to_index], y_dim)
+            return quantized(abs(from_x - to_x), abs(from_y - to_y))
+
+        return distance_callback
+
+    def serpentine_routes(self, num_vehicles, depot=0):
+        """ Method to build a first solution that walks the grid row by
+        row, alternating direction, cut into num_vehicles consecutive
+        parts.
+
+        Returns
+        -------
+        routes : list
+            One list of nodes (depot excluded) per vehicle.
+        """
+        nodes = np.arange(self.size).reshape(self.x_dim, self.y_dim)
+        nodes[1::2] = nodes[1::2, ::-1]
+        tour = nodes.ravel()
+        tour = tour[tour != depot]
+        bounds = np.linspace(0, len(tour), num_vehicles + 1).astype(int)
+        return [tour[bounds[v]:bounds[v + 1]].tolist()
+                for v in range(num_vehicles)]
+
+
+def create_grid_data_model(x_dim, y_dim, num_vehicles, spacing=1.0,
+                           metric='euclidean'):
+    """ Stores the data of a grid problem with the implicit matrix.
+
+    Returns
+    -------
+    data : dictionary
+        distance_matrix (a GridDistanceMatrix), num_vehicles and depot.
+    """
+    data = {}
+    data['distance_matrix'] = GridDistanceMatrix(x_dim, y_dim, spacing,
+                                                 metric)
+    data['num_vehicles'] = num_vehicles
+    data['depot'] = 0
+    return data
+
+
+def solve_implicit_grid(x_dim, y_dim, num_vehicles=1, time_limit=60,
+                        scale=100, max_route_distance=None,
+                        local_search_metaheuristic=None,
+                        radius=DEFAULT_NEIGHBOR_RADIUS):
+    """ Method to solve the routing problem of a (large) grid without a
+    materialized matrix.
+
+    The search starts from serpentine_routes, since the first solution
+    heuristics of the solver scan all n * n arcs, and the successors of
+    every node are restricted to its lattice neighbors (the way
+    sparse_model restricts them to candidate arcs): otherwise the solver
+    evaluates all n * n arcs through the python callback before its
+    first move, minutes on a 100x100 grid. Restricting a domain still
+    takes or tools O(n) per node, so the setup grows quadratically: a
+    100x100 grid is set up in about 6 s and then searched within
+    time_limit. Far larger grids are better served by the native engine
+    (see optops.solve_routes).
+
+    Parameters
+    ----------
+    x_dim, y_dim, num_vehicles
+        See create_grid_data_model.
+    time_limit : float
+        Search time limit (seconds).
+    scale, max_route_distance
+        See optops.create_routing_model.
+    local_search_metaheuristic : str
+        See optops.create_search_parameters.
+    radius : int
+        See GridDistanceMatrix.lattice_neighbors.
+
+    Returns
+    -------
+    routes : route_set.RouteSet
+        None when no solution was found.
+    """
+    data = create_grid_data_model(x_dim, y_dim, num_vehicles)
+    grid = data['distance_matrix']
+    depot = data['depot']
+    manager, routing, _ = optops.create_routing_model(
+        data, scale=scale, max_route_distance=max_route_distance)
+    initial_routes = grid.serpentine_routes(num_vehicles, depot)
+    # the arcs of the start are allowed too, e.g. around the depot.
+    successors = {}
+    for route in initial_routes:
+        successors.update(zip(route, route[1:]))
+    ends = [routing.End(v) for v in range(num_vehicles)]
+    for node in range(grid.size):
+        if node == depot:
+            continue
+        allowed = [manager.NodeToIndex(int(n))
+                   for n in grid.lattice_neighbors(node, radius)
+                   if n != depot]
+        if node in successors:
+            allowed.append(manager.NodeToIndex(successors[node]))
+        routing.NextVar(manager.NodeToIndex(node)).SetValues(allowed + ends)
+    search_parameters = optops.create_search_parameters(
+        local_search_metaheuristic=local_search_metaheuristic,
+        time_limit=time_limit)
+    routing.CloseModelWithParameters(search_parameters)
+    initial = routing.ReadAssignmentFromRoutes(initial_routes, True)
+    if initial is None:
+        solution = routing.SolveWithParameters(search_parameters)
+    else:
+        solution = routing.SolveFromAssignmentWithParameters(
+            initial, search_parameters)
+    if not solution:
+        return None
+    return optops.get_route_set(data, manager, routing, solution)
@@ -4,15 +4,19 @@ in the grid.
 """
 
 from __future__ import print_function
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
-from scipy.spatial import distance
 import matplotlib.pyplot as plt
+import anytime
+import grid_distances
+import lower_bounds
+from optops import GRID_DISTANCE_SCALE
+import optops
+import portfolio
+import route_set
+import sparse_model
 import pdb
 import time
 
 
-
 def create_data_model():
     """Stores the data for the problem."""
     data = {}
@@ -35,7 +39,12 @@ def create_data_model():
     data['depot'] = 0
     return data
 
-def create_equal_distance():
+def create_equal_distance(implicit=False):
+    """ Data model of the 10x10 grid. With implicit the distances are
+    computed from the node ids (see grid_distances) instead of stored.
+    """
+    if implicit:
+        return grid_distances.create_grid_data_model(10, 10, 1)
     data = {}
     points_matrix = create_grid_points()
     data['distance_matrix'] = calculate_grid_distances(points_matrix)
@@ -54,118 +63,129 @@ def create_grid_points():
     return points_matrix
 
 def calculate_grid_distances(points_matrix):
-    distance_matrix = []
-    row_matrix = []
-    for point_a in points_matrix:
-        for point_b in points_matrix:
-            dst = distance.euclidean(point_a, point_b)
-            row_matrix.append(dst)
-        distance_matrix.append(row_matrix)
-        row_matrix = []
-    #print(distance_matrix)
-    #print("distance matrix just above!\n")
-    return distance_matrix
+    """ Computes the euclidean distance matrix of the grid points."""
+    return optops.calc_distance_matrix(points_matrix, metric='euclidean')
+
 
 def return_nodes(manager, routing, solution):
     """returns nodes sorted with the travel."""
-    print('Objective: {} miles'.format(solution.ObjectiveValue()))
-    index = routing.Start(0)
-    plan_output = 'Route for vehicle 0:\n'
-    tsp_nodes = []
-    route_distance = 0
-    while not routing.IsEnd(index):
-        plan_output += ' {} ->'.format(manager.IndexToNode(index))
-        tsp_nodes.append(manager.IndexToNode(index))
-        previous_index = index
-        index = solution.Value(routing.NextVar(index))
-        route_distance += routing.GetArcCostForVehicle(previous_index, index, 0)
-    plan_output += ' {}\n'.format(manager.IndexToNode(index))
-    tsp_nodes.append(manager.IndexToNode(index))
-    print(plan_output)
-    plan_output += 'Route distance: {}miles\n'.format(route_distance)
-    #print(tsp_nodes)
-    return tsp_nodes
-
-
-def print_grid_to_map(nodes, tsp_path):
-	x_axis = []
-	y_axis = []
-	# convert points to coords
-	for n in nodes:
-		x, y = n
-		x_axis.append(x)
-		y_axis.append(y)
-	plt.plot(x_axis, y_axis, 'ro')
-	plt.show(block=False)
-
-	for n in tsp_path:
-		x, y = nodes[n]
-		x_axis.append(x)
-		y_axis.append(y)
-		print("Node is %s and coords are %s" %(n, nodes[n]))
-	for n in range(0, len(tsp_path)-1):
-		plt.plot([x_axis[tsp_path[n]], x_axis[tsp_path[n+1]]], [y_axis[tsp_path[n]], y_axis[tsp_path[n+1]]])
-		plt.draw()
-		plt.pause(0.2)
-		#plt.show(block=False)
-	#plt.plot(x_axis, y_axis)
+    return optops.get_single_route_nodes(manager, routing, solution, 0)
+
+
+def print_grid_to_map(nodes, tsp_path, animate=False):
+	""" Draws the grid and the tour, segment by segment if animate."""
+	if animate:
+		optops.animate_routes(nodes, [tsp_path])
+	else:
+		optops.draw_routes(plt.gca(), nodes, [tsp_path])
 	plt.show()
 
 
 
-def print_solution(manager, routing, solution):
+def print_solution(data, manager, routing, solution):
     """Prints solution on console."""
-    print('Objective: {} miles'.format(solution.ObjectiveValue()))
-    index = routing.Start(0)
-    plan_output = 'Route for vehicle 0:\n'
-    route_distance = 0
-    while not routing.IsEnd(index):
-        plan_output += ' {} ->'.format(manager.IndexToNode(index))
-        previous_index = index
-        index = solution.Value(routing.NextVar(index))
-        route_distance += routing.GetArcCostForVehicle(previous_index, index, 0)
-    plan_output += ' {}\n'.format(manager.IndexToNode(index))
-    print(plan_output)
-    plan_output += 'Route distance: {}miles\n'.format(route_distance)
-
-
-def main():
-    """Entry point of the program."""
+    routes = optops.get_route_set(data, manager, routing, solution)
+    print('Objective: {} miles'.format(routes.objective / GRID_DISTANCE_SCALE))
+    print(routes.format_plan(unit='miles'))
+    return routes
+
+
+def solve_with_portfolio(time_limit=10, num_workers=None,
+                         target_objective=None):
+    """Solves the grid TSP with a parallel portfolio of solver
+    configurations and returns the portfolio result."""
+    data = create_equal_distance()
+    result = portfolio.solve_portfolio(
+        data, time_limit=time_limit, num_workers=num_workers,
+        target_objective=target_objective, scale=GRID_DISTANCE_SCALE)
+    if result['routes'] is not None:
+        print('Best objective: {} miles by {}'.format(
+            result['objective'] / GRID_DISTANCE_SCALE, result['config']))
+        for vehicle_id, route in result['routes'].items():
+            print('Route for vehicle {}: {}'.format(
+                vehicle_id, ' -> '.join(str(n) for n in route)))
+    return result
+
+
+def solve_anytime(time_limit=10, target_objective=None):
+    """Solves the grid TSP in anytime mode, printing every improving
+    solution as soon as it is found. Returns the best one."""
+    data = create_equal_distance()
+    best = None
+    for improvement in anytime.iter_solutions(
+            data, scale=GRID_DISTANCE_SCALE, time_limit=time_limit):
+        best = improvement
+        print('{:.3f}s objective: {} miles'.format(
+            improvement.elapsed, improvement.objective / GRID_DISTANCE_SCALE))
+        if target_objective is not None and \
+                improvement.objective <= target_objective:
+            break
+    return best
+
+
+def solve_to_gap(gap_limit=0.01, time_limit=30, held_karp=True):
+    """Solves the grid TSP until the optimality gap to a lower bound
+    (see lower_bounds) is not above gap_limit or time_limit is over,
+    printing the gap of every improving solution. Returns the best
+    routes."""
+    data = create_equal_distance()
+    bound = lower_bounds.tour_lower_bound(data, held_karp=held_karp)
+    print('Lower bound: {:.2f} miles'.format(bound))
+    monitor = lower_bounds.GapMonitor(bound, GRID_DISTANCE_SCALE, gap_limit)
+    best = anytime.solve_with_callback(data, monitor,
+                                       scale=GRID_DISTANCE_SCALE,
+                                       time_limit=time_limit)
+    if best is None:
+        return None
+    return route_set.RouteSet.from_routes(best.routes, data, best.objective)
+
+
+def solve_sparse(time_limit=10, k=10):
+    """Solves the grid TSP with the sparse model, which only keeps the k
+    nearest neighbours of every node as candidate arcs (see
+    sparse_model). Returns the routes."""
+    data = sparse_model.create_sparse_data_model(create_grid_points(), 1, k)
+    routes, objective = sparse_model.solve_sparse(data,
+                                                  time_limit=time_limit)
+    if routes is None:
+        return None
+    return route_set.RouteSet.from_routes(routes, data, objective)
+
+
+def main(engine='ortools', gap_limit=None, local_search_metaheuristic=None,
+         budget=None):
+    """Entry point of the program, engine is 'ortools', 'native' (see
+    optops.ENGINES) or 'sparse' (see solve_sparse). With a gap_limit the
+    or tools search runs until the optimality gap is not above it (see
+    solve_to_gap). Otherwise it stops at the first local optimum unless
+    a local_search_metaheuristic is given, which then needs a budget (a
+    search_budget.SearchBudget)."""
     # Instantiate the data problem.
     data = create_equal_distance()  #create_data_model()
 
-    # Create the routing index manager.
-    manager = pywrapcp.RoutingIndexManager(len(data['distance_matrix']),
-                                           data['num_vehicles'], data['depot'])
-
-    # Create Routing Model.
-    routing = pywrapcp.RoutingModel(manager)
-
-
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-
-    # Define cost of each arc.
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-    # Setting first solution heuristic.
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-
-    # Solve the problem.
-    solution = routing.SolveWithParameters(search_parameters)
+    # Solve the problem, with the first solution heuristic
+    # PATH_CHEAPEST_ARC on or tools.
+    if gap_limit is not None and engine == 'ortools':
+        routes = solve_to_gap(gap_limit)
+    elif engine == 'sparse':
+        routes = solve_sparse()
+    elif engine == 'ortools':
+        routes = optops.solve_routes(
+            data, engine=engine, scale=GRID_DISTANCE_SCALE,
+            local_search_metaheuristic=local_search_metaheuristic,
+            budget=budget)
+    else:
+        routes = optops.solve_routes(data, engine=engine,
+                                     scale=GRID_DISTANCE_SCALE)
+    if budget is not None and budget.stop_reason is not None:
+        print(budget.describe())
 
     # Print solution on console.
-    if solution:
-        print_solution(manager, routing, solution)
-        tsp_node_path = return_nodes(manager, routing, solution)
+    if routes is not None:
+        print('Objective: {} miles'.format(
+            routes.objective / GRID_DISTANCE_SCALE))
+        print(routes.format_plan(unit='miles'))
+        tsp_node_path = routes.route(0).tolist()
         nodes = create_grid_points()
         print_grid_to_map(nodes, tsp_node_path)
 
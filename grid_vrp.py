@@ -1,25 +1,31 @@
 """Vehicles Routing Problem (VRP)."""
 
 from __future__ import print_function
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
-from scipy.spatial import distance
 import matplotlib.pyplot as plt
+import anytime
+import grid_distances
+from optops import GRID_DISTANCE_SCALE
+import optops
+import portfolio
+import route_set
+import sparse_model
 import pdb
 import time
-import json
 
 
-def create_equal_distance():
+def create_equal_distance(implicit=False):
+    """ Data model of the 8x8 grid. With implicit the distances are
+    computed from the node ids (see grid_distances) instead of stored.
+    """
+    if implicit:
+        return grid_distances.create_grid_data_model(8, 8, 4)
     data = {}
     points_matrix = create_grid_points()
     data['distance_matrix'] = calculate_grid_distances(points_matrix)
     data['num_vehicles'] = 4
     data['depot'] = 0
-    with open('data.json', 'w') as outfile:
-        json.dump(data, outfile)
-    with open('data.json') as json_file:
-        data = json.load(json_file)
+    optops.write_model_to_binary(data, 'data.lpm')
+    data = optops.read_model_from_binary('data.lpm')
     return data
 
 
@@ -32,147 +38,116 @@ def create_grid_points():
     return points_matrix
 
 def calculate_grid_distances(points_matrix):
-    distance_matrix = []
-    row_matrix = []
-    for point_a in points_matrix:
-        for point_b in points_matrix:
-            dst = distance.euclidean(point_a, point_b)
-            row_matrix.append(dst)
-        distance_matrix.append(row_matrix)
-        row_matrix = []
-    #print(distance_matrix)
-    #print("distance matrix just above!\n")
-    return distance_matrix
+    """ Computes the euclidean distance matrix of the grid points."""
+    return optops.calc_distance_matrix(points_matrix, metric='euclidean')
 
 
 def get_vrp_nodes_path(data, manager, routing, solution):
     """ This method gets the paths for all nodes."""
-    all_paths = {}
-    for vehicle_id in range(data['num_vehicles']):
-        all_paths[vehicle_id] = return_nodes(manager, routing, solution, vehicle_id)
-    return all_paths
+    return optops.get_all_routes(data, manager, routing, solution)
 
 def return_nodes(manager, routing, solution, vehicle_id):
     """returns nodes sorted with the travel."""
-    print('Objective: {} miles'.format(solution.ObjectiveValue()))
-    index = routing.Start(vehicle_id)
-    plan_output = 'Route for vehicle 0:\n'
-    vrp_nodes = []
-    route_distance = 0
-    while not routing.IsEnd(index):
-        plan_output += ' {} ->'.format(manager.IndexToNode(index))
-        vrp_nodes.append(manager.IndexToNode(index))
-        previous_index = index
-        index = solution.Value(routing.NextVar(index))
-        route_distance += routing.GetArcCostForVehicle(previous_index, index, 0)
-    plan_output += ' {}\n'.format(manager.IndexToNode(index))
-    vrp_nodes.append(manager.IndexToNode(index))
-    print(plan_output)
-    plan_output += 'Route distance: {}miles\n'.format(route_distance)
-    #print(tsp_nodes)
-    return vrp_nodes
-
-
-def print_paths_to_grid(data, nodes, vrp_nodes_path):
-    color_list = ['b', 'g', 'r', 'c', 'm', 'y', 'k', 'w']
-    for  vehicle_id in range(data['num_vehicles']):
-        color = color_list[vehicle_id % len(color_list)]
-        print_grid_to_map(nodes, vrp_nodes_path[vehicle_id], color)
+    return optops.get_single_route_nodes(manager, routing, solution,
+                                         vehicle_id)
+
+
+def print_paths_to_grid(data, nodes, vrp_nodes_path, animate=False):
+    optops.print_paths_to_grid(data, nodes, vrp_nodes_path, animate=animate)
     plt.show()
 
-def print_grid_to_map(nodes, tsp_path, color):
-	x_axis = []
-	y_axis = []
-	# convert points to coords
-	for n in nodes:
-		x, y = n
-		x_axis.append(x)
-		y_axis.append(y)
-	plt.plot(x_axis, y_axis, 'ro')
-	plt.show(block=False)
-
-	for n in tsp_path:
-		x, y = nodes[n]
-		x_axis.append(x)
-		y_axis.append(y)
-		#print("Node is %s and coords are %s" %(n, nodes[n]))
-	print(len(x_axis))
-	print(len(y_axis))
-	for n in range(0, len(tsp_path)-1):
-		plt.plot([x_axis[tsp_path[n]], x_axis[tsp_path[n+1]]], [y_axis[tsp_path[n]], y_axis[tsp_path[n+1]]], color)
-		plt.draw()
-		plt.pause(0.2)
+def print_grid_to_map(nodes, tsp_path, color, animate=False):
+	if animate:
+		optops.animate_routes(nodes, [tsp_path], color=color)
+	else:
+		optops.draw_routes(plt.gca(), nodes, [tsp_path], color=color)
 
 
 def print_solution(data, manager, routing, solution):
     """Prints solution on console."""
-    max_route_distance = 0
-    for vehicle_id in range(data['num_vehicles']):
-        index = routing.Start(vehicle_id)
-        plan_output = 'Route for vehicle {}:\n'.format(vehicle_id)
-        route_distance = 0
-        while not routing.IsEnd(index):
-            plan_output += ' {} -> '.format(manager.IndexToNode(index))
-            previous_index = index
-            index = solution.Value(routing.NextVar(index))
-            route_distance += routing.GetArcCostForVehicle(
-                previous_index, index, vehicle_id)
-        plan_output += '{}\n'.format(manager.IndexToNode(index))
-        plan_output += 'Distance of the route: {}m\n'.format(route_distance)
-        print(plan_output)
-        max_route_distance = max(route_distance, max_route_distance)
-    print('Maximum of the route distances: {}m'.format(max_route_distance))
-
-
-def main():
-    """Solve the CVRP problem."""
-    # Instantiate the data problem.
-    data = create_equal_distance()
-
-    # Create the routing index manager.
-    manager = pywrapcp.RoutingIndexManager(len(data['distance_matrix']),
-                                           data['num_vehicles'], data['depot'])
-
-    # Create Routing Model.
-    routing = pywrapcp.RoutingModel(manager)
-
+    routes = optops.get_route_set(data, manager, routing, solution)
+    print(routes.format_plan())
+    return routes
 
-    # Create and register a transit callback.
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
 
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-
-    # Define cost of each arc.
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-    # Add Distance constraint.
-    dimension_name = 'Distance'
-    routing.AddDimension(
-        transit_callback_index,
-        0,  # no slack
-        3000,  # vehicle maximum travel distance
-        True,  # start cumul to zero
-        dimension_name)
-    distance_dimension = routing.GetDimensionOrDie(dimension_name)
-    distance_dimension.SetGlobalSpanCostCoefficient(100)
-
-    # Setting first solution heuristic.
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+def solve_with_portfolio(time_limit=10, num_workers=None,
+                         target_objective=None):
+    """Solves the grid distance constrained VRP with a parallel portfolio of solver
+    configurations and returns the portfolio result."""
+    data = create_equal_distance()
+    result = portfolio.solve_portfolio(
+        data, time_limit=time_limit, num_workers=num_workers,
+        target_objective=target_objective, scale=GRID_DISTANCE_SCALE,
+        max_route_distance=3000)
+    if result['routes'] is not None:
+        print('Best objective: {} miles by {}'.format(
+            result['objective'] / GRID_DISTANCE_SCALE, result['config']))
+        for vehicle_id, route in result['routes'].items():
+            print('Route for vehicle {}: {}'.format(
+                vehicle_id, ' -> '.join(str(n) for n in route)))
+    return result
+
+
+def solve_anytime(time_limit=10, target_objective=None):
+    """Solves the grid distance constrained VRP in anytime mode, printing
+    every improving solution as soon as it is found. Returns the best
+    one."""
+    data = create_equal_distance()
+    best = None
+    for improvement in anytime.iter_solutions(
+            data, scale=GRID_DISTANCE_SCALE, max_route_distance=3000,
+            time_limit=time_limit):
+        best = improvement
+        print('{:.3f}s objective: {} miles'.format(
+            improvement.elapsed, improvement.objective / GRID_DISTANCE_SCALE))
+        if target_objective is not None and \
+                improvement.objective <= target_objective:
+            break
+    return best
+
+
+def solve_sparse(time_limit=10, k=10):
+    """Solves the grid distance constrained VRP with the sparse model,
+    which only keeps the k nearest neighbours of every node as candidate
+    arcs (see sparse_model). Returns the routes."""
+    data = sparse_model.create_sparse_data_model(create_grid_points(), 4, k)
+    routes, objective = sparse_model.solve_sparse(
+        data, time_limit=time_limit, max_route_distance=3000)
+    if routes is None:
+        return None
+    return route_set.RouteSet.from_routes(routes, data, objective)
+
+
+def main(engine='ortools', local_search_metaheuristic=None, budget=None):
+    """Solve the CVRP problem, with the or tools solver, the native
+    heuristics (engine='native', see optops.ENGINES) or the sparse
+    model (engine='sparse', see solve_sparse). The or tools search stops
+    at the first local optimum unless a local_search_metaheuristic is
+    given, which then needs a budget (a search_budget.SearchBudget)."""
+    # Instantiate the data problem.
+    data = create_equal_distance()
 
-    # Solve the problem.
-    solution = routing.SolveWithParameters(search_parameters)
+    # Solve the problem, with the first solution heuristic
+    # PATH_CHEAPEST_ARC on or tools.
+    if engine == 'sparse':
+        routes = solve_sparse()
+    elif engine == 'ortools':
+        routes = optops.solve_routes(
+            data, engine=engine, scale=GRID_DISTANCE_SCALE,
+            max_route_distance=3000,
+            local_search_metaheuristic=local_search_metaheuristic,
+            budget=budget)
+    else:
+        routes = optops.solve_routes(data, engine=engine,
+                                     scale=GRID_DISTANCE_SCALE,
+                                     max_route_distance=3000)
+    if budget is not None and budget.stop_reason is not None:
+        print(budget.describe())
 
     # Print solution on console.
-    if solution:
-        print_solution(data, manager, routing, solution)
-        vrp_nodes_path = get_vrp_nodes_path(data, manager, routing, solution)
+    if routes is not None:
+        print(routes.format_plan())
+        vrp_nodes_path = routes.to_dict()
         nodes = create_grid_points()
         print_paths_to_grid(data, nodes, vrp_nodes_path)
 
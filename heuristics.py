@@ -0,0 +1,682 @@
+""" Module which contains a native routing heuristic engine, a fast
+fallback to the or tools solver when routes are needed at once.
+
+It works directly on the distance matrix of a data model (numpy, compact
+or implicit, see condensed_matrix.as_matrix): a nearest neighbor or a
+savings construction, improved by 2-opt, Or-opt and relocate moves. The
+moves are only tried towards the nearest neighbors of every node, all
+the candidates of an operator are evaluated at once with numpy and the
+improving moves which do not overlap are applied together. The neighbors
+come from a KD-tree when the coordinates of the nodes are known, so that
+large grids are never scanned n * n.
+
+The objective is the one of optops.create_routing_model: the total
+distance, plus span_cost_coefficient times the longest route when a
+max_route_distance is given.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from scipy.spatial import cKDTree
+import bisect
+import heapq
+import itertools
+import time
+import numpy as np
+import condensed_matrix
+import route_set
+import tracing
+
+
+CONSTRUCTIONS = ('nearest_neighbor', 'savings')
+OPERATORS = ('two_opt', 'or_opt', 'relocate')
+# neighbors per node the moves are tried towards.
+DEFAULT_NEIGHBORS = 16
+# longest segment moved by Or-opt.
+OR_OPT_MAX_SEGMENT = 3
+# improvements below it are rounding noise.
+EPSILON = 1e-9
+# savings merges between two looks at the clock.
+CLOCK_INTERVAL = 4096
+
+
+def nearest_neighbors(matrix, num_neighbors=DEFAULT_NEIGHBORS, depot=0,
+                      block_size=256, points=None):
+    """ Method to find the nearest nodes of every node, depot excluded.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray or a condensed_matrix/grid_distances matrix
+        The (n, n) distances.
+    num_neighbors : int
+        Neighbors per node, at most n - 2.
+    depot : int
+    block_size : int
+        Rows of distances computed at a time.
+    points : numpy.ndarray
+        (n, 2) coordinates of the nodes. If given, or if the matrix is a
+        grid_distances.GridDistanceMatrix, the neighbors are found with a
+        KD-tree in O(n log n) instead of the O(n * n) scan of the matrix.
+        The moves are still evaluated on the matrix, so the coordinates
+        only need to place close nodes close.
+
+    Returns
+    -------
+    numpy.ndarray
+        (n, k) node ids, closest first.
+    """
+    matrix = condensed_matrix.as_matrix(matrix)
+    size = len(matrix)
+    k = max(0, min(num_neighbors, size - 2))
+    if k == 0:
+        return np.zeros((size, k), dtype=np.int64)
+    norm = 2
+    if points is None and hasattr(matrix, 'lattice_neighbors'):
+        points = matrix.points()
+        norm = 1 if matrix.metric == 'manhattan' else 2
+    if points is not None:
+        return _tree_neighbors(np.asarray(points, dtype=np.float64), k,
+                               depot, norm)
+    candidates = np.delete(np.arange(size), depot)
+    neighbors = np.zeros((size, k), dtype=np.int64)
+    for start in range(0, size, block_size):
+        rows = np.arange(start, min(start + block_size, size))
+        block = np.array(matrix[rows[:, None], candidates[None, :]],
+                         dtype=np.float64)
+        block[candidates[None, :] == rows[:, None]] = np.inf
+        nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(block, nearest, axis=1),
+                           axis=1, kind='stable')
+        neighbors[rows] = candidates[np.take_along_axis(nearest, order,
+                                                        axis=1)]
+    return neighbors
+
+
+def _tree_neighbors(points, k, depot, norm):
+    """ Returns the k nearest neighbors of every point (itself and the
+    depot excluded) by a query of a KD-tree with the given Minkowski
+    norm.
+    """
+    size = len(points)
+    _, found = cKDTree(points).query(points, k=k + 2, p=norm)
+    keep = (found != np.arange(size)[:, None]) & (found != depot)
+    # the first k kept of every row, in distance order.
+    order = np.argsort(~keep, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(found, order, axis=1).astype(np.int64)
+
+
+@tracing.traced('heuristics.construct')
+def nearest_neighbor_routes(matrix, num_vehicles, depot=0,
+                            max_route_distance=None, neighbors=None,
+                            time_limit=None):
+    """ Method to build routes by always driving to the closest unvisited
+    node. A vehicle returns to the depot when the next node would take
+    it over max_route_distance; the last vehicle takes what is left,
+    which may break max_route_distance (see solve). Once time_limit
+    (seconds) is over, the last vehicle takes the unvisited nodes in id
+    order.
+
+    Returns
+    -------
+    routes : list
+        One numpy array of nodes per vehicle, starting and ending at the
+        depot.
+    """
+    matrix = condensed_matrix.as_matrix(matrix)
+    size = len(matrix)
+    deadline = None if time_limit is None else time.time() + time_limit
+    if neighbors is None:
+        neighbors = nearest_neighbors(matrix, depot=depot)
+    visited = np.zeros(size, dtype=bool)
+    visited[depot] = True
+    routes = [[depot]]
+    length = 0.0
+    current = depot
+    for _ in range(size - 1):
+        if deadline is not None and time.time() > deadline:
+            routes[-1].extend(np.flatnonzero(~visited).tolist())
+            break
+        node = _closest_unvisited(matrix, neighbors, visited, current)
+        if max_route_distance is not None and current != depot and \
+                len(routes) < num_vehicles and \
+                length + matrix[current, node] + matrix[node, depot] > \
+                max_route_distance:
+            routes[-1].append(depot)
+            routes.append([depot])
+            length = 0.0
+            current = depot
+            node = _closest_unvisited(matrix, neighbors, visited, depot)
+        length += matrix[current, node]
+        routes[-1].append(node)
+        visited[node] = True
+        current = node
+    routes[-1].append(depot)
+    return _pad_routes(routes, num_vehicles, depot)
+
+
+@tracing.traced('heuristics.construct')
+def savings_routes(matrix, num_vehicles, depot=0, max_route_distance=None,
+                   neighbors=None, time_limit=None):
+    """ Method to build routes with the Clarke and Wright savings: every
+    node starts on its own route and the ends of two routes are joined,
+    largest saving d(depot, i) + d(depot, j) - d(i, j) first, while the
+    joined route keeps max_route_distance. Only the pairs of the
+    neighbor lists are considered, and the distances are taken as
+    symmetric when a route is turned around.
+
+    If more routes than vehicles are left, the shortest ones are
+    chained, which may break max_route_distance (see solve). Once
+    time_limit (seconds) is over, no more pairs are joined and the routes
+    left are chained in the order of their first nodes instead.
+
+    Returns
+    -------
+    routes : list
+        See nearest_neighbor_routes.
+    """
+    deadline = None if time_limit is None else time.time() + time_limit
+    matrix = condensed_matrix.as_matrix(matrix)
+    size = len(matrix)
+    if neighbors is None:
+        neighbors = nearest_neighbors(matrix, depot=depot)
+    customers = np.delete(np.arange(size), depot)
+    to_depot = np.asarray(matrix[customers, depot], dtype=np.float64)
+    depot_distance = np.zeros(size)
+    depot_distance[customers] = to_depot
+    first = np.repeat(customers, neighbors.shape[1])
+    second = neighbors[customers].ravel()
+    keep = first < second
+    first, second = first[keep], second[keep]
+    savings = (depot_distance[first] + depot_distance[second]
+               - np.asarray(matrix[first, second], dtype=np.float64))
+    order = np.argsort(-savings, kind='stable')
+
+    # route id of every node, and nodes and length of every route.
+    owner = np.arange(size)
+    members = {int(c): [int(c)] for c in customers}
+    lengths = {int(c): 2 * depot_distance[c] for c in customers}
+    expired = False
+    for count, pair in enumerate(order):
+        if savings[pair] <= 0:
+            break
+        if deadline is not None and count % CLOCK_INTERVAL == 0 and \
+                time.time() > deadline:
+            expired = True
+            break
+        i, j = int(first[pair]), int(second[pair])
+        a, b = owner[i], owner[j]
+        if a == b:
+            continue
+        route_a, route_b = members[a], members[b]
+        if i not in (route_a[0], route_a[-1]) or \
+                j not in (route_b[0], route_b[-1]):
+            continue
+        length = lengths[a] + lengths[b] - savings[pair]
+        if max_route_distance is not None and length > max_route_distance:
+            continue
+        # orient the routes as ... i -> j ..., moving the shorter one.
+        if len(route_a) < len(route_b):
+            a, b, i, j, route_a, route_b = b, a, j, i, route_b, route_a
+        if route_b[0] == j and route_a[-1] == i:
+            route_a.extend(route_b)
+        elif route_b[-1] == j and route_a[0] == i:
+            route_a[:0] = route_b
+        elif route_a[-1] == i:
+            route_a.extend(reversed(route_b))
+        else:
+            route_a[:0] = reversed(route_b)
+        owner[route_b] = a
+        lengths[a] = length
+        del members[b], lengths[b]
+
+    routes = sorted(members, key=lambda route: members[route][0])
+    num_routes = max(1, num_vehicles)
+    if expired and len(routes) > num_routes:
+        routes = [list(itertools.chain.from_iterable(
+                      members[r] for r in chunk))
+                  for chunk in np.array_split(routes, num_routes)]
+    else:
+        routes = _chain_shortest(matrix, [members[r] for r in routes],
+                                 [lengths[r] for r in routes], num_routes,
+                                 depot)
+    return _pad_routes([[depot] + route + [depot] for route in routes],
+                       num_vehicles, depot)
+
+
+def _chain_shortest(matrix, routes, lengths, num_routes, depot):
+    """ Chains the two shortest routes (of the given lengths, depot
+    included) until at most num_routes are left.
+    """
+    if len(routes) <= num_routes:
+        return routes
+    heap = [(length, i, route)
+            for i, (length, route) in enumerate(zip(lengths, routes))]
+    heapq.heapify(heap)
+    count = len(heap)
+    while len(heap) > num_routes:
+        length_a, _, route_a = heapq.heappop(heap)
+        length_b, _, route_b = heapq.heappop(heap)
+        length = (length_a + length_b + matrix[route_a[-1], route_b[0]]
+                  - matrix[route_a[-1], depot] - matrix[depot, route_b[0]])
+        heapq.heappush(heap, (length, count, route_a + route_b))
+        count += 1
+    return [route for _, _, route in sorted(heap, key=lambda item: item[1])]
+
+
+@tracing.traced('heuristics.improve')
+def improve_routes(matrix, routes, neighbors, depot=0,
+                   max_route_distance=None, span_cost_coefficient=100,
+                   operators=OPERATORS, time_limit=None):
+    """ Method to improve routes with local search until no operator
+    finds an improving move or time_limit (seconds) is over.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray or a condensed_matrix/grid_distances matrix
+    routes : list
+        One sequence of nodes per vehicle, depot at both ends.
+    neighbors : numpy.ndarray
+        See nearest_neighbors.
+    depot : int
+    max_route_distance : float
+        No move makes a route longer than it. Also adds the span cost
+        to the objective, as optops.create_routing_model does.
+    span_cost_coefficient : int
+    operators : tuple
+        Names from OPERATORS, applied in this order.
+    time_limit : float
+        None runs to a local optimum. The clock is also read while the
+        moves of an operator are applied, so a large instance overruns
+        time_limit by at most one evaluation of the moves.
+
+    Returns
+    -------
+    routes : list
+        The improved routes, numpy arrays.
+    """
+    matrix = condensed_matrix.as_matrix(matrix)
+    deadline = None if time_limit is None else time.time() + time_limit
+    search = _LocalSearch(matrix, routes, neighbors, depot,
+                          max_route_distance,
+                          span_cost_coefficient
+                          if max_route_distance is not None else 0,
+                          deadline)
+    moves = {'two_opt': search.two_opt, 'or_opt': search.or_opt,
+             'relocate': search.relocate}
+    improved = True
+    while improved:
+        improved = False
+        objective = search.objective()
+        for name in operators:
+            if deadline is not None and time.time() > deadline:
+                return search.routes
+            improved = moves[name]() or improved
+        # the gains of 2-opt and Or-opt take the matrix as symmetric, on
+        # an asymmetric one a round may not pay off.
+        improved = improved and search.objective() < objective - EPSILON
+    return search.routes
+
+
+def route_objective(lengths, max_route_distance=None,
+                    span_cost_coefficient=100):
+    """ Returns the objective of routes of the given lengths (in the
+    units of the matrix).
+    """
+    lengths = np.asarray(lengths, dtype=np.float64)
+    if max_route_distance is None or not len(lengths):
+        return float(lengths.sum())
+    return float(lengths.sum() + span_cost_coefficient * lengths.max())
+
+
+@tracing.traced('heuristics.solve')
+def solve(data, construction='savings', scale=1, max_route_distance=None,
+          span_cost_coefficient=100, time_limit=None,
+          num_neighbors=DEFAULT_NEIGHBORS, operators=OPERATORS):
+    """ Method to solve a data model with the native engine.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model (distance_matrix, num_vehicles, depot and, if
+        known, the coordinates as points, see nearest_neighbors). The
+        scale is stored back to it as 'distance_scale'.
+    construction : str
+        One of CONSTRUCTIONS.
+    scale : float
+        Scale of the reported objective, see optops.quantize_matrix.
+    max_route_distance, span_cost_coefficient, operators
+        See improve_routes.
+    time_limit : float
+        Seconds for the whole solve: the neighbor search and the
+        construction count against it, the local search gets the rest.
+    num_neighbors : int
+        See nearest_neighbors.
+
+    Returns
+    -------
+    route_set.RouteSet
+        The routes, with the objective in the integer units of the
+        routing solver. None if a route is longer than
+        max_route_distance (the fleet cannot cover the nodes within it),
+        as the or tools engine finds no solution then.
+    """
+    if construction not in CONSTRUCTIONS:
+        raise ValueError("Unknown construction '%s'. Choose one of %s."
+                         % (construction, ', '.join(CONSTRUCTIONS)))
+    start = time.time()
+    matrix = condensed_matrix.as_matrix(data['distance_matrix'])
+    depot = data['depot']
+    neighbors = nearest_neighbors(matrix, num_neighbors, depot,
+                                  points=data.get('points'))
+    build = (nearest_neighbor_routes if construction == 'nearest_neighbor'
+             else savings_routes)
+    routes = build(matrix, data['num_vehicles'], depot, max_route_distance,
+                   neighbors, _remaining(time_limit, start))
+    routes = improve_routes(matrix, routes, neighbors, depot,
+                            max_route_distance, span_cost_coefficient,
+                            operators, _remaining(time_limit, start))
+    data['distance_scale'] = scale
+    routes = route_set.RouteSet.from_routes(routes, data)
+    if max_route_distance is not None and len(routes.distances) and \
+            routes.distances.max() > max_route_distance + EPSILON:
+        return None
+    routes.objective = int(round(scale * route_objective(
+        routes.distances, max_route_distance, span_cost_coefficient)))
+    return routes
+
+
+def _remaining(time_limit, start):
+    """ Returns what is left of time_limit since start, None if no
+    limit.
+    """
+    if time_limit is None:
+        return None
+    return max(0.0, time_limit - (time.time() - start))
+
+
+class _LocalSearch(object):
+    """ The routes under improvement, with the flat layout the moves are
+    evaluated on: all routes one after the other in flat, the position
+    of every node in it (the depot has none) and the route of every
+    position. Past the deadline the operators stop applying moves.
+    """
+
+    def __init__(self, matrix, routes, neighbors, depot, max_route_distance,
+                 span_cost_coefficient, deadline=None):
+        self.matrix = matrix
+        self.deadline = deadline
+        self.routes = [np.array(route, dtype=np.int64) for route in routes]
+        self.neighbors = neighbors
+        self.depot = depot
+        self.max_route_distance = max_route_distance
+        self.span_cost_coefficient = span_cost_coefficient
+        self._layout()
+
+    def _layout(self):
+        sizes = np.array([len(route) for route in self.routes])
+        self.offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.offsets[1:])
+        self.flat = np.concatenate(self.routes)
+        self.route_of = np.repeat(np.arange(len(sizes)), sizes)
+        inner = np.ones(len(self.flat), dtype=bool)
+        inner[self.offsets[:-1]] = False
+        inner[self.offsets[1:] - 1] = False
+        self.position = np.full(len(self.matrix), -1, dtype=np.int64)
+        self.position[self.flat[inner]] = np.flatnonzero(inner)
+        self.customers = self.flat[inner]
+        arcs = np.zeros(len(self.flat))
+        if len(self.flat) > 1:
+            arcs[:-1] = self.matrix[self.flat[:-1], self.flat[1:]]
+        cumulative = np.concatenate([[0.0], np.cumsum(arcs)])
+        self.lengths = (cumulative[self.offsets[1:] - 1]
+                        - cumulative[self.offsets[:-1]])
+
+    def expired(self):
+        return self.deadline is not None and time.time() > self.deadline
+
+    def _distance(self, from_nodes, to_nodes):
+        return np.asarray(self.matrix[from_nodes, to_nodes],
+                          dtype=np.float64)
+
+    def _candidates(self):
+        """ Returns the (node, neighbor) pairs and their positions."""
+        k = self.neighbors.shape[1]
+        nodes = np.repeat(self.customers, k)
+        others = self.neighbors[self.customers].ravel()
+        return nodes, others, self.position[nodes], self.position[others]
+
+    def objective(self):
+        return route_objective(self.lengths, self.max_route_distance,
+                               self.span_cost_coefficient)
+
+    def two_opt(self):
+        """ Reverses the path between two arcs of a route, for the arcs
+        which make a node adjacent to one of its neighbors.
+        """
+        nodes, others, pos_u, pos_v = self._candidates()
+        same = self.route_of[pos_u] == self.route_of[pos_v]
+        low = np.minimum(pos_u, pos_v)[same]
+        high = np.maximum(pos_u, pos_v)[same]
+        # new arcs (flat[low], flat[high]) or (flat[low - 1], flat[high - 1])
+        low = np.concatenate([low, low - 1])
+        high = np.concatenate([high, high - 1])
+        valid = high - low >= 2
+        low, high = low[valid], high[valid]
+        flat = self.flat
+        gains = (self._distance(flat[low], flat[low + 1])
+                 + self._distance(flat[high], flat[high + 1])
+                 - self._distance(flat[low], flat[high])
+                 - self._distance(flat[low + 1], flat[high + 1]))
+        better = gains > EPSILON
+        if not better.any():
+            return False
+        low, high, gains = low[better], high[better], gains[better]
+        for move in _select_disjoint(gains, low, high + 1):
+            if self.expired():
+                break
+            route = self.route_of[low[move]]
+            start = self.offsets[route]
+            path = self.routes[route]
+            i, j = low[move] - start, high[move] - start
+            path[i + 1:j + 1] = path[i + 1:j + 1][::-1].copy()
+        self._layout()
+        return True
+
+    def _segment_moves(self, segment, inter):
+        """ Evaluates moving the segment of the given length starting at
+        every node next to one of its neighbors, in either orientation.
+
+        Returns
+        -------
+        tuple
+            (delta, start, insert_after, reverse) position arrays,
+            insert_after is the position of the node the segment goes
+            after.
+        """
+        nodes, others, start, pos_v = self._candidates()
+        route = self.route_of[start]
+        end = start + segment - 1
+        valid = end < self.offsets[route + 1] - 1
+        flat = self.flat
+        # insert between (v, next of v) or (previous of v, v).
+        after = np.concatenate([pos_v, pos_v - 1])
+        start, end, route = (np.tile(start, 2), np.tile(end, 2),
+                             np.tile(route, 2))
+        valid = np.tile(valid, 2)
+        target = self.route_of[after]
+        if inter:
+            valid &= target != route
+        else:
+            valid &= (target == route) & ((after < start - 1) | (after > end))
+        if inter and segment == 1:
+            empty = np.flatnonzero(self.offsets[1:] - self.offsets[:-1] == 2)
+            if len(empty):
+                single = self.position[self.customers]
+                after = np.concatenate([after, np.full(len(single),
+                                        self.offsets[empty[0]])])
+                start = np.concatenate([start, single])
+                end = np.concatenate([end, single])
+                route = np.concatenate([route, self.route_of[single]])
+                target = np.concatenate([target, np.full(len(single),
+                                                         empty[0])])
+                valid = np.concatenate([valid, np.ones(len(single),
+                                                       dtype=bool)])
+        start, end, after = start[valid], end[valid], after[valid]
+        route, target = route[valid], target[valid]
+        first, last = flat[start], flat[end]
+        before, following = flat[start - 1], flat[end + 1]
+        x, y = flat[after], flat[after + 1]
+        removal = (self._distance(before, first)
+                   + self._distance(last, following)
+                   - self._distance(before, following))
+        base = self._distance(x, y)
+        forward = self._distance(x, first) + self._distance(last, y) - base
+        backward = self._distance(x, last) + self._distance(first, y) - base
+        reverse = backward < forward
+        insertion = np.where(reverse, backward, forward)
+        if inter:
+            new_source = self.lengths[route] - removal
+            new_target = self.lengths[target] + insertion
+            feasible = np.ones(len(start), dtype=bool)
+            if self.max_route_distance is not None:
+                feasible = (new_target <= self.max_route_distance) & (
+                    (new_source <= self.max_route_distance)
+                    | (new_source <= self.lengths[route]))
+            delta = insertion - removal + self._span_delta(
+                route, new_source, target, new_target)
+        else:
+            feasible = np.ones(len(start), dtype=bool)
+            delta = insertion - removal
+        keep = feasible & (delta < -EPSILON)
+        return (delta[keep], start[keep], after[keep], reverse[keep],
+                route[keep], target[keep])
+
+    def _span_delta(self, route, new_route, target, new_target):
+        """ Change of the span cost when two routes get new lengths."""
+        if not self.span_cost_coefficient:
+            return np.zeros(len(route))
+        order = np.argsort(-self.lengths)[:3]
+        top = self.lengths[order]
+        others = np.full(len(route), 0.0)
+        for rank in range(len(order) - 1, -1, -1):
+            free = (order[rank] != route) & (order[rank] != target)
+            others = np.where(free, top[rank], others)
+        longest = np.maximum(np.maximum(new_route, new_target), others)
+        return self.span_cost_coefficient * (longest - self.lengths.max())
+
+    def or_opt(self):
+        """ Moves segments of 1 to OR_OPT_MAX_SEGMENT nodes elsewhere in
+        their route.
+        """
+        improved = False
+        for segment in range(OR_OPT_MAX_SEGMENT, 0, -1):
+            if self.expired():
+                break
+            delta, start, after, reverse, _, _ = self._segment_moves(
+                segment, inter=False)
+            if not len(delta):
+                continue
+            low = np.minimum(start - 1, after)
+            high = np.maximum(start + segment, after + 1)
+            for move in _select_disjoint(-delta, low, high):
+                if self.expired():
+                    break
+                route = self.route_of[start[move]]
+                offset = self.offsets[route]
+                self.routes[route] = _move_segment(
+                    self.routes[route], start[move] - offset, segment,
+                    after[move] - offset, reverse[move])
+            self._layout()
+            improved = True
+        return improved
+
+    def relocate(self):
+        """ Moves single nodes to another route (an empty one too). The
+        moves of one pass touch distinct routes; if the span cost makes
+        them interfere, only the best one is kept.
+        """
+        delta, start, after, reverse, source, target = self._segment_moves(
+            1, inter=True)
+        if not len(delta):
+            return False
+        before = self.objective()
+        saved = [route.copy() for route in self.routes]
+        touched = set()
+        chosen = []
+        for move in np.argsort(delta, kind='stable'):
+            if source[move] in touched or target[move] in touched:
+                continue
+            touched.update((source[move], target[move]))
+            chosen.append(move)
+        self._relocate(chosen, start, after, source, target)
+        if len(chosen) > 1 and self.objective() >= before - EPSILON:
+            self.routes = saved
+            self._layout()
+            self._relocate(chosen[:1], start, after, source, target)
+        return True
+
+    def _relocate(self, moves, start, after, source, target):
+        routes = self.routes
+        for move in moves:
+            if self.expired():
+                break
+            node = self.flat[start[move]]
+            src, dst = source[move], target[move]
+            position = start[move] - self.offsets[src]
+            routes[src] = np.delete(routes[src], position)
+            at = after[move] - self.offsets[dst] + 1
+            routes[dst] = np.insert(routes[dst], at, node)
+        self._layout()
+
+
+def _move_segment(path, start, segment, after, reverse):
+    """ Returns path with path[start:start + segment] moved behind the
+    node at position after (positions of the original path).
+    """
+    moved = path[start:start + segment]
+    if reverse:
+        moved = moved[::-1]
+    if after < start:
+        return np.concatenate([path[:after + 1], moved,
+                               path[after + 1:start],
+                               path[start + segment:]])
+    return np.concatenate([path[:start], path[start + segment:after + 1],
+                           moved, path[after + 1:]])
+
+
+def _select_disjoint(gains, lows, highs):
+    """ Returns the moves, best gain first, whose closed position
+    intervals [low, high] do not overlap, so they can be applied
+    together.
+    """
+    starts, ends, chosen = [], [], []
+    for move in np.argsort(-gains, kind='stable'):
+        low, high = lows[move], highs[move]
+        k = bisect.bisect_left(starts, low)
+        if k < len(starts) and starts[k] <= high:
+            continue
+        if k > 0 and ends[k - 1] >= low:
+            continue
+        starts.insert(k, low)
+        ends.insert(k, high)
+        chosen.append(move)
+    return chosen
+
+
+def _closest_unvisited(matrix, neighbors, visited, node):
+    """ Returns the closest unvisited node, from the neighbor list if
+    it has one, else from a scan of the row.
+    """
+    candidates = neighbors[node][~visited[neighbors[node]]]
+    if len(candidates):
+        return int(candidates[0])
+    unvisited = np.flatnonzero(~visited)
+    return int(unvisited[np.argmin(matrix[node, unvisited])])
+
+
+def _pad_routes(routes, num_vehicles, depot):
+    routes = [np.asarray(route, dtype=np.int64) for route in routes]
+    while len(routes) < num_vehicles:
+        routes.append(np.array([depot, depot], dtype=np.int64))
+    return routes
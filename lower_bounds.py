@@ -0,0 +1,246 @@
+""" Module which contains lower bounds of the optimal tour length, to
+tell how far a solution of the routing solver can still be from the
+optimum.
+
+The 1-tree bound is a minimum spanning tree of all nodes but one plus
+the two shortest edges of that node. The Held-Karp bound raises it with
+subgradient optimization of node penalties. Both assume a symmetric
+matrix and, for models with several vehicles, the triangle inequality
+(the routes then form a closed walk no shorter than the optimal tour).
+Prim's algorithm takes O(n^2) per tree, so they are meant for the grid
+sizes of grid_tsp, up to a few thousand nodes.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+import numpy as np
+import condensed_matrix
+import heuristics
+import tracing
+
+
+DEFAULT_HELD_KARP_ITERATIONS = 100
+# iterations without a better bound before the step is halved.
+HELD_KARP_PATIENCE = 10
+
+
+def minimum_spanning_tree(matrix, nodes=None, penalties=None):
+    """ Method to find a minimum spanning tree with Prim's algorithm.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray or a condensed_matrix/grid_distances matrix
+        The (n, n) distances.
+    nodes : numpy.ndarray
+        The nodes to span, all of them if None.
+    penalties : numpy.ndarray
+        Added to both ends of every edge (see held_karp_bound).
+
+    Returns
+    -------
+    weight : float
+        Total (penalized) weight of the tree.
+    parents : numpy.ndarray
+        The parent of every node of nodes in the tree (a node id), -1
+        for the root nodes[0].
+    """
+    matrix = condensed_matrix.as_matrix(matrix)
+    if nodes is None:
+        nodes = np.arange(len(matrix))
+    nodes = np.asarray(nodes, dtype=np.int64)
+    if penalties is None:
+        penalties = np.zeros(len(matrix))
+    size = len(nodes)
+    parents = np.full(size, -1, dtype=np.int64)
+    if size < 2:
+        return 0.0, parents
+    in_tree = np.zeros(size, dtype=bool)
+    in_tree[0] = True
+    best = _edge_costs(matrix, nodes[0], nodes, penalties)
+    closest = np.zeros(size, dtype=np.int64)
+    best[0] = np.inf
+    weight = 0.0
+    for _ in range(size - 1):
+        k = int(np.argmin(best))
+        weight += best[k]
+        parents[k] = nodes[closest[k]]
+        in_tree[k] = True
+        best[k] = np.inf
+        costs = _edge_costs(matrix, nodes[k], nodes, penalties)
+        closer = ~in_tree & (costs < best)
+        best[closer] = costs[closer]
+        closest[closer] = k
+    return weight, parents
+
+
+def one_tree_bound(matrix, penalties=None, special=0):
+    """ Method to compute the 1-tree bound.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray or a condensed_matrix/grid_distances matrix
+    penalties : numpy.ndarray
+        Node penalties, the bound is the weight of the penalized 1-tree
+        minus twice their sum.
+    special : int
+        The node left out of the spanning tree (e.g. the depot).
+
+    Returns
+    -------
+    bound : float
+    degrees : numpy.ndarray
+        Degree of every node in the 1-tree.
+    """
+    matrix = condensed_matrix.as_matrix(matrix)
+    size = len(matrix)
+    if penalties is None:
+        penalties = np.zeros(size)
+    degrees = np.zeros(size, dtype=np.int64)
+    if size < 3:
+        bound = 2 * float(matrix[0, size - 1]) if size == 2 else 0.0
+        degrees[:] = 2 if size == 2 else 0
+        return bound, degrees
+    others = np.delete(np.arange(size), special)
+    weight, parents = minimum_spanning_tree(matrix, others, penalties)
+    np.add.at(degrees, others[parents >= 0], 1)
+    np.add.at(degrees, parents[parents >= 0], 1)
+    costs = _edge_costs(matrix, special, others, penalties)
+    nearest = np.argpartition(costs, 1)[:2]
+    weight += costs[nearest].sum()
+    degrees[others[nearest]] += 1
+    degrees[special] = 2
+    return weight - 2 * penalties.sum(), degrees
+
+
+@tracing.traced('bound.held_karp')
+def held_karp_bound(matrix, upper_bound=None,
+                    iterations=DEFAULT_HELD_KARP_ITERATIONS, special=0):
+    """ Method to compute the Held-Karp bound by subgradient optimization
+    of the 1-tree bound: the penalty of every node moves with its degree
+    minus 2, the step follows (upper_bound - bound) and is halved when
+    the bound stalls.
+
+    Parameters
+    ----------
+    matrix : numpy.ndarray or a condensed_matrix/grid_distances matrix
+    upper_bound : float
+        Length of a known tour, found with heuristics.solve if None.
+    iterations : int
+        Maximum number of 1-trees computed.
+    special : int
+        See one_tree_bound.
+
+    Returns
+    -------
+    bound : float
+        The best bound found. If a 1-tree is a tour it is optimal and
+        the iterations stop.
+    penalties : numpy.ndarray
+        The penalties of the best bound.
+    """
+    matrix = condensed_matrix.as_matrix(matrix)
+    size = len(matrix)
+    if upper_bound is None:
+        tour = heuristics.solve({'distance_matrix': matrix,
+                                 'num_vehicles': 1, 'depot': special})
+        upper_bound = float(tour.distances.sum())
+    penalties = np.zeros(size)
+    best_bound, best_penalties = -np.inf, penalties
+    step = 2.0
+    stalled = 0
+    for _ in range(iterations):
+        bound, degrees = one_tree_bound(matrix, penalties, special)
+        if bound > best_bound + heuristics.EPSILON:
+            best_bound, best_penalties = bound, penalties.copy()
+            stalled = 0
+        else:
+            stalled += 1
+            if stalled >= HELD_KARP_PATIENCE:
+                step /= 2
+                stalled = 0
+        subgradient = degrees - 2
+        norm = float(np.dot(subgradient, subgradient))
+        if norm == 0 or step < 1e-4 or upper_bound - bound <= 0:
+            break
+        penalties = penalties + step * (upper_bound - bound) / norm * \
+            subgradient
+    return float(best_bound), best_penalties
+
+
+def tour_lower_bound(data, held_karp=True,
+                     iterations=DEFAULT_HELD_KARP_ITERATIONS,
+                     upper_bound=None):
+    """ Method to compute a lower bound of the total distance of a data
+    model, in the units of its matrix.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model (distance_matrix, num_vehicles, depot).
+    held_karp : bool
+        Improve the 1-tree bound, see held_karp_bound.
+    iterations, upper_bound
+        See held_karp_bound.
+
+    Returns
+    -------
+    float
+    """
+    if held_karp:
+        return held_karp_bound(data['distance_matrix'], upper_bound,
+                               iterations, data['depot'])[0]
+    return one_tree_bound(data['distance_matrix'], special=data['depot'])[0]
+
+
+def optimality_gap(objective, bound):
+    """ Returns the relative gap (objective - bound) / objective, 0 when
+    the objective reaches the bound.
+    """
+    if objective <= 0:
+        return 0.0
+    return max(0.0, (objective - bound) / float(objective))
+
+
+class GapMonitor(object):
+    """ Solution callback for anytime.solve_with_callback which reports
+    the optimality gap of every improving solution and stops the search
+    once it is not above gap_limit.
+
+    Parameters
+    ----------
+    bound : float
+        Lower bound in the units of the matrix (see tour_lower_bound).
+    scale : float
+        The scale of the routing model, objectives are divided by it.
+    gap_limit : float
+        Relative gap (e.g. 0.01) to stop at, None never stops.
+    verbose : bool
+        Print a line for every solution.
+    """
+
+    def __init__(self, bound, scale=1, gap_limit=None, verbose=True):
+        self.bound = bound
+        self.scale = scale
+        self.gap_limit = gap_limit
+        self.verbose = verbose
+        # (elapsed, objective, gap) of every improving solution.
+        self.history = []
+
+    @property
+    def gap(self):
+        return self.history[-1][2] if self.history else None
+
+    def __call__(self, improvement):
+        objective = improvement.objective / float(self.scale)
+        gap = optimality_gap(objective, self.bound)
+        self.history.append((improvement.elapsed, objective, gap))
+        if self.verbose:
+            print('{:.3f}s objective: {:.2f} bound: {:.2f} gap: {:.2%}'
+                  .format(improvement.elapsed, objective, self.bound, gap))
+        return self.gap_limit is not None and gap <= self.gap_limit
+
+
+def _edge_costs(matrix, node, nodes, penalties):
+    return (np.asarray(matrix[node, nodes], dtype=np.float64)
+            + penalties[node] + penalties[nodes])
@@ -6,13 +6,54 @@ or tools.
 
 
 from __future__ import print_function
-# from ortools.constraint_solver import routing_enums_pb2
-# from ortools.constraint_solver import pywrapcp
+from ortools.constraint_solver import routing_enums_pb2
+from ortools.constraint_solver import pywrapcp
 from scipy.spatial import distance
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
+import numpy as np
+import condensed_matrix
+import heuristics
+import route_set
+import tracing
+import io
+import itertools
 import json
 import pdb
 import os
+import struct
+
+
+# metric name -> scipy.spatial.distance.cdist metric.
+DISTANCE_METRICS = {
+    'euclidean': 'euclidean',
+    'manhattan': 'cityblock',
+    'squared': 'sqeuclidean',
+}
+# approximate number of distances computed per block of rows.
+BLOCK_ELEMENTS = 1 << 22
+# binary model container: magic, header length and alignment of the
+# raw matrix blob.
+BINARY_MODEL_MAGIC = b'LPMODEL1'
+BINARY_MODEL_ALIGNMENT = 64
+# distances are multiplied by the scale and rounded before they are
+# handed to the routing solver, which only works with integers.
+DEFAULT_DISTANCE_SCALE = 1
+# condensed matrices of more nodes are registered through a callback over
+# their storage: or tools keeps a registered matrix dense, 8 * n * n
+# bytes (3.2 GB at 20k nodes).
+MAX_TRANSIT_MATRIX_NODES = 5000
+# the scale of the grid entry points, their distances keep two decimals.
+GRID_DISTANCE_SCALE = 100
+# grid files: magic bytes of the numpy binary format and the characters
+# dropped from the legacy "(x, y)" lines.
+NPY_MAGIC = b'\x93NUMPY'
+LEGACY_GRID_TRANSLATION = str.maketrans('()', '  ')
+# engines of solve_routes: the or tools routing solver or the native
+# heuristics of the heuristics module.
+ENGINES = ('ortools', 'native')
 
 
 def create_data_model(distance_matrix, num_vehicles):
@@ -24,6 +65,323 @@ def create_data_model(distance_matrix, num_vehicles):
     return data
 
 
+def quantize_matrix(distance_matrix, scale=DEFAULT_DISTANCE_SCALE):
+    """ Method to convert a distance matrix to the integers of or tools.
+
+    Parameters
+    ----------
+    distance_matrix : list, numpy.ndarray or a condensed_matrix matrix
+        The (n, n) distances.
+    scale : float
+        The factor every distance is multiplied with before it is
+        rounded (e.g. 100 keeps two decimals).
+
+    Returns
+    -------
+    numpy.ndarray
+        The (n, n) int64 matrix.
+    """
+    matrix = np.asarray(distance_matrix, dtype=np.float64)
+    return np.rint(matrix * scale).astype(np.int64)
+
+
+def quantize_rows(distance_matrix, scale=DEFAULT_DISTANCE_SCALE,
+                  node_order=None):
+    """ Generator of the quantized rows of a distance matrix, one at a
+    time, so that no (n, n) float or int copy of the matrix is made (a
+    condensed matrix is never made dense).
+
+    Parameters
+    ----------
+    distance_matrix : list, numpy.ndarray or a condensed_matrix matrix
+    scale : float
+        See quantize_matrix.
+    node_order : numpy.ndarray
+        See create_routing_model.
+
+    Yields
+    ------
+    numpy.ndarray
+        Row i as int64, as quantize_matrix would give it.
+    """
+    row = getattr(distance_matrix, 'row', None)
+    nodes = range(len(distance_matrix)) if node_order is None \
+        else node_order
+    for i in nodes:
+        values = np.asarray(row(i) if row is not None else distance_matrix[i])
+        if node_order is not None:
+            values = values[node_order]
+        if scale == 1 and values.dtype.kind in 'iu':
+            yield values.astype(np.int64, copy=False)
+        else:
+            values = values.astype(np.float64, copy=False)
+            yield np.rint(values * scale).astype(np.int64)
+
+
+def quantize_condensed(matrix, scale=DEFAULT_DISTANCE_SCALE, out=None):
+    """ Method to quantize a condensed matrix block by block, so that it
+    is neither made dense nor copied as float64 as a whole.
+
+    Parameters
+    ----------
+    matrix : condensed_matrix.CondensedMatrix
+    scale : float
+        See quantize_matrix.
+    out : numpy.ndarray
+        Array of len(matrix.values) integers to write the values to.
+        Defaults to a new int32 array, int64 if the values do not fit.
+
+    Returns
+    -------
+    condensed_matrix.CondensedMatrix
+        The quantized matrix over out.
+    """
+    values = matrix.values
+    if out is None:
+        out = np.empty(values.shape, dtype=quantized_dtype(matrix, scale))
+    for start in range(0, len(values), BLOCK_ELEMENTS):
+        block = values[start:start + BLOCK_ELEMENTS].astype(np.float64)
+        out[start:start + BLOCK_ELEMENTS] = np.rint(block * scale)
+    return condensed_matrix.CondensedMatrix(out, matrix.size)
+
+
+def quantized_dtype(matrix, scale=DEFAULT_DISTANCE_SCALE):
+    """ Returns int32 if the quantized values of a condensed matrix fit
+    in it, int64 otherwise.
+    """
+    values = matrix.values
+    largest = float(np.abs(values).max()) if len(values) else 0.0
+    if round(largest * scale) <= np.iinfo(np.int32).max:
+        return np.dtype(np.int32)
+    return np.dtype(np.int64)
+
+
+def quantize_model(data, scale=DEFAULT_DISTANCE_SCALE):
+    """ Method to quantize the matrix of a data model once, e.g. before
+    it is written for or shared with worker processes.
+
+    create_routing_model registers the matrix of the returned model as
+    it is, without converting it again, as long as it is called with
+    the same scale. Route distances (see route_set) are divided back to
+    the units of the original matrix.
+
+    Returns
+    -------
+    data : dictionary
+        A copy of the model with the quantized distance_matrix and
+        'quantized_scale': a condensed matrix stays condensed (see
+        quantize_condensed), any other one becomes an int64 (n, n)
+        array. A matrix without storage (see condensed_matrix.is_implicit)
+        is kept as it is and quantized per arc by create_routing_model.
+    """
+    distances = data['distance_matrix']
+    quantized = dict(data)
+    if condensed_matrix.is_implicit(distances):
+        return quantized
+    if isinstance(distances, condensed_matrix.CondensedMatrix):
+        matrix = quantize_condensed(distances, scale)
+    else:
+        matrix = np.empty((len(distances), len(distances)), dtype=np.int64)
+        for i, row in enumerate(quantize_rows(distances, scale)):
+            matrix[i] = row
+    quantized['distance_matrix'] = matrix
+    quantized['quantized_scale'] = scale
+    return quantized
+
+
+def transit_matrix(distance_matrix, scale=DEFAULT_DISTANCE_SCALE,
+                   node_order=None):
+    """ Method to build the matrix RegisterTransitMatrix takes, a list of
+    lists of python ints, row by row (see quantize_rows). The list, which
+    the or tools binding needs, is the only (n, n) intermediate.
+    """
+    return [row.tolist() for row in
+            quantize_rows(distance_matrix, scale, node_order)]
+
+
+@tracing.traced('model.setup')
+def create_routing_model(data, scale=DEFAULT_DISTANCE_SCALE,
+                         max_route_distance=None, span_cost_coefficient=100,
+                         dimension_name='Distance', node_order=None):
+    """ Method to build the or tools routing model of a data model.
+
+    The quantized distance matrix is registered natively with
+    RegisterTransitMatrix, so no python callback is evaluated during
+    the search. An implicit matrix (one with a transit_callback method,
+    e.g. grid_distances.GridDistanceMatrix) and a condensed matrix of
+    more than MAX_TRANSIT_MATRIX_NODES nodes are registered through
+    their callback instead, so the matrix is never materialized, at the
+    cost of a python call per arc evaluated.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model (distance_matrix, num_vehicles, depot). The
+        scale is stored back to it as 'distance_scale'. The matrix of a
+        model with 'quantized_scale' (see quantize_model) is registered
+        as it is.
+    scale : float
+        See quantize_matrix.
+    max_route_distance : float
+        If given, a distance dimension with this maximum travel distance
+        per vehicle (in the units of the matrix) is added.
+    span_cost_coefficient : int
+        The global span cost coefficient of the distance dimension.
+    dimension_name : str
+        The name of the distance dimension.
+    node_order : numpy.ndarray
+        Relabels the nodes without copying the matrix: node k of the
+        routing model is node node_order[k] of the matrix. The depot
+        should keep its id.
+
+    Returns
+    -------
+    manager : ortools RoutingIndexManager
+    routing : ortools RoutingModel
+    transit_callback_index : int
+    """
+    distances = data['distance_matrix']
+    matrix_scale = scale
+    if data.get('quantized_scale') is not None:
+        if data['quantized_scale'] != scale:
+            raise ValueError("the matrix is quantized with scale %s, not %s"
+                             % (data['quantized_scale'], scale))
+        matrix_scale = 1
+    manager = pywrapcp.RoutingIndexManager(len(distances),
+                                           data['num_vehicles'],
+                                           data['depot'])
+    routing = pywrapcp.RoutingModel(manager)
+    transit_callback = getattr(distances, 'transit_callback', None)
+    if isinstance(distances, condensed_matrix.CondensedMatrix) and \
+            len(distances) <= MAX_TRANSIT_MATRIX_NODES:
+        transit_callback = None
+    if transit_callback is not None:
+        callback_manager = manager if node_order is None else \
+            _RelabeledIndexManager(manager, node_order)
+        transit_callback_index = routing.RegisterTransitCallback(
+            transit_callback(callback_manager, matrix_scale))
+    else:
+        transit_callback_index = routing.RegisterTransitMatrix(
+            transit_matrix(distances, matrix_scale, node_order))
+    # Define cost of each arc.
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    if max_route_distance is not None:
+        routing.AddDimension(
+            transit_callback_index,
+            0,  # no slack
+            int(round(max_route_distance * scale)),
+            True,  # start cumul to zero
+            dimension_name)
+        distance_dimension = routing.GetDimensionOrDie(dimension_name)
+        distance_dimension.SetGlobalSpanCostCoefficient(span_cost_coefficient)
+    data['distance_scale'] = scale
+    return manager, routing, transit_callback_index
+
+
+class _RelabeledIndexManager(object):
+    """ The index manager the transit callback of a relabeled model sees
+    (see create_routing_model), mapping indices to matrix nodes.
+    """
+
+    def __init__(self, manager, node_order):
+        self.manager = manager
+        self.node_order = node_order
+
+    def GetNumberOfIndices(self):
+        return self.manager.GetNumberOfIndices()
+
+    def IndexToNode(self, index):
+        return int(self.node_order[self.manager.IndexToNode(index)])
+
+
+def create_search_parameters(first_solution_strategy='PATH_CHEAPEST_ARC',
+                             local_search_metaheuristic=None,
+                             time_limit=None):
+    """ Method to create the search parameters of the routing solver.
+
+    Parameters
+    ----------
+    first_solution_strategy : str
+        Name of a routing_enums_pb2.FirstSolutionStrategy value.
+    local_search_metaheuristic : str
+        Name of a routing_enums_pb2.LocalSearchMetaheuristic value
+        (e.g. 'GUIDED_LOCAL_SEARCH'). None keeps the default.
+    time_limit : float
+        Time limit of the search in seconds. None means no limit.
+
+    Returns
+    -------
+    search_parameters : ortools RoutingSearchParameters
+    """
+    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
+    search_parameters.first_solution_strategy = (
+        getattr(routing_enums_pb2.FirstSolutionStrategy,
+                first_solution_strategy))
+    if local_search_metaheuristic is not None:
+        search_parameters.local_search_metaheuristic = (
+            getattr(routing_enums_pb2.LocalSearchMetaheuristic,
+                    local_search_metaheuristic))
+    if time_limit is not None:
+        search_parameters.time_limit.FromMilliseconds(
+            max(1, int(time_limit * 1000)))
+    return search_parameters
+
+
+def solve_routes(data, engine='ortools', scale=DEFAULT_DISTANCE_SCALE,
+                 max_route_distance=None,
+                 first_solution_strategy='PATH_CHEAPEST_ARC',
+                 local_search_metaheuristic=None, time_limit=None,
+                 budget=None):
+    """ Method to solve a data model with the chosen engine.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model (distance_matrix, num_vehicles, depot).
+    engine : str
+        One of ENGINES. 'native' builds the routes with the savings
+        heuristic and improves them with local search, without a routing
+        model, for instances where routes are needed at once.
+    scale, max_route_distance
+        See create_routing_model.
+    first_solution_strategy, local_search_metaheuristic, time_limit
+        See create_search_parameters, the native engine only uses the
+        time limit.
+    budget : search_budget.SearchBudget
+        Stopping rules of the or tools search, e.g. to stop a guided
+        local search once it stagnates. The native engine ignores it.
+
+    Returns
+    -------
+    route_set.RouteSet
+        The routes, None if no solution was found.
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown engine '%s'. Choose one of %s."
+                         % (engine, ', '.join(ENGINES)))
+    if engine == 'native':
+        return heuristics.solve(data, scale=scale,
+                                max_route_distance=max_route_distance,
+                                time_limit=time_limit)
+    manager, routing, _ = create_routing_model(
+        data, scale=scale, max_route_distance=max_route_distance)
+    search_parameters = create_search_parameters(
+        first_solution_strategy, local_search_metaheuristic, time_limit)
+    if budget is None:
+        solution = routing.SolveWithParameters(search_parameters)
+    else:
+        solution = budget.solve(routing, search_parameters)
+    if not solution:
+        return None
+    return get_route_set(data, manager, routing, solution)
+
+
+def get_distance_scale(data):
+    """ Returns the scale the model's distances were quantized with."""
+    return data.get('distance_scale', DEFAULT_DISTANCE_SCALE)
+
+
+@tracing.traced('model.read_json')
 def read_model_from_file(a_file):
     """ Method to read the data model from a file.
 
@@ -42,6 +400,7 @@ def read_model_from_file(a_file):
         return data
 
 
+@tracing.traced('model.write_json')
 def write_model_to_file(data, a_file):
     """ Method to write model to a file.
 
@@ -54,7 +413,131 @@ def write_model_to_file(data, a_file):
 
     """
     with open(a_file, 'w') as outfile:
-        json.dump(data, outfile)
+        json.dump(data, outfile, default=_to_json_serializable)
+
+
+def _to_json_serializable(obj):
+    """ Converts numpy arrays and scalars for the json encoder."""
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    if isinstance(obj, (condensed_matrix.CondensedMatrix,
+                        condensed_matrix.DenseMatrix)):
+        return obj.to_dense().tolist()
+    raise TypeError("Object of type %s is not JSON serializable"
+                    % type(obj).__name__)
+
+
+@tracing.traced('model.write_binary')
+def write_model_to_binary(data, a_file, dtype=None):
+    """ Method to write the model to a binary, memory-mappable file.
+
+    The file holds the magic bytes, the length of a small json header
+    (num_vehicles, depot, the rest of the model keys and the matrix
+    dtype/shape/format) and then the raw C-ordered distance matrix,
+    aligned to BINARY_MODEL_ALIGNMENT bytes. A condensed matrix is
+    written as its values, in the 'condensed' format.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model.
+    a_file : str
+        The filename (relative path) of the file to be written.
+    dtype : numpy dtype
+        The dtype the matrix is stored as. Defaults to the matrix' own
+        dtype (float64 for lists).
+    """
+    distances = data['distance_matrix']
+    header = {key: value for key, value in data.items()
+              if key != 'distance_matrix'}
+    if condensed_matrix.is_implicit(distances):
+        raise ValueError("an implicit distance_matrix (%s) has no storage "
+                         "to write" % type(distances).__name__)
+    if isinstance(distances, condensed_matrix.CondensedMatrix):
+        matrix = np.ascontiguousarray(distances.values, dtype=dtype)
+        header['matrix_format'] = 'condensed'
+        shape = distances.shape
+    else:
+        matrix = np.ascontiguousarray(distances, dtype=dtype)
+        if matrix.ndim != 2:
+            raise ValueError("distance_matrix must be two dimensional, got "
+                             "shape %s" % (matrix.shape,))
+        shape = matrix.shape
+    header['matrix_dtype'] = matrix.dtype.str
+    header['matrix_shape'] = list(shape)
+    header_bytes = json.dumps(header, default=_to_json_serializable).encode()
+    prefix_len = len(BINARY_MODEL_MAGIC) + 4 + len(header_bytes)
+    padding = -prefix_len % BINARY_MODEL_ALIGNMENT
+    header_bytes += b' ' * padding
+    with open(a_file, 'wb') as outfile:
+        outfile.write(BINARY_MODEL_MAGIC)
+        outfile.write(struct.pack('<I', len(header_bytes)))
+        outfile.write(header_bytes)
+        matrix.tofile(outfile)
+
+
+@tracing.traced('model.read_binary')
+def read_model_from_binary(a_file, mmap=True):
+    """ Method to read a model written by write_model_to_binary.
+
+    Parameters
+    ----------
+    a_file : str
+        The filename (relative path) of the file to be read.
+    mmap : bool
+        If True the distance matrix is a read-only numpy.memmap over
+        the file, so nothing is loaded until it is used. Otherwise the
+        matrix is read into memory.
+
+    Returns
+    -------
+    data : dictionary
+        The data model. A matrix in the 'condensed' format is a
+        condensed_matrix.CondensedMatrix over its values.
+    """
+    header, offset = _read_binary_header(a_file)
+    dtype = np.dtype(header.pop('matrix_dtype'))
+    shape = tuple(header.pop('matrix_shape'))
+    size = shape[0]
+    condensed = header.pop('matrix_format', 'dense') == 'condensed'
+    if condensed:
+        shape = (size * (size - 1) // 2,)
+    count = int(np.prod(shape))
+    if mmap and count > 0:
+        matrix = np.memmap(a_file, dtype=dtype, mode='r', offset=offset,
+                           shape=shape)
+    else:
+        with open(a_file, 'rb') as infile:
+            infile.seek(offset)
+            matrix = np.fromfile(infile, dtype=dtype,
+                                 count=count).reshape(shape)
+    data = header
+    data['distance_matrix'] = condensed_matrix.CondensedMatrix(
+        matrix, size) if condensed else matrix
+    return data
+
+
+def _read_binary_header(a_file):
+    """ Returns the json header of a binary model and the offset of the
+    matrix blob.
+    """
+    with open(a_file, 'rb') as infile:
+        magic = infile.read(len(BINARY_MODEL_MAGIC))
+        if magic != BINARY_MODEL_MAGIC:
+            raise ValueError("%s is not a binary model file" % a_file)
+        header_len, = struct.unpack('<I', infile.read(4))
+        header = json.loads(infile.read(header_len).decode())
+    return header, len(BINARY_MODEL_MAGIC) + 4 + header_len
+
+
+def convert_json_model_to_binary(json_file, binary_file, dtype=None):
+    """ Method to convert a json model to the binary format."""
+    write_model_to_binary(read_model_from_file(json_file), binary_file, dtype)
+
+
+def convert_binary_model_to_json(binary_file, json_file):
+    """ Method to convert a binary model to the json format."""
+    write_model_to_file(read_model_from_binary(binary_file), json_file)
 
 
 def print_route_solution():
@@ -72,21 +555,111 @@ def calc_matrix_euclidean_distance(points_matrix):
 
     Returns
     -------
-    distance_matrix : list
-        A list which contains lists with the distance between the
-        points given to the points_matrix (input).
-    """
-    distance_matrix = []
-    row_matrix = []
-    for point_a in points_matrix:
-        for point_b in points_matrix:
-            dst = distance.euclidean(point_a, point_b)
-            row_matrix.append(dst)
-        distance_matrix.append(row_matrix)
-        row_matrix = []
+    distance_matrix : numpy.ndarray
+        A (n, n) array with the distance between the points given to
+        the points_matrix (input).
+    """
+    return calc_distance_matrix(points_matrix, metric='euclidean')
+
+
+@tracing.traced('matrix.build')
+def calc_distance_matrix(points_matrix, metric='euclidean', block_size=None,
+                         dtype=np.float64):
+    """ Method to calculate the full distance matrix of a set of points.
+
+    The matrix is computed in blocks of rows, each block in a single
+    vectorized call, so the temporary memory stays bounded no matter
+    how many points are given.
+
+    Parameters
+    ----------
+    points_matrix : list or numpy.ndarray
+        A matrix containing point coordinates (x,y), one row per point.
+    metric : str
+        One of the keys of DISTANCE_METRICS ('euclidean', 'manhattan',
+        'squared').
+    block_size : int
+        Number of rows computed at once. If None, it is chosen so that
+        a block holds about BLOCK_ELEMENTS distances.
+    dtype : numpy dtype
+        The dtype of the returned matrix.
+
+    Returns
+    -------
+    distance_matrix : numpy.ndarray
+        A (n, n) array with the distance between every pair of points.
+    """
+    if metric not in DISTANCE_METRICS:
+        raise ValueError("Unknown metric '%s'. Choose one of %s."
+                         % (metric, ', '.join(sorted(DISTANCE_METRICS))))
+    points = np.asarray(points_matrix, dtype=np.float64)
+    if points.ndim == 1:
+        points = points.reshape(-1, 1)
+    num_points = len(points)
+    distance_matrix = np.empty((num_points, num_points), dtype=dtype)
+    if num_points == 0:
+        return distance_matrix
+    if block_size is None:
+        block_size = max(1, BLOCK_ELEMENTS // num_points)
+    scipy_metric = DISTANCE_METRICS[metric]
+    direct_output = distance_matrix.dtype == np.float64
+    for start in range(0, num_points, block_size):
+        stop = min(start + block_size, num_points)
+        if direct_output:
+            # rows of a C-ordered array are contiguous, write in place.
+            distance.cdist(points[start:stop], points, scipy_metric,
+                           out=distance_matrix[start:stop])
+        else:
+            distance_matrix[start:stop] = distance.cdist(
+                points[start:stop], points, scipy_metric)
     return distance_matrix
 
 
+@tracing.traced('matrix.build')
+def calc_condensed_distance_matrix(points_matrix, metric='euclidean',
+                                   dtype=np.float32, block_size=None):
+    """ Method to calculate the distance matrix of a set of points in
+    condensed form, only the upper triangle stored (see
+    condensed_matrix.CondensedMatrix).
+
+    Parameters
+    ----------
+    points_matrix : list or numpy.ndarray
+        A matrix containing point coordinates (x,y), one row per point.
+    metric : str
+        One of the keys of DISTANCE_METRICS.
+    dtype : numpy dtype
+        float32 by default, the storage holds n * (n - 1) / 2 of them.
+    block_size : int
+        Number of rows computed at once, see calc_distance_matrix.
+
+    Returns
+    -------
+    condensed_matrix.CondensedMatrix
+    """
+    if metric not in DISTANCE_METRICS:
+        raise ValueError("Unknown metric '%s'. Choose one of %s."
+                         % (metric, ', '.join(sorted(DISTANCE_METRICS))))
+    points = np.asarray(points_matrix, dtype=np.float64)
+    if points.ndim == 1:
+        points = points.reshape(-1, 1)
+    num_points = len(points)
+    matrix = condensed_matrix.CondensedMatrix.empty(num_points, dtype)
+    if num_points < 2:
+        return matrix
+    if block_size is None:
+        block_size = max(1, BLOCK_ELEMENTS // num_points)
+    scipy_metric = DISTANCE_METRICS[metric]
+    for start in range(0, num_points - 1, block_size):
+        stop = min(start + block_size, num_points - 1)
+        block = distance.cdist(points[start:stop], points[start + 1:],
+                               scipy_metric)
+        # row i of the block starts at its own diagonal.
+        for i in range(start, stop):
+            matrix.upper_row(i)[:] = block[i - start, i - start:]
+    return matrix
+
+
 def create_simple_grid(x_dim, y_dim):
     """ Method to create a grid of points of equal distance.
 
@@ -109,41 +682,118 @@ def create_simple_grid(x_dim, y_dim):
     return points_matrix
 
 
+@tracing.traced('grid.write')
 def write_grid_to_file(points_matrix, output_file):
     """ Method to write a grid's points to a file.
+
+    Files ending in '.npy' are written as binary numpy arrays, any
+    other file as plain 'x,y' lines.
+
     Parameters
     ---------
-    points_matrix : list
+    points_matrix : list or numpy.ndarray
         a list of tuples (x,y) representing the coordinates of points.
     output_file : str
         the filename where the grid points will be written.
     """
-    with open(output_file, 'w') as outfile:
-        for point in points_matrix:
-            coords = str(point)
-            outfile.write("%s\n" % coords)
-        #outfile.write(','.join('%s %s' % x for x in points_matrix))
+    points = np.asarray(points_matrix)
+    if output_file.endswith('.npy'):
+        np.save(output_file, points)
+        return
+    if points.dtype.kind == 'f':
+        fmt = '%.17g'
+    else:
+        fmt = '%d'
+    np.savetxt(output_file, points.reshape(len(points), -1), fmt=fmt,
+               delimiter=',')
 
 
+@tracing.traced('grid.read')
 def read_grid_from_file(input_file):
     """ Method to read points from a file and build a grid with them.
-    
+
+    Reads the '.npy' and 'x,y' formats of write_grid_to_file as well as
+    the legacy '(x, y)' lines of older grid files.
+
     Parameters
     ----------
     input_file : str
         The filepath with the grid points.
-    
+
     Returns
     -------
-    points_matrix : list
-        a list of tuples (x,y) representing the coordinates of points.
+    points_matrix : numpy.ndarray
+        a (n, 2) array with the coordinates (x,y) of the points.
     """
-    points_matrix = []
+    if _is_npy_file(input_file):
+        return np.load(input_file)
     with open(input_file, 'r') as infile:
-        content = infile.read().splitlines()
-        for coord in content:
-            points_matrix.append(eval(coord))
-    return points_matrix
+        content = infile.read()
+    if content.lstrip().startswith('('):
+        # legacy format, drop the parentheses and parse it as csv.
+        content = content.translate(LEGACY_GRID_TRANSLATION)
+    if not content.strip():
+        return np.empty((0, 2))
+    return np.loadtxt(io.StringIO(content), delimiter=',', ndmin=2)
+
+
+def iter_grid_from_file(input_file, chunk_size=1 << 16):
+    """ Method to read the points of a grid file in chunks, for files
+    too big to be loaded at once.
+
+    Parameters
+    ----------
+    input_file : str
+        The filepath with the grid points (any read_grid_from_file
+        format).
+    chunk_size : int
+        The maximum number of points per chunk.
+
+    Yields
+    ------
+    numpy.ndarray
+        (m, 2) arrays of consecutive points, m <= chunk_size.
+    """
+    if _is_npy_file(input_file):
+        points = np.load(input_file, mmap_mode='r')
+        for start in range(0, len(points), chunk_size):
+            yield np.array(points[start:start + chunk_size])
+        return
+    with open(input_file, 'r') as infile:
+        while True:
+            lines = list(itertools.islice(infile, chunk_size))
+            if not lines:
+                return
+            chunk = ''.join(lines).translate(LEGACY_GRID_TRANSLATION)
+            if chunk.strip():
+                yield np.loadtxt(io.StringIO(chunk), delimiter=',', ndmin=2)
+
+
+def _is_npy_file(a_file):
+    """ Checks the magic bytes of a numpy binary file."""
+    with open(a_file, 'rb') as infile:
+        return infile.read(6) == NPY_MAGIC
+
+
+@tracing.traced('routes.extract')
+def get_route_set(data, manager, routing, solution=None):
+    """ Method to read all the routes of a solution, in a single pass.
+
+    Parameters
+    ----------
+    data : dictionary
+        The model containing the data for the optimization model.
+    manager : ortools objects
+    routing : ortools routing
+    solution : ortools solution as found, None inside a solution
+        callback of the routing model.
+
+    Returns
+    -------
+    route_set.RouteSet
+        The routes with their distances and loads.
+    """
+    return route_set.RouteSet.from_solution(data, manager, routing, solution)
 
 
 def get_all_routes(data, manager, routing, solution):
@@ -162,11 +812,27 @@ def get_all_routes(data, manager, routing, solution):
     all_paths : dictionary
         A dictionary full of key:path pairs.
     """
-    all_paths = {}
-    for vehicle_id in range(data['num_vehicles']):
-        all_paths[vehicle_id] = get_single_route_nodes(
-                                    manager, routing, solution, vehicle_id)
-    return all_paths
+    return get_route_set(data, manager, routing, solution).to_dict()
+
+
+def get_current_routes(data, manager, routing):
+    """ Method to get the routes of all vehicles from inside a solution
+    callback of the routing model, where no assignment object exists
+    yet.
+
+    Parameters
+    ----------
+    data : dictionary
+        The model containing the data for the optimization model.
+    manager : ortools objects
+    routing : ortools routing
+
+    Returns
+    -------
+    all_paths : dictionary
+        A dictionary full of vehicle_id:path pairs.
+    """
+    return route_set.RouteSet.from_solution(data, manager, routing).to_dict()
 
 
 def get_single_route_nodes(manager, routing, solution, vehicle_id):
@@ -184,15 +850,11 @@ def get_single_route_nodes(manager, routing, solution, vehicle_id):
     solution_nodes: list
         A list of all nodes that consist the solution.
     """
-    print('Objective: {} miles'.format(solution.ObjectiveValue()))
     index = routing.Start(vehicle_id)
     solution_nodes = []
-    route_distance = 0
     while not routing.IsEnd(index):
         solution_nodes.append(manager.IndexToNode(index))
-        previous_index = index
         index = solution.Value(routing.NextVar(index))
-        route_distance += routing.GetArcCostForVehicle(previous_index, index, 0)
     solution_nodes.append(manager.IndexToNode(index))
     return solution_nodes
 
@@ -225,28 +887,136 @@ def print_grid(nodes, color='ro'):
 def print_solution_to_grid(nodes, solution_path, axis, color):
     """ Method to print the solution to grid."""
     x_axis, y_axis = axis
-    for n in solution_path:
-        x, y = nodes[n]
-        x_axis.append(x)
-        y_axis.append(y)
-        # print("Node is %s and coords are %s" %(n, nodes[n]))
-    for n in range(0, len(solution_path)-1):
-        plt.plot([x_axis[solution_path[n]],
-                  x_axis[solution_path[n+1]]],
-                  [y_axis[solution_path[n]],
-                  y_axis[solution_path[n+1]]],
-                  color)
-        #plt.draw()
-        #plt.pause(0.01)
-
-
-def print_paths_to_grid(data, nodes, solutions_path):
-    """ Method to print the paths to an already printed grid."""
-    axis = print_grid(nodes, 'ro')
-    for vehicle_id in range(data['num_vehicles']):
-        color = get_plot_color(vehicle_id)
-        print_solution_to_grid(nodes, solutions_path[vehicle_id], axis, color)
-    #plt.show(block=False)
+    points = np.asarray(nodes, dtype=np.float64)
+    coords = points[np.asarray(solution_path, dtype=np.intp)]
+    x_axis.extend(coords[:, 0].tolist())
+    y_axis.extend(coords[:, 1].tolist())
+    ax = plt.gca()
+    ax.add_collection(LineCollection(_route_segments(points, solution_path),
+                                     colors=color))
+    ax.autoscale_view()
+
+
+@tracing.traced('plot.draw')
+def print_paths_to_grid(data, nodes, solutions_path, animate=False,
+                        pause=0.2):
+    """ Method to print the paths to an already printed grid.
+
+    Every route is drawn as a single LineCollection. With animate=True
+    the routes are drawn segment by segment on an interactive backend,
+    pausing pause seconds after each one.
+    """
+    routes = [solutions_path[vehicle_id]
+              for vehicle_id in range(data['num_vehicles'])]
+    if animate:
+        animate_routes(nodes, routes, pause=pause)
+    else:
+        draw_routes(plt.gca(), nodes, routes)
+
+
+def _route_segments(points, route):
+    """ Returns the (len(route) - 1, 2, 2) array of the route segments.
+    Separate segments render faster than one long polyline when the
+    route crosses itself a lot.
+    """
+    coords = points[np.asarray(route, dtype=np.intp)]
+    return np.stack([coords[:-1], coords[1:]], axis=1)
+
+
+def _iter_routes(routes):
+    """ Yields (vehicle_id, route) pairs of a dict or a list of routes."""
+    if hasattr(routes, 'items'):
+        return sorted(routes.items())
+    return enumerate(routes)
+
+
+def draw_routes(ax, nodes, routes, node_style='ro', markersize=2,
+                linewidth=1.0, color=None):
+    """ Method to draw the nodes and the routes on a matplotlib axes.
+
+    Parameters
+    ----------
+    ax : matplotlib Axes
+    nodes : list or numpy.ndarray
+        The (x, y) coordinates of the nodes.
+    routes : dictionary or list
+        vehicle_id: nodes pairs (as returned by get_all_routes) or a
+        list of routes.
+    node_style : str
+        Format of the node markers, None to skip them.
+    color : str
+        Color of every route, by default each vehicle gets the color of
+        get_plot_color.
+
+    Returns
+    -------
+    collections : list
+        One LineCollection per drawn route.
+    """
+    points = np.asarray(nodes, dtype=np.float64)
+    if node_style is not None:
+        ax.plot(points[:, 0], points[:, 1], node_style,
+                markersize=markersize)
+    collections = []
+    for vehicle_id, route in _iter_routes(routes):
+        if len(route) < 2:
+            continue
+        collection = LineCollection(
+            _route_segments(points, route),
+            colors=color or get_plot_color(vehicle_id), linewidths=linewidth)
+        ax.add_collection(collection)
+        collections.append(collection)
+    ax.autoscale_view()
+    return collections
+
+
+@tracing.traced('plot.render')
+def render_routes_to_file(nodes, routes, a_file, figsize=(8, 8), dpi=100,
+                          file_format=None):
+    """ Method to render the routes straight to an image file.
+
+    The figure is drawn on its own Agg canvas, so no GUI backend is
+    needed and the pyplot state is left untouched.
+
+    Parameters
+    ----------
+    nodes, routes
+        See draw_routes.
+    a_file : str or file-like
+        Where the image is written.
+    figsize : tuple
+        Size of the figure in inches.
+    dpi : int
+    file_format : str
+        Image format, deduced from the file name if None.
+    """
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    draw_routes(figure.add_subplot(111), nodes, routes)
+    figure.savefig(a_file, dpi=dpi, format=file_format)
+
+
+def animate_routes(nodes, routes, pause=0.2, ax=None, color=None):
+    """ Method to draw the routes segment by segment (needs an
+    interactive backend to be seen).
+
+    Every route is still a single LineCollection, which grows by one
+    segment per frame.
+    """
+    if ax is None:
+        ax = plt.gca()
+    points = np.asarray(nodes, dtype=np.float64)
+    draw_routes(ax, points, [], markersize=6)
+    plt.show(block=False)
+    for vehicle_id, route in _iter_routes(routes):
+        segments = _route_segments(points, route)
+        collection = LineCollection(
+            [], colors=color or get_plot_color(vehicle_id))
+        ax.add_collection(collection)
+        for n in range(1, len(segments) + 1):
+            collection.set_segments(segments[:n])
+            plt.draw()
+            plt.pause(pause)
 
 
 def get_plot_color(vehicle_id):
@@ -255,6 +1025,7 @@ def get_plot_color(vehicle_id):
     return color_list[vehicle_id % len(color_list)]
 
 
+@tracing.traced('plot.save')
 def save_fig_to_file(filedir):
     """ Method to save a matplotlib figure as a file.
     """
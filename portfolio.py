@@ -0,0 +1,201 @@
+""" Module which runs a portfolio of routing solver configurations in
+parallel processes and keeps the best solution found within a shared
+wall-clock budget.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from collections import namedtuple
+import multiprocessing
+import queue
+import time
+import numpy as np
+import optops
+import shared_matrix
+
+
+# seed 0 keeps the node order of the model, any other seed relabels the
+# nodes (the depot stays in place) so ties are broken differently.
+SolverConfig = namedtuple('SolverConfig', ['name', 'first_solution_strategy',
+                                           'local_search_metaheuristic',
+                                           'seed'])
+
+DEFAULT_PORTFOLIO = [
+    SolverConfig('pca-gls', 'PATH_CHEAPEST_ARC', 'GUIDED_LOCAL_SEARCH', 0),
+    SolverConfig('savings-gls', 'SAVINGS', 'GUIDED_LOCAL_SEARCH', 0),
+    SolverConfig('christofides-tabu', 'CHRISTOFIDES', 'TABU_SEARCH', 0),
+    SolverConfig('pca-sa', 'PATH_CHEAPEST_ARC', 'SIMULATED_ANNEALING', 0),
+    SolverConfig('insertion-gls', 'PARALLEL_CHEAPEST_INSERTION',
+                 'GUIDED_LOCAL_SEARCH', 0),
+    SolverConfig('pca-gls-seed1', 'PATH_CHEAPEST_ARC', 'GUIDED_LOCAL_SEARCH',
+                 1),
+    SolverConfig('pca-tabu-seed2', 'PATH_CHEAPEST_ARC', 'TABU_SEARCH', 2),
+    SolverConfig('pma-gls-seed3', 'PATH_MOST_CONSTRAINED_ARC',
+                 'GUIDED_LOCAL_SEARCH', 3),
+]
+
+# seconds the workers get to report after the budget is over before
+# they are terminated.
+SHUTDOWN_GRACE = 1.0
+
+
+def solve_portfolio(data, configs=None, time_limit=10, num_workers=None,
+                    target_objective=None, scale=optops.DEFAULT_DISTANCE_SCALE,
+                    max_route_distance=None):
+    """ Method to solve a model with several configurations at once.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model (distance_matrix, num_vehicles, depot).
+    configs : list
+        A list of SolverConfig. Defaults to DEFAULT_PORTFOLIO.
+    time_limit : float
+        The wall-clock budget (seconds) shared by all configurations.
+    num_workers : int
+        Number of concurrent processes, defaults to the cpu count.
+        Configurations beyond it start when a worker is free.
+    target_objective : int
+        If given, all workers are stopped as soon as one of them finds
+        a solution with an objective not above it.
+    scale, max_route_distance
+        See optops.create_routing_model.
+
+    Returns
+    -------
+    result : dictionary
+        'objective', 'routes' (vehicle_id: nodes) and 'config' of the
+        best solution (None if no solution was found), 'found_at' (s),
+        'wall_time' (s), 'stopped_early' and 'runs' with the best
+        objective and status of every configuration.
+    """
+    if configs is None:
+        configs = DEFAULT_PORTFOLIO
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    # the workers attach to one shared matrix, quantized once, instead of
+    # unpickling their own (see shared_matrix for what stays per worker).
+    with shared_matrix.SharedMatrixManager() as matrices:
+        return _run_portfolio(matrices.share(data, scale), configs,
+                              time_limit, num_workers, target_objective,
+                              scale, max_route_distance)
+
+
+def _run_portfolio(data, configs, time_limit, num_workers, target_objective,
+                   scale, max_route_distance):
+    """ Runs the configurations, see solve_portfolio."""
+    ctx = multiprocessing.get_context()
+    messages = ctx.Queue()
+    stop_event = ctx.Event()
+    start = time.time()
+    deadline = start + time_limit
+    pending = list(configs)
+    running = {}
+    runs = dict((config.name, {'objective': None, 'status': 'not started'})
+                for config in configs)
+    best = {'objective': None, 'routes': None, 'config': None,
+            'found_at': None}
+
+    def handle(message):
+        kind, name, payload = message
+        if kind == 'solution':
+            objective, routes = payload
+            runs[name]['objective'] = objective
+            if best['objective'] is None or objective < best['objective']:
+                best.update(objective=objective, routes=routes, config=name,
+                            found_at=time.time() - start)
+        else:
+            runs[name]['status'] = payload
+            process = running.pop(name, None)
+            if process is not None:
+                process.join()
+
+    while pending or running:
+        now = time.time()
+        while (pending and len(running) < num_workers and now < deadline
+               and not stop_event.is_set()):
+            config = pending.pop(0)
+            process = ctx.Process(
+                target=_portfolio_worker,
+                args=(data, config, deadline - now, scale, max_route_distance,
+                      target_objective, messages, stop_event))
+            process.daemon = True
+            process.start()
+            running[config.name] = process
+            runs[config.name]['status'] = 'running'
+        if stop_event.is_set() or now > deadline + SHUTDOWN_GRACE:
+            break
+        if not running and (now >= deadline or not pending):
+            break
+        try:
+            handle(messages.get(timeout=0.05))
+        except queue.Empty:
+            pass
+        for name, process in list(running.items()):
+            if not process.is_alive() and process.exitcode != 0:
+                runs[name]['status'] = 'crashed'
+                running.pop(name)
+    # stop whoever is left, then collect what was already reported.
+    for name, process in running.items():
+        process.terminate()
+        runs[name]['status'] = 'terminated'
+    while True:
+        try:
+            handle(messages.get(timeout=0.05))
+        except queue.Empty:
+            break
+    for process in running.values():
+        process.join()
+    for name in [config.name for config in pending]:
+        runs[name]['status'] = 'skipped'
+    best['wall_time'] = time.time() - start
+    best['stopped_early'] = stop_event.is_set()
+    best['runs'] = runs
+    return best
+
+
+def _portfolio_worker(data, config, time_limit, scale, max_route_distance,
+                      target_objective, messages, stop_event):
+    """ Solves one configuration and streams its improving solutions to
+    the messages queue.
+    """
+    permutation = _seed_permutation(len(data['distance_matrix']),
+                                    data['depot'], config.seed)
+    worker_data = dict(data)
+    # the nodes are relabeled by the model, the matrix is not copied.
+    manager, routing, _ = optops.create_routing_model(
+        worker_data, scale=scale, max_route_distance=max_route_distance,
+        node_order=permutation if config.seed else None)
+    best = [None]
+
+    def on_solution():
+        objective = routing.CostVar().Max()
+        if best[0] is None or objective < best[0]:
+            best[0] = objective
+            routes = optops.get_current_routes(worker_data, manager, routing)
+            routes = dict((vehicle_id, [int(permutation[n]) for n in nodes])
+                          for vehicle_id, nodes in routes.items())
+            messages.put(('solution', config.name, (objective, routes)))
+            if target_objective is not None and objective <= target_objective:
+                stop_event.set()
+        if stop_event.is_set():
+            routing.solver().FinishCurrentSearch()
+
+    routing.AddAtSolutionCallback(on_solution)
+    search_parameters = optops.create_search_parameters(
+        config.first_solution_strategy, config.local_search_metaheuristic,
+        time_limit)
+    solution = routing.SolveWithParameters(search_parameters)
+    messages.put(('done', config.name,
+                  'finished' if solution else 'no solution'))
+
+
+def _seed_permutation(num_nodes, depot, seed):
+    """ Returns the node relabeling of a seed, the depot keeps its id."""
+    permutation = np.arange(num_nodes)
+    if seed:
+        others = np.delete(permutation, depot)
+        np.random.RandomState(seed).shuffle(others)
+        permutation = np.insert(others, depot, depot)
+    return permutation
@@ -0,0 +1,273 @@
+""" Module which contains RouteSet, the array backed result of a routing
+solve.
+
+All the routes are kept in one flat node array with per-vehicle offsets
+(CSR style), next to the distance and the load of every route, so a
+solution is read from the solver once and printing, exporting and
+plotting all work on the same arrays.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+import csv
+import io
+import numpy as np
+import condensed_matrix
+
+
+class RouteSet(object):
+    """ The routes of all the vehicles of a solution.
+
+    Parameters
+    ----------
+    nodes : numpy.ndarray
+        The nodes of all the routes, one route after the other (every
+        route starts and ends at its depot).
+    offsets : numpy.ndarray
+        num_vehicles + 1 offsets, route v is nodes[offsets[v]:offsets[v + 1]].
+    distances : numpy.ndarray
+        Length of every route, in the units of the distance matrix.
+    loads : numpy.ndarray
+        Total demand served by every route (zeros without demands).
+    objective : int
+        Objective value of the solution, None if unknown.
+    """
+
+    def __init__(self, nodes, offsets, distances=None, loads=None,
+                 objective=None):
+        self.nodes = np.asarray(nodes, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        num_vehicles = len(self.offsets) - 1
+        self.distances = (np.zeros(num_vehicles) if distances is None
+                          else np.asarray(distances, dtype=np.float64))
+        self.loads = (np.zeros(num_vehicles) if loads is None
+                      else np.asarray(loads, dtype=np.float64))
+        self.objective = objective
+
+    @classmethod
+    def from_solution(cls, data, manager, routing, solution=None):
+        """ Method to read the routes of a solution in a single pass.
+
+        Parameters
+        ----------
+        data : dictionary
+            The data model, its distance_matrix (or points) and demands
+            give the route distances and loads.
+        manager : ortools RoutingIndexManager
+        routing : ortools RoutingModel
+        solution : ortools Assignment
+            None reads the current values, as inside a solution
+            callback of the routing model.
+
+        Returns
+        -------
+        RouteSet
+        """
+        nodes = []
+        offsets = [0]
+        index_to_node = manager.IndexToNode
+        for vehicle_id in range(data['num_vehicles']):
+            index = routing.Start(vehicle_id)
+            while not routing.IsEnd(index):
+                nodes.append(index_to_node(index))
+                if solution is None:
+                    index = routing.NextVar(index).Value()
+                else:
+                    index = solution.Value(routing.NextVar(index))
+            nodes.append(index_to_node(index))
+            offsets.append(len(nodes))
+        if solution is None:
+            objective = routing.CostVar().Max()
+        else:
+            objective = solution.ObjectiveValue()
+        return cls.from_arrays(data, nodes, offsets, objective)
+
+    @classmethod
+    def from_routes(cls, routes, data=None, objective=None):
+        """ Method to build a RouteSet from vehicle_id: nodes pairs (as
+        returned by optops.get_all_routes) or a list of routes.
+        """
+        if hasattr(routes, 'items'):
+            routes = [routes[v] for v in sorted(routes)]
+        lengths = [len(route) for route in routes]
+        offsets = np.zeros(len(routes) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        nodes = (np.concatenate([np.asarray(r, dtype=np.int64)
+                                 for r in routes])
+                 if offsets[-1] else np.zeros(0, dtype=np.int64))
+        if data is None:
+            return cls(nodes, offsets, objective=objective)
+        return cls.from_arrays(data, nodes, offsets, objective)
+
+    @classmethod
+    def from_arrays(cls, data, nodes, offsets, objective=None):
+        """ Method to build a RouteSet and compute the route distances
+        and loads from the data model.
+        """
+        nodes = np.asarray(nodes, dtype=np.int64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        return cls(nodes, offsets, _route_sums(_arc_lengths(data, nodes),
+                                               offsets, arcs=True),
+                   _route_sums(_node_loads(data, nodes), offsets),
+                   objective)
+
+    @property
+    def num_vehicles(self):
+        return len(self.offsets) - 1
+
+    def __len__(self):
+        return self.num_vehicles
+
+    def route(self, vehicle_id):
+        """ Returns the nodes of a route (a view of the flat array)."""
+        return self.nodes[self.offsets[vehicle_id]:
+                          self.offsets[vehicle_id + 1]]
+
+    def __iter__(self):
+        for vehicle_id in range(self.num_vehicles):
+            yield self.route(vehicle_id)
+
+    def items(self):
+        """ Returns vehicle_id: nodes pairs, so a RouteSet can be passed
+        where a routes dictionary is expected (e.g. optops.draw_routes).
+        """
+        return [(v, self.route(v)) for v in range(self.num_vehicles)]
+
+    def to_dict(self):
+        """ Returns the routes as a vehicle_id: list of nodes dictionary."""
+        nodes = self.nodes.tolist()
+        offsets = self.offsets.tolist()
+        return dict((v, nodes[offsets[v]:offsets[v + 1]])
+                    for v in range(self.num_vehicles))
+
+    def stats(self):
+        """ Method to compute the statistics of the routes.
+
+        Returns
+        -------
+        stats : dictionary
+            total, max, mean and min distance, balance (max over mean
+            distance of the used routes), total and max load, the stops
+            of every route and the number of used vehicles.
+        """
+        stops = np.diff(self.offsets) - 2
+        used = stops > 0
+        distances = self.distances
+        if used.any():
+            mean, shortest = distances[used].mean(), distances[used].min()
+        else:
+            mean = shortest = 0.0
+        return {'total_distance': float(distances.sum()),
+                'max_distance': float(distances.max(initial=0)),
+                'min_distance': float(shortest),
+                'mean_distance': float(mean),
+                'balance': float(distances.max() / mean) if mean else 1.0,
+                'total_load': float(self.loads.sum()),
+                'max_load': float(self.loads.max(initial=0)),
+                'stops': stops.tolist(),
+                'vehicles_used': int(used.sum())}
+
+    def format_plan(self, names=None, unit='m'):
+        """ Method to build the printable plan of all the routes.
+
+        Parameters
+        ----------
+        names : list or dictionary
+            Printed instead of the node ids if given.
+        unit : str
+            Unit appended to the distances.
+        """
+        lines = []
+        for vehicle_id, route in self.items():
+            labels = (route.tolist() if names is None
+                      else [names[n] for n in route.tolist()])
+            lines.append('Route for vehicle {}:'.format(vehicle_id))
+            lines.append(' ' + ' -> '.join(str(label) for label in labels))
+            lines.append('Distance of the route: {}{}'.format(
+                round(float(self.distances[vehicle_id]), 2), unit))
+            if self.loads[vehicle_id]:
+                lines.append('Load of the route: {}'.format(
+                    self.loads[vehicle_id]))
+            lines.append('')
+        lines.append('Maximum of the route distances: {}{}'.format(
+            round(float(self.distances.max(initial=0)), 2), unit))
+        return '\n'.join(lines)
+
+    def write_csv(self, a_file, names=None):
+        """ Method to write the routes as vehicle_id,position,node rows."""
+        positions = np.arange(len(self.nodes)) - np.repeat(
+            self.offsets[:-1], np.diff(self.offsets))
+        vehicles = np.repeat(np.arange(self.num_vehicles),
+                             np.diff(self.offsets))
+        labels = (self.nodes.tolist() if names is None
+                  else [names[n] for n in self.nodes.tolist()])
+        with open(a_file, 'w', newline='') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(['vehicle_id', 'position', 'node'])
+            writer.writerows(zip(vehicles.tolist(), positions.tolist(),
+                                 labels))
+
+    def to_bytes(self):
+        """ Method to serialize the route set (npz format)."""
+        buffer = io.BytesIO()
+        np.savez(buffer, nodes=self.nodes, offsets=self.offsets,
+                 distances=self.distances, loads=self.loads,
+                 objective=np.array(-1 if self.objective is None
+                                    else self.objective, dtype=np.int64))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, payload):
+        """ Method to read a route set written by to_bytes."""
+        with np.load(io.BytesIO(payload)) as arrays:
+            objective = int(arrays['objective'])
+            return cls(arrays['nodes'], arrays['offsets'],
+                       arrays['distances'], arrays['loads'],
+                       None if objective < 0 else objective)
+
+    def write_to_file(self, a_file):
+        with open(a_file, 'wb') as outfile:
+            outfile.write(self.to_bytes())
+
+    @classmethod
+    def read_from_file(cls, a_file):
+        with open(a_file, 'rb') as infile:
+            return cls.from_bytes(infile.read())
+
+
+def _arc_lengths(data, nodes):
+    """ Returns the length of every arc nodes[i] -> nodes[i + 1] of the
+    flat node array (including the meaningless arcs between routes).
+    """
+    if len(nodes) < 2:
+        return np.zeros(0)
+    if 'distance_matrix' in data:
+        matrix = condensed_matrix.as_matrix(data['distance_matrix'])
+        lengths = np.asarray(matrix[nodes[:-1], nodes[1:]], dtype=np.float64)
+        # a quantized matrix (see optops.quantize_model) is scaled back.
+        return lengths / data.get('quantized_scale', 1)
+    if 'points' in data:
+        points = np.asarray(data['points'], dtype=np.float64)
+        offsets = points[nodes[1:]] - points[nodes[:-1]]
+        return np.hypot(offsets[:, 0], offsets[:, 1])
+    return np.zeros(len(nodes) - 1)
+
+
+def _node_loads(data, nodes):
+    if 'demands' not in data:
+        return np.zeros(len(nodes))
+    return np.asarray(data['demands'], dtype=np.float64)[nodes]
+
+
+def _route_sums(values, offsets, arcs=False):
+    """ Sums values per route with a cumulative sum. With arcs=True a
+    route of k nodes sums its k - 1 arcs.
+    """
+    cumulative = np.zeros(len(values) + 1)
+    np.cumsum(values, out=cumulative[1:])
+    starts = offsets[:-1]
+    ends = offsets[1:]
+    if arcs:
+        ends = np.maximum(ends - 1, starts)
+    return cumulative[ends] - cumulative[starts]
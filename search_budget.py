@@ -0,0 +1,220 @@
+""" Module which contains SearchBudget, a controller of the time a
+routing search is given.
+
+The default search parameters have no time limit: the search stops at
+the first local optimum, or never once a metaheuristic is on. A
+SearchBudget follows the objective of every improving solution and
+stops the search when it stagnates (no improvement, or less than
+min_improvement, within stagnation_window seconds), when a target
+objective is reached, or at the time_limit cap. The reason is kept in
+stop_reason.
+
+    budget = search_budget.SearchBudget(time_limit=60, stagnation_window=5)
+    solution = budget.solve(routing, search_parameters)
+    print(budget.describe())
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from ortools.constraint_solver import routing_enums_pb2
+import bisect
+import time
+import tracing
+
+
+# why a search stopped: the time limit (the budget's or the solver's),
+# no improvement within the stagnation window, too little improvement
+# within it, the target objective reached, the search ending by itself
+# (local optimum, or another limit of the search parameters) or ending
+# without any solution.
+STOP_REASONS = ('deadline', 'stagnation', 'slow_improvement', 'target',
+                'completed', 'no_solution')
+# routing statuses of a search the solver's time limit ended.
+TIMEOUT_STATUSES = (
+    routing_enums_pb2.RoutingSearchStatus.ROUTING_FAIL_TIMEOUT,
+    routing_enums_pb2.RoutingSearchStatus
+    .ROUTING_PARTIAL_SUCCESS_LOCAL_OPTIMUM_NOT_REACHED)
+
+
+class SearchBudget(object):
+    """ Stopping rules of a routing search.
+
+    Parameters
+    ----------
+    time_limit : float
+        Seconds after which the search is stopped, None for no cap.
+    stagnation_window : float
+        Seconds of the trailing window the progress is measured over,
+        None disables the stagnation rules.
+    min_improvement : float
+        Relative improvement of the best objective (e.g. 0.001) the
+        window must show, 0 only stops when there was none at all.
+    target_objective : int
+        Stop as soon as the objective is not above it.
+    """
+
+    def __init__(self, time_limit=30, stagnation_window=5,
+                 min_improvement=0.0, target_objective=None):
+        self.time_limit = time_limit
+        self.stagnation_window = stagnation_window
+        self.min_improvement = min_improvement
+        self.target_objective = target_objective
+        self.routing = None
+        self.reset()
+
+    def reset(self):
+        self.start = None
+        # (elapsed, objective) of every improving solution.
+        self.history = []
+        self._times = []
+        self.stop_reason = None
+        self.stopped_at = None
+
+    @property
+    def best_objective(self):
+        return self.history[-1][1] if self.history else None
+
+    @property
+    def found_at(self):
+        """ Seconds after the start the best solution was found at."""
+        return self.history[-1][0] if self.history else None
+
+    def attach(self, routing):
+        """ Method to register the budget with a routing model before its
+        search: a solution callback follows the objective and a custom
+        limit, polled by the solver all along the search, applies the
+        stopping rules.
+        """
+        self.reset()
+        self.routing = routing
+        routing.AddAtSolutionCallback(self._on_solution)
+        routing.AddSearchMonitor(routing.solver().CustomLimit(
+            self._should_stop))
+        self.start = time.time()
+
+    def solve(self, routing, search_parameters, initial=None):
+        """ Method to run the search of a routing model under the budget.
+
+        Parameters
+        ----------
+        routing : ortools RoutingModel
+        search_parameters : ortools RoutingSearchParameters
+        initial : ortools Assignment
+            Solution to start from, see
+            RoutingModel.ReadAssignmentFromRoutes.
+
+        Returns
+        -------
+        ortools Assignment
+            The best solution, None if none was found.
+        """
+        search_parameters = self.limit_parameters(search_parameters)
+        self.attach(routing)
+        with tracing.span('search') as span:
+            if initial is None:
+                solution = routing.SolveWithParameters(search_parameters)
+            else:
+                solution = routing.SolveFromAssignmentWithParameters(
+                    initial, search_parameters)
+            self.finish(solution)
+            span.set(stop_reason=self.stop_reason,
+                     solutions=len(self.history))
+            tracing.record_solver_stats(routing)
+        return solution
+
+    def limit_parameters(self, search_parameters):
+        """ Method to give the time_limit to the solver as well: returns a
+        copy of the search parameters whose time limit is the smaller of
+        their own and the budget's. The custom limit only applies the
+        stagnation rules when python is polled, and a metaheuristic
+        without a time limit makes or tools warn it may run forever.
+        """
+        if self.time_limit is None:
+            return search_parameters
+        milliseconds = max(1, int(self.time_limit * 1000))
+        own = search_parameters.time_limit.ToMilliseconds()
+        if 0 < own <= milliseconds:
+            return search_parameters
+        limited = type(search_parameters)()
+        limited.CopyFrom(search_parameters)
+        limited.time_limit.FromMilliseconds(milliseconds)
+        return limited
+
+    def finish(self, solution):
+        """ Method to record the end of a search run by the caller. A
+        search ended by the time limit of the solver counts as 'deadline'.
+        """
+        if self.stop_reason is None:
+            self.stopped_at = time.time() - self.start
+            if self._timed_out(self.stopped_at):
+                self.stop_reason = 'deadline'
+            else:
+                self.stop_reason = 'completed' if solution else 'no_solution'
+
+    def check(self, elapsed):
+        """ Returns the reason to stop at elapsed seconds, None to go on.
+        """
+        if self.time_limit is not None and elapsed >= self.time_limit:
+            return 'deadline'
+        if not self.history:
+            return None
+        best = self.history[-1][1]
+        if self.target_objective is not None and \
+                best <= self.target_objective:
+            return 'target'
+        window = self.stagnation_window
+        if window is None or elapsed - self.history[0][0] < window:
+            return None
+        if elapsed - self.history[-1][0] >= window:
+            return 'stagnation'
+        if self.min_improvement:
+            before = self.history[bisect.bisect_right(
+                self._times, elapsed - window) - 1][1]
+            if before - best < self.min_improvement * abs(before):
+                return 'slow_improvement'
+        return None
+
+    def summary(self):
+        """ Returns the stop reason, the elapsed seconds, the number of
+        improving solutions and the best objective and when it was found.
+        """
+        return {'stop_reason': self.stop_reason,
+                'elapsed': self.stopped_at,
+                'solutions': len(self.history),
+                'best_objective': self.best_objective,
+                'found_at': self.found_at}
+
+    def describe(self):
+        """ Returns the summary as one line of text."""
+        if not self.history:
+            return 'Search stopped ({}) after {:.2f}s without a ' \
+                'solution'.format(self.stop_reason, self.stopped_at or 0)
+        return 'Search stopped ({}) after {:.2f}s, best objective {} ' \
+            'found at {:.2f}s, {} improving solutions'.format(
+                self.stop_reason, self.stopped_at or 0, self.best_objective,
+                self.found_at, len(self.history))
+
+    def _timed_out(self, elapsed):
+        if self.time_limit is not None and elapsed >= self.time_limit:
+            return True
+        return self.routing is not None and \
+            self.routing.status() in TIMEOUT_STATUSES
+
+    def _on_solution(self):
+        objective = self.routing.CostVar().Max()
+        if not self.history or objective < self.history[-1][1]:
+            elapsed = time.time() - self.start
+            self.history.append((elapsed, objective))
+            self._times.append(elapsed)
+
+    def _should_stop(self):
+        if self.stop_reason is not None:
+            return True
+        elapsed = time.time() - self.start
+        reason = self.check(elapsed)
+        if reason is None:
+            return False
+        self.stop_reason = reason
+        self.stopped_at = elapsed
+        return True
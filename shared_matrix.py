@@ -0,0 +1,250 @@
+""" Module which places distance matrices in shared memory, so worker
+processes attach to one stored matrix instead of unpickling their own.
+
+SharedMatrixManager copies a matrix once into a
+multiprocessing.shared_memory segment and returns it as a SharedArray,
+a read-only numpy array that pickles to the segment name only: a data
+model (see optops.create_data_model) sent to a worker process attaches
+to the same memory, without a copy, on arrival. This matters with the
+spawn start method (windows, macos), where every Process and pool task
+pickles its arguments. Given a scale, the matrix is quantized straight
+into the segment (see optops.quantize_model), so the workers register
+it without float or int copies of their own. A condensed matrix is
+shared in its condensed form, and a matrix without storage (e.g.
+grid_distances.GridDistanceMatrix) needs no segment at all.
+
+    with shared_matrix.SharedMatrixManager() as manager:
+        data = manager.share(data, scale=100)
+        result = portfolio.solve_portfolio(data, time_limit=10, scale=100)
+
+This does not make the memory of a routing model independent of the
+number of workers: each worker still builds the python list of lists
+RegisterTransitMatrix takes and or tools keeps its own dense int64
+copy, only the stored matrix and its transfer are shared.
+
+The manager unlinks its segments when it is closed, at interpreter exit,
+and, should the process crash, the resource tracker of multiprocessing
+unlinks whatever is left when the process and its children are gone.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from multiprocessing import shared_memory
+import atexit
+import sys
+import numpy as np
+import condensed_matrix
+import optops
+
+
+# the managers with live segments, closed at interpreter exit.
+_managers = set()
+
+
+class SharedArray(np.ndarray):
+    """ A numpy array over a shared memory segment, pickled by name.
+
+    Views and results of operations are plain copies when pickled, only
+    the array created over the whole segment travels by name.
+    """
+
+    def __new__(cls, segment, shape, dtype):
+        array = np.ndarray.__new__(cls, shape, dtype=dtype,
+                                   buffer=segment.buf)
+        array._segment = segment
+        array._shared = (segment.name, tuple(shape), np.dtype(dtype).str)
+        return array
+
+    def __array_finalize__(self, obj):
+        # views keep the segment mapped as long as they live.
+        self._segment = getattr(obj, '_segment', None)
+        self._shared = None
+
+    @property
+    def segment_name(self):
+        return self._shared[0] if self._shared else None
+
+    def __reduce__(self):
+        if self._shared is None:
+            return np.asarray(self).copy().__reduce__()
+        return (attach_array, self._shared)
+
+
+def attach_array(name, shape, dtype):
+    """ Method to map an existing segment as a read-only SharedArray
+    (what unpickling a SharedArray calls).
+    """
+    if sys.version_info >= (3, 13):
+        segment = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        # children share the resource tracker of the process which
+        # created the segment, registering it again changes nothing.
+        segment = shared_memory.SharedMemory(name=name)
+    array = SharedArray(segment, shape, dtype)
+    array.flags.writeable = False
+    return array
+
+
+class SharedMatrixManager(object):
+    """ Owner of the shared memory segments of a process.
+
+    Parameters
+    ----------
+    dtype : numpy dtype
+        The dtype matrices are stored as, None keeps their own (float64
+        for lists of lists).
+    """
+
+    def __init__(self, dtype=None):
+        self.dtype = dtype
+        self._segments = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __len__(self):
+        return len(self._segments)
+
+    @property
+    def nbytes(self):
+        """ Total size of the live segments."""
+        return sum(segment.size for segment in self._segments.values())
+
+    def share_array(self, values):
+        """ Method to copy an array into a new segment.
+
+        Returns
+        -------
+        SharedArray
+            Read-only, over the new segment.
+        """
+        values = np.ascontiguousarray(values, dtype=self.dtype)
+        array = self._create(values.shape, values.dtype)
+        array[...] = values
+        array.flags.writeable = False
+        return array
+
+    def share_quantized(self, matrix, scale):
+        """ Method to quantize a matrix into a new segment row by row
+        (see optops.quantize_rows), without an (n, n) float or int copy
+        of it. A condensed matrix keeps its type: the segment only holds
+        its n * (n - 1) / 2 values, quantized as by
+        optops.quantize_condensed.
+
+        Returns
+        -------
+        SharedArray or condensed_matrix.CondensedMatrix
+            Read-only, over the new segment.
+        """
+        if isinstance(matrix, condensed_matrix.CondensedMatrix):
+            array = self._create(matrix.values.shape,
+                                 optops.quantized_dtype(matrix, scale))
+            matrix = optops.quantize_condensed(matrix, scale, out=array)
+            array.flags.writeable = False
+            return matrix
+        array = self._create((len(matrix), len(matrix)), np.int64)
+        for i, row in enumerate(optops.quantize_rows(matrix, scale)):
+            array[i] = row
+        array.flags.writeable = False
+        return array
+
+    def share_matrix(self, matrix, scale=None):
+        """ Method to share a distance matrix: a list of lists or numpy
+        array becomes a SharedArray, a condensed matrix keeps its type
+        over shared values, an implicit matrix (no storage) is returned
+        as it is. With a scale the matrix is quantized, see
+        share_quantized.
+        """
+        if isinstance(matrix, SharedArray) and matrix.segment_name:
+            return matrix
+        if condensed_matrix.is_implicit(matrix):
+            return matrix
+        if scale is not None:
+            return self.share_quantized(matrix, scale)
+        if isinstance(matrix, condensed_matrix.CondensedMatrix):
+            return condensed_matrix.CondensedMatrix(
+                self.share_array(matrix.values), matrix.size)
+        if isinstance(matrix, condensed_matrix.DenseMatrix):
+            return self.share_array(matrix.values)
+        return self.share_array(matrix)
+
+    def share(self, data, scale=None):
+        """ Method to share the matrix of a data model.
+
+        Parameters
+        ----------
+        data : dictionary
+            The data model.
+        scale : float
+            If given, the matrix is quantized with it and the model
+            marked with 'quantized_scale' (see optops.quantize_model),
+            unless it has no storage or already is quantized.
+
+        Returns
+        -------
+        data : dictionary
+            A copy of the model whose distance_matrix is shared, the
+            other keys are the same objects.
+        """
+        shared = dict(data)
+        matrix = data['distance_matrix']
+        if scale is None or data.get('quantized_scale') is not None or \
+                condensed_matrix.is_implicit(matrix):
+            shared['distance_matrix'] = self.share_matrix(matrix)
+            return shared
+        shared['distance_matrix'] = self.share_matrix(matrix, scale)
+        shared['quantized_scale'] = scale
+        return shared
+
+    def _create(self, shape, dtype):
+        """ Returns a writable SharedArray over a new segment."""
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape)) * dtype.itemsize
+        segment = shared_memory.SharedMemory(create=True, size=max(1, size))
+        self._segments[segment.name] = segment
+        _managers.add(self)
+        return SharedArray(segment, shape, dtype)
+
+    def release(self, matrix):
+        """ Method to unlink the segment of a matrix (a SharedArray or a
+        condensed matrix over one) or of a segment name.
+        """
+        if isinstance(matrix, condensed_matrix.CondensedMatrix):
+            matrix = matrix.values
+        name = matrix.segment_name if isinstance(matrix, SharedArray) \
+            else matrix
+        segment = self._segments.pop(name, None)
+        if segment is not None:
+            _close_segment(segment)
+
+    def close(self):
+        """ Method to unlink all the segments. Arrays still in use keep
+        their mapping until they are garbage collected.
+        """
+        while self._segments:
+            _close_segment(self._segments.popitem()[1])
+        _managers.discard(self)
+
+
+@atexit.register
+def _close_managers():
+    for manager in list(_managers):
+        manager.close()
+
+
+def _close_segment(segment):
+    try:
+        segment.close()
+    except BufferError:
+        # numpy arrays still export the buffer, the mapping goes away
+        # with them.
+        pass
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,197 @@
+""" Module which contains a content-addressed cache of routing solutions,
+with an in-memory LRU tier and an on-disk tier.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import shutil
+import optops
+
+
+def instance_key(data, scale=optops.DEFAULT_DISTANCE_SCALE,
+                 max_route_distance=None, search_parameters=None):
+    """ Method to compute the key of a routing instance.
+
+    Parameters
+    ----------
+    data : dictionary
+        The data model (distance_matrix, num_vehicles, depot).
+    scale, max_route_distance
+        See optops.create_routing_model.
+    search_parameters : ortools RoutingSearchParameters
+        The parameters the instance is solved with.
+
+    Returns
+    -------
+    str
+        The sha256 hex digest of the quantized matrix and the settings.
+    """
+    matrix = optops.quantize_matrix(data['distance_matrix'], scale)
+    digest = hashlib.sha256()
+    digest.update(str(matrix.shape).encode())
+    digest.update(matrix.tobytes())
+    settings = [data['num_vehicles'], data['depot'], scale,
+                max_route_distance]
+    digest.update(json.dumps(settings).encode())
+    if search_parameters is not None:
+        digest.update(str(search_parameters).encode())
+    return digest.hexdigest()
+
+
+def file_key(a_file, num_vehicles, depot=0,
+             scale=optops.DEFAULT_DISTANCE_SCALE, max_route_distance=None,
+             search_parameters=None, metric='euclidean'):
+    """ Method to compute the key of an instance built from a grid file
+    (see optops.read_grid_from_file), without reading the grid or
+    building its matrix.
+
+    Parameters
+    ----------
+    a_file : str
+        The grid file.
+    num_vehicles, depot
+        See optops.create_data_model.
+    scale, max_route_distance, search_parameters
+        See instance_key.
+    metric : str
+        The metric the matrix is calculated with.
+
+    Returns
+    -------
+    str
+        The sha256 hex digest of the file contents and the settings.
+    """
+    digest = hashlib.sha256()
+    with open(a_file, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    settings = [num_vehicles, depot, scale, max_route_distance, metric]
+    digest.update(json.dumps(settings).encode())
+    if search_parameters is not None:
+        digest.update(str(search_parameters).encode())
+    return digest.hexdigest()
+
+
+class SolutionCache(object):
+    """ Two tier cache of solved instances keyed by instance_key.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the on-disk tier (created on the first write).
+        None keeps the cache in memory only.
+    max_memory_entries : int
+        Size of the in-memory LRU tier.
+    """
+
+    def __init__(self, directory=None, max_memory_entries=128):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.memory = OrderedDict()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+    def get(self, key):
+        """ Method to look up a solution.
+
+        Returns
+        -------
+        result : dictionary
+            'routes' (vehicle_id: nodes) and 'objective', or None on a
+            miss. It is a copy, changing it leaves the cache intact.
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return _copy_result(self.memory[key])
+        path = self._path(key, '.json')
+        if path is not None and os.path.exists(path):
+            with open(path) as json_file:
+                stored = json.load(json_file)
+            result = {'objective': stored['objective'],
+                      'routes': dict((int(vehicle_id), nodes)
+                                     for vehicle_id, nodes in stored['routes'])}
+            self._remember(key, result)
+            self.stats['disk_hits'] += 1
+            return _copy_result(result)
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key, routes, objective, figure_file=None):
+        """ Method to store a solution (and optionally its figure).
+
+        Parameters
+        ----------
+        key : str
+            The instance_key of the solved instance.
+        routes : dictionary
+            vehicle_id: nodes pairs.
+        objective : int
+            The objective value of the solution.
+        figure_file : str
+            A rendered figure of the solution to keep with it.
+        """
+        result = {'objective': objective,
+                  'routes': dict((int(vehicle_id), [int(n) for n in nodes])
+                                 for vehicle_id, nodes in routes.items())}
+        self._remember(key, result)
+        if self.directory is None:
+            return
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        with open(self._path(key, '.json'), 'w') as outfile:
+            json.dump({'objective': objective,
+                       'routes': sorted(result['routes'].items())}, outfile)
+        if figure_file is not None and os.path.exists(figure_file):
+            shutil.copyfile(figure_file, self._path(key, '.png'))
+
+    def restore_figure(self, key, target_file):
+        """ Method to copy the cached figure of key to target_file.
+
+        Returns
+        -------
+        bool
+            True if a figure was cached for the key.
+        """
+        path = self._path(key, '.png')
+        if path is None or not os.path.exists(path):
+            return False
+        shutil.copyfile(path, target_file)
+        return True
+
+    def invalidate(self, key=None):
+        """ Method to drop the entry of key from both tiers, or every
+        entry if key is None.
+        """
+        keys = list(self.memory) if key is None else [key]
+        if key is None and self.directory is not None and \
+                os.path.isdir(self.directory):
+            keys.extend(os.path.splitext(name)[0]
+                        for name in os.listdir(self.directory))
+        for k in set(keys):
+            self.memory.pop(k, None)
+            for extension in ('.json', '.png'):
+                path = self._path(k, extension)
+                if path is not None and os.path.exists(path):
+                    os.remove(path)
+
+    def _remember(self, key, result):
+        self.memory[key] = result
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def _path(self, key, extension):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, key + extension)
+
+
+def _copy_result(result):
+    return {'objective': result['objective'],
+            'routes': dict((vehicle_id, list(nodes))
+                           for vehicle_id, nodes in result['routes'].items())}
@@ -0,0 +1,408 @@
+""" Module which runs a long-lived routing solver service: a pool of
+worker processes which load the grid and its distance matrix once, and
+a job queue in front of them.
+
+Jobs are submitted with SolverService.submit, which returns a job id at
+once, and are followed with status (state and progress of the search),
+result and cancel. Every job has its own time limit. The service can
+also be shared by several processes (e.g. the workers of a web server)
+over a local socket, see serve_forever and connect.
+
+    service = SolverService(GRID_FILE, media_dir=MEDIA_DIR)
+    job_id = service.submit(vehicle_num=4, time_limit=10)
+    service.status(job_id)['state']
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from collections import deque
+from multiprocessing.managers import BaseManager
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+import optops
+
+
+JOB_STATES = ('queued', 'running', 'done', 'failed', 'cancelled')
+# seconds a cancelled job may keep running (the search only checks for
+# cancellation when it finds a solution) before its worker is restarted.
+CANCEL_GRACE = 2.0
+# minimum seconds between two progress reports of a job.
+PROGRESS_INTERVAL = 0.2
+DEFAULT_ADDRESS = ('127.0.0.1', 50500)
+
+
+class SolverService(object):
+    """ Pool of warm solver processes fed from a job queue.
+
+    Parameters
+    ----------
+    grid_file : str
+        The grid the workers load at start-up (see
+        optops.read_grid_from_file).
+    num_workers : int
+        Number of worker processes.
+    media_dir : str
+        Directory the figure of every solved job is rendered to, None
+        to skip rendering.
+    scale, max_route_distance
+        See optops.create_routing_model.
+    default_time_limit : float
+        Time limit (seconds) of the jobs submitted without one.
+    """
+
+    def __init__(self, grid_file, num_workers=2, media_dir=None,
+                 scale=optops.DEFAULT_DISTANCE_SCALE, max_route_distance=None,
+                 default_time_limit=30):
+        self.grid_file = grid_file
+        self.num_workers = num_workers
+        self.media_dir = media_dir
+        self.settings = {'scale': scale,
+                         'max_route_distance': max_route_distance}
+        self.default_time_limit = default_time_limit
+        self.jobs = {}
+        self.pending = deque()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.ctx = multiprocessing.get_context()
+        self.events = None
+        self.collector = None
+        self.running = False
+
+    def start(self):
+        """ Method to start the workers and the collector thread."""
+        if self.running:
+            return self
+        self.events = self.ctx.Queue()
+        self.running = True
+        for worker_id in range(self.num_workers):
+            self.workers.append(self._spawn(worker_id))
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+        return self
+
+    def submit(self, vehicle_num, time_limit=None,
+               first_solution_strategy='PATH_CHEAPEST_ARC',
+               local_search_metaheuristic='GUIDED_LOCAL_SEARCH'):
+        """ Method to queue a solve of the grid for vehicle_num vehicles.
+
+        Returns
+        -------
+        job_id : str
+        """
+        if not self.running:
+            self.start()
+        job = {'id': uuid.uuid4().hex,
+               'vehicle_num': vehicle_num,
+               'time_limit': (self.default_time_limit if time_limit is None
+                              else time_limit),
+               'first_solution_strategy': first_solution_strategy,
+               'local_search_metaheuristic': local_search_metaheuristic,
+               'state': 'queued',
+               'submitted': time.time(),
+               'started': None,
+               'finished': None,
+               'progress': {'solutions': 0, 'objective': None},
+               'result': None,
+               'error': None}
+        if self.media_dir is not None:
+            job['figure_file'] = os.path.join(
+                self.media_dir, 'figure_{}.png'.format(job['id']))
+        with self.lock:
+            self.jobs[job['id']] = job
+            self.pending.append(job['id'])
+            self._dispatch()
+        return job['id']
+
+    def status(self, job_id):
+        """ Method to poll a job.
+
+        Returns
+        -------
+        job : dictionary
+            A copy of the job: 'state' (one of JOB_STATES), 'progress'
+            (solutions found and best objective so far), 'result'
+            ('routes', 'objective', 'stats' and 'figure_file') once done,
+            'error' if it failed and the submitted/started/finished times.
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                raise KeyError('unknown job %s' % job_id)
+            job = dict(job)
+            job['progress'] = dict(job['progress'])
+            if job['started'] is not None and job['finished'] is None:
+                job['progress']['elapsed'] = time.time() - job['started']
+            return job
+
+    def result(self, job_id, timeout=None):
+        """ Method to wait for a job to finish.
+
+        Returns
+        -------
+        result : dictionary
+            See status, None if the job failed or was cancelled before
+            a solution was found.
+
+        Raises
+        ------
+        TimeoutError
+            If the job is still queued or running after timeout seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            job = self.status(job_id)
+            if job['state'] in ('done', 'failed', 'cancelled'):
+                return job['result']
+            if deadline is not None and time.time() > deadline:
+                raise TimeoutError('job %s is still %s' % (job_id,
+                                                           job['state']))
+            time.sleep(0.05)
+
+    def cancel(self, job_id):
+        """ Method to cancel a job. A queued job is dropped, a running
+        search is stopped (its best solution so far is kept as result).
+
+        Returns
+        -------
+        bool
+            False if the job had already finished.
+        """
+        with self.lock:
+            job = self.jobs[job_id]
+            if job_id in self.pending:
+                self.pending.remove(job_id)
+                job['state'] = 'cancelled'
+                job['finished'] = time.time()
+                return True
+            if job['state'] not in ('queued', 'running'):
+                return False
+            job['cancel_requested'] = time.time()
+            for worker in self.workers:
+                if worker['job_id'] == job_id:
+                    worker['cancel'].set()
+            return True
+
+    def list_jobs(self):
+        """ Returns the id, state and vehicle_num of every job."""
+        with self.lock:
+            return [{'id': job['id'], 'state': job['state'],
+                     'vehicle_num': job['vehicle_num']}
+                    for job in self.jobs.values()]
+
+    def forget(self, job_id):
+        """ Method to drop a finished job from the job table."""
+        with self.lock:
+            if self.jobs[job_id]['state'] in ('done', 'failed', 'cancelled'):
+                del self.jobs[job_id]
+
+    def shutdown(self, wait=True):
+        """ Method to stop the workers, queued jobs are cancelled."""
+        with self.lock:
+            self.running = False
+            for job_id in self.pending:
+                self.jobs[job_id]['state'] = 'cancelled'
+            self.pending.clear()
+            for worker in self.workers:
+                worker['cancel'].set()
+                worker['tasks'].put(None)
+        for worker in self.workers:
+            worker['process'].join(None if wait else CANCEL_GRACE)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+                worker['process'].join()
+        if self.collector is not None:
+            self.collector.join()
+        self.workers = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+        return False
+
+    def _spawn(self, worker_id):
+        tasks = self.ctx.Queue()
+        cancel = self.ctx.Event()
+        process = self.ctx.Process(
+            target=_service_worker,
+            args=(worker_id, self.grid_file, self.settings, tasks,
+                  self.events, cancel),
+            daemon=True)
+        process.start()
+        return {'id': worker_id, 'process': process, 'tasks': tasks,
+                'cancel': cancel, 'job_id': None}
+
+    def _dispatch(self):
+        """ Hands queued jobs to idle workers (the lock is held)."""
+        for worker in self.workers:
+            if not self.pending:
+                return
+            if worker['job_id'] is None:
+                job = self.jobs[self.pending.popleft()]
+                worker['job_id'] = job['id']
+                worker['cancel'].clear()
+                worker['tasks'].put(dict(
+                    (key, job.get(key)) for key in
+                    ('id', 'vehicle_num', 'time_limit', 'figure_file',
+                     'first_solution_strategy',
+                     'local_search_metaheuristic')))
+
+    def _collect(self):
+        """ Applies the events of the workers to the job table and
+        restarts the workers which died or ignore a cancellation.
+        """
+        while self.running or any(w['process'].is_alive()
+                                  for w in self.workers):
+            try:
+                event = self.events.get(timeout=0.1)
+            except queue.Empty:
+                event = None
+            except (EOFError, OSError):
+                break
+            with self.lock:
+                if event is not None:
+                    self._handle(*event)
+                if self.running:
+                    self._check_workers()
+                    self._dispatch()
+
+    def _handle(self, kind, worker_id, job_id=None, payload=None):
+        job = self.jobs.get(job_id)
+        if kind == 'started' and job is not None:
+            job['state'] = 'running'
+            job['started'] = time.time()
+        elif kind == 'progress' and job is not None:
+            job['progress'].update(payload)
+        elif kind in ('done', 'failed'):
+            if job is not None and job['finished'] is None:
+                job['finished'] = time.time()
+                if kind == 'failed':
+                    job['state'] = 'failed'
+                    job['error'] = payload
+                else:
+                    job['result'] = payload
+                    job['state'] = ('cancelled' if 'cancel_requested' in job
+                                    else 'done')
+            for worker in self.workers:
+                if worker['id'] == worker_id and worker['job_id'] == job_id:
+                    worker['job_id'] = None
+
+    def _check_workers(self):
+        now = time.time()
+        for position, worker in enumerate(self.workers):
+            job = self.jobs.get(worker['job_id'])
+            dead = not worker['process'].is_alive()
+            stuck = (job is not None and 'cancel_requested' in job
+                     and now - job['cancel_requested'] > CANCEL_GRACE)
+            if not dead and not stuck:
+                continue
+            if job is not None:
+                job['finished'] = now
+                job['state'] = 'cancelled' if stuck else 'failed'
+                if dead and not stuck:
+                    job['error'] = 'worker exited with code %s' % (
+                        worker['process'].exitcode)
+            if not dead:
+                worker['process'].terminate()
+            worker['process'].join()
+            self.workers[position] = self._spawn(worker['id'])
+
+
+def _service_worker(worker_id, grid_file, settings, tasks, events, cancel):
+    """ Loads the grid once and solves the jobs of the tasks queue."""
+    points = optops.read_grid_from_file(grid_file)
+    matrix = optops.calc_matrix_euclidean_distance(points)
+    while True:
+        job = tasks.get()
+        if job is None:
+            return
+        events.put(('started', worker_id, job['id']))
+        if cancel.is_set():
+            events.put(('done', worker_id, job['id'], None))
+            continue
+        try:
+            result = _solve_job(worker_id, points, matrix, settings, job,
+                                events, cancel)
+            events.put(('done', worker_id, job['id'], result))
+        except Exception:
+            events.put(('failed', worker_id, job['id'],
+                        traceback.format_exc()))
+
+
+def _solve_job(worker_id, points, matrix, settings, job, events, cancel):
+    """ Solves one job and reports its progress, returns its result."""
+    data = optops.create_data_model(matrix, job['vehicle_num'])
+    manager, routing, _ = optops.create_routing_model(
+        data, scale=settings['scale'],
+        max_route_distance=settings['max_route_distance'])
+    progress = {'solutions': 0, 'objective': None, 'reported': 0.0}
+
+    def on_solution():
+        progress['solutions'] += 1
+        objective = routing.CostVar().Max()
+        # a metaheuristic also accepts worse solutions, keep the best.
+        if progress['objective'] is None or objective < progress['objective']:
+            progress['objective'] = objective
+        now = time.time()
+        if now - progress['reported'] > PROGRESS_INTERVAL:
+            progress['reported'] = now
+            events.put(('progress', worker_id, job['id'],
+                        {'solutions': progress['solutions'],
+                         'objective': progress['objective']}))
+        if cancel.is_set():
+            routing.solver().FinishCurrentSearch()
+
+    routing.AddAtSolutionCallback(on_solution)
+    search_parameters = optops.create_search_parameters(
+        job['first_solution_strategy'], job['local_search_metaheuristic'],
+        job['time_limit'])
+    solution = routing.SolveWithParameters(search_parameters)
+    events.put(('progress', worker_id, job['id'],
+                {'solutions': progress['solutions'],
+                 'objective': progress['objective']}))
+    if not solution:
+        return None
+    routes = optops.get_route_set(data, manager, routing, solution)
+    figure_file = job.get('figure_file')
+    if figure_file is not None:
+        optops.render_routes_to_file(points, routes, figure_file)
+    return {'routes': routes.to_dict(), 'objective': routes.objective,
+            'stats': routes.stats(), 'figure_file': figure_file}
+
+
+class _ServiceServer(BaseManager):
+    pass
+
+
+class _ServiceClient(BaseManager):
+    pass
+
+
+def serve_forever(service, address=DEFAULT_ADDRESS, authkey=b'lp-projects'):
+    """ Method to share a started service over a local socket, blocks
+    until the process is stopped.
+    """
+    _ServiceServer.register('get_service', callable=lambda: service)
+    manager = _ServiceServer(address=address, authkey=authkey)
+    manager.get_server().serve_forever()
+
+
+def connect(address=DEFAULT_ADDRESS, authkey=b'lp-projects'):
+    """ Method to connect to a service run with serve_forever.
+
+    Returns
+    -------
+    A proxy with the submit, status, result, cancel, list_jobs and
+    forget methods of SolverService.
+    """
+    _ServiceClient.register('get_service')
+    manager = _ServiceClient(address=address, authkey=authkey)
+    manager.connect()
+    return manager.get_service()
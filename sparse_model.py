@@ -0,0 +1,315 @@
+""" Module which builds a sparse routing model for large point sets.
+
+Instead of the dense n x n matrix, only the k nearest neighbours of
+every node (found with a KD-tree) are kept as candidate arcs, in CSR
+form. The next variables of the routing model are restricted to those
+candidates, so the local search only tries candidate arcs, and the
+distance of any other arc is computed on demand from the coordinates.
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+from ortools.constraint_solver import pywrapcp
+from scipy import sparse
+from scipy.spatial import cKDTree
+import math
+import numpy as np
+import optops
+import time
+
+
+def create_sparse_data_model(points_matrix, num_vehicles, k=10,
+                             scale=optops.GRID_DISTANCE_SCALE):
+    """ Stores the data for a sparse problem.
+
+    Parameters
+    ----------
+    points_matrix : list or numpy.ndarray
+        The (x, y) coordinates of the nodes.
+    num_vehicles : int
+    k : int
+        Number of nearest neighbours kept per node.
+    scale : float
+        See optops.quantize_matrix.
+
+    Returns
+    -------
+    data : dictionary
+        points, candidate_arcs (CSR of quantized distances),
+        num_vehicles, depot and distance_scale.
+    """
+    points = np.asarray(points_matrix, dtype=np.float64)
+    data = {}
+    data['points'] = points
+    data['candidate_arcs'] = knn_candidate_arcs(points, k, scale)
+    data['num_vehicles'] = num_vehicles
+    data['depot'] = 0
+    data['distance_scale'] = scale
+    return data
+
+
+def knn_candidate_arcs(points, k=10, scale=optops.GRID_DISTANCE_SCALE):
+    """ Method to find the candidate arcs of every node.
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        The (n, 2) coordinates.
+    k : int
+        Number of nearest neighbours per node. The graph is made
+        symmetric, so a node may end up with more than k candidates.
+    scale : float
+        See optops.quantize_matrix.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        (n, n) int64 matrix, entry (i, j) holds the quantized distance
+        of the candidate arc i -> j. Zero distances are kept as explicit
+        entries.
+    """
+    num_points = len(points)
+    k = min(k, num_points - 1)
+    if k <= 0:
+        return sparse.csr_matrix((num_points, num_points), dtype=np.int64)
+    tree = cKDTree(points)
+    distances, neighbours = tree.query(points, k=k + 1)
+    rows = np.repeat(np.arange(num_points), k + 1)
+    cols = neighbours.ravel()
+    dists = distances.ravel()
+    keep = rows != cols
+    rows, cols, dists = rows[keep], cols[keep], dists[keep]
+    # add the reverse arcs and drop the duplicates.
+    rows, cols = np.concatenate([rows, cols]), np.concatenate([cols, rows])
+    dists = np.concatenate([dists, dists])
+    keys, first = np.unique(rows * num_points + cols, return_index=True)
+    rows, cols = keys // num_points, keys % num_points
+    values = np.rint(dists[first] * scale).astype(np.int64)
+    indptr = np.zeros(num_points + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_points), out=indptr[1:])
+    return sparse.csr_matrix((values, cols, indptr),
+                             shape=(num_points, num_points))
+
+
+def nearest_neighbour_routes(data, max_route_distance=None):
+    """ Method to build a first solution which only uses candidate arcs
+    where it can, by walking to the nearest unvisited node.
+
+    Without max_route_distance the tour is cut into num_vehicles
+    consecutive parts, with it a route is closed as soon as the next
+    node would take it (back to the depot) past the cap.
+
+    Returns
+    -------
+    routes : list
+        One list of nodes (depot excluded) per vehicle, None when the
+        cut tour needs more than num_vehicles routes.
+    """
+    points = data['points']
+    candidates = data['candidate_arcs']
+    depot = data['depot']
+    num_points = len(points)
+    visited = np.zeros(num_points, dtype=bool)
+    visited[depot] = True
+    tree = None
+    tour = []
+    current = depot
+    for _ in range(num_points - 1):
+        row = slice(candidates.indptr[current], candidates.indptr[current + 1])
+        neighbours = candidates.indices[row]
+        free = neighbours[~visited[neighbours]]
+        if len(free):
+            nxt = free[np.argmin(candidates.data[row][~visited[neighbours]])]
+        else:
+            if tree is None:
+                tree = cKDTree(points)
+            nxt = _nearest_unvisited(tree, points, current, visited)
+        visited[nxt] = True
+        tour.append(int(nxt))
+        current = nxt
+    num_vehicles = data['num_vehicles']
+    if max_route_distance is not None:
+        return _split_tour(data, tour, max_route_distance)
+    bounds = np.linspace(0, len(tour), num_vehicles + 1).astype(int)
+    return [tour[bounds[v]:bounds[v + 1]] for v in range(num_vehicles)]
+
+
+def _split_tour(data, tour, max_route_distance):
+    """ Cuts the tour into routes whose quantized length, the return to
+    the depot included, is not above max_route_distance.
+    """
+    points = data['points']
+    depot = data['depot']
+    scale = data['distance_scale']
+    cap = int(round(max_route_distance * scale))
+
+    def distance(a, b):
+        return int(round(math.dist(points[a], points[b]) * scale))
+
+    routes = []
+    route, length, last = [], 0, depot
+    for node in tour:
+        extended = length + distance(last, node)
+        if route and extended + distance(node, depot) > cap:
+            routes.append(route)
+            route, extended = [], distance(depot, node)
+        route.append(node)
+        length, last = extended, node
+    if route:
+        routes.append(route)
+    if len(routes) > data['num_vehicles']:
+        return None
+    return routes + [[] for _ in range(data['num_vehicles'] - len(routes))]
+
+
+def _nearest_unvisited(tree, points, current, visited):
+    """ Queries the KD-tree with a growing k until an unvisited node
+    shows up, falls back to a full scan.
+    """
+    num_points = len(points)
+    k = 32
+    while k < num_points:
+        _, neighbours = tree.query(points[current], k=k)
+        free = neighbours[~visited[neighbours]]
+        if len(free):
+            return free[0]
+        k *= 4
+    remaining = np.flatnonzero(~visited)
+    offsets = points[remaining] - points[current]
+    return remaining[np.argmin(np.einsum('ij,ij->i', offsets, offsets))]
+
+
+def create_sparse_routing_model(data, max_route_distance=None,
+                                span_cost_coefficient=100,
+                                initial_routes=None, restrict=True):
+    """ Method to build the routing model of a sparse data model.
+
+    Parameters
+    ----------
+    data : dictionary
+        See create_sparse_data_model.
+    max_route_distance : float
+        See optops.create_routing_model.
+    span_cost_coefficient : int
+        See optops.create_routing_model.
+    initial_routes : list
+        Routes whose arcs are allowed on top of the candidate arcs,
+        so that they stay a feasible starting point.
+    restrict : bool
+        If False the successors are not restricted to the candidate
+        arcs, the candidates then only save the distance computations.
+
+    Returns
+    -------
+    manager : ortools RoutingIndexManager
+    routing : ortools RoutingModel
+    transit_callback_index : int
+    """
+    points = data['points']
+    candidates = data['candidate_arcs']
+    scale = data['distance_scale']
+    depot = data['depot']
+    num_points = len(points)
+    manager = pywrapcp.RoutingIndexManager(num_points, data['num_vehicles'],
+                                           depot)
+    routing = pywrapcp.RoutingModel(manager)
+
+    coords = [tuple(p) for p in points.tolist()]
+    coo = candidates.tocoo()
+    lookup = dict(zip((coo.row * num_points + coo.col).tolist(),
+                      coo.data.tolist()))
+    index_to_node = [manager.IndexToNode(i)
+                     for i in range(routing.Size() + routing.vehicles())]
+
+    def distance_callback(from_index, to_index):
+        """Returns the candidate distance, or computes it on demand."""
+        from_node = index_to_node[from_index]
+        to_node = index_to_node[to_index]
+        dist = lookup.get(from_node * num_points + to_node)
+        if dist is None:
+            dist = int(round(math.dist(coords[from_node], coords[to_node])
+                             * scale))
+        return dist
+
+    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    if max_route_distance is not None:
+        routing.AddDimension(transit_callback_index, 0,
+                             int(round(max_route_distance * scale)), True,
+                             'Distance')
+        routing.GetDimensionOrDie('Distance').SetGlobalSpanCostCoefficient(
+            span_cost_coefficient)
+
+    if not restrict:
+        return manager, routing, transit_callback_index
+    # restrict every successor to the candidates, the route ends and the
+    # arcs of the initial routes.
+    ends = [routing.End(v) for v in range(data['num_vehicles'])]
+    extra = {}
+    for route in initial_routes or []:
+        for a, b in zip(route, route[1:]):
+            extra.setdefault(a, []).append(b)
+    for node in range(num_points):
+        if node == depot:
+            continue
+        row = candidates.indices[candidates.indptr[node]:
+                                 candidates.indptr[node + 1]]
+        allowed = [manager.NodeToIndex(int(n)) for n in row if n != depot]
+        allowed.extend(manager.NodeToIndex(n) for n in extra.get(node, []))
+        routing.NextVar(manager.NodeToIndex(node)).SetValues(allowed + ends)
+    return manager, routing, transit_callback_index
+
+
+def solve_sparse(data, time_limit=None, max_route_distance=None,
+                 local_search_metaheuristic=None):
+    """ Method to solve a sparse data model, starting from
+    nearest_neighbour_routes.
+
+    When the start breaks max_route_distance, or the search restricted
+    to the candidate arcs finds nothing, the model is solved again
+    without the restriction in the time that is left.
+
+    Returns
+    -------
+    routes : dictionary
+        vehicle_id: nodes pairs (depot included at both ends), or None
+        when no solution was found.
+    objective : int
+    """
+    start = time.time()
+    search_parameters = optops.create_search_parameters(
+        local_search_metaheuristic=local_search_metaheuristic,
+        time_limit=time_limit)
+    solution = None
+    initial_routes = nearest_neighbour_routes(data, max_route_distance)
+    if initial_routes is not None:
+        manager, routing, _ = create_sparse_routing_model(
+            data, max_route_distance, initial_routes=initial_routes)
+        routing.CloseModelWithParameters(search_parameters)
+        initial = routing.ReadAssignmentFromRoutes(initial_routes, True)
+        if initial is not None:
+            solution = routing.SolveFromAssignmentWithParameters(
+                initial, search_parameters)
+    if not solution:
+        if time_limit is not None:
+            search_parameters = optops.create_search_parameters(
+                local_search_metaheuristic=local_search_metaheuristic,
+                time_limit=max(0, time_limit - (time.time() - start)))
+        manager, routing, _ = create_sparse_routing_model(
+            data, max_route_distance, restrict=False)
+        solution = routing.SolveWithParameters(search_parameters)
+    if not solution:
+        return None, None
+    routes = optops.get_all_routes(data, manager, routing, solution)
+    return routes, solution.ObjectiveValue()
+
+
+def solve_sparse_grid(x_dim, y_dim, num_vehicles=1, k=10, time_limit=60,
+                      scale=optops.GRID_DISTANCE_SCALE):
+    """ Solves the routing problem of an x_dim by y_dim grid with the
+    sparse model.
+    """
+    data = create_sparse_data_model(optops.create_simple_grid(x_dim, y_dim),
+                                    num_vehicles, k, scale)
+    return solve_sparse(data, time_limit=time_limit)
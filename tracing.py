@@ -0,0 +1,233 @@
+""" Module which contains a lightweight tracing layer for the pipeline
+stages (geocoding, matrix building, model files, model setup, search,
+plotting).
+
+Tracing is disabled by default and a disabled span costs one global
+lookup. It is enabled with enable(), or by setting the LP_TRACE
+environment variable to the file the Chrome trace is written to at exit.
+
+    with tracing.span('solve', vehicles=4):
+        solution = routing.SolveWithParameters(search_parameters)
+        tracing.record_solver_stats(routing)
+
+:author: Charalampos Babalis
+"""
+
+from __future__ import print_function
+import atexit
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+_tracer = None
+# the tracer of the last disabled run, so it can still be written out.
+_last_run = []
+
+
+class _NullSpan(object):
+    """ The span handed out while tracing is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    """ A timed stage, recorded into the tracer when it exits."""
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.tracer.stack.append(self)
+        if self.tracer.track_allocations:
+            self.alloc_start = tracemalloc.get_traced_memory()[0]
+        self.cpu_start = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        record = {
+            'name': self.name,
+            'start': self.start - self.tracer.origin,
+            'wall': end - self.start,
+            'cpu': time.process_time() - self.cpu_start,
+            'depth': len(self.tracer.stack) - 1,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'attrs': self.attrs,
+        }
+        if self.tracer.track_allocations:
+            record['alloc_bytes'] = (tracemalloc.get_traced_memory()[0]
+                                     - self.alloc_start)
+        if exc_type is not None:
+            record['error'] = repr(exc)
+        self.tracer.stack.pop()
+        self.tracer.records.append(record)
+        if self.tracer.hook is not None:
+            self.tracer.hook(record)
+        return False
+
+    def set(self, **attrs):
+        """ Method to attach attributes to the span after it started."""
+        self.attrs.update(attrs)
+
+
+class _Tracer(object):
+
+    def __init__(self, track_allocations, hook, profile):
+        self.track_allocations = track_allocations
+        self.hook = hook
+        self.profiler = cProfile.Profile() if profile else None
+        # tracemalloc is only stopped by disable if enable started it.
+        self.started_tracemalloc = False
+        self.records = []
+        self.stack = []
+        self.origin = time.perf_counter()
+
+
+def enable(track_allocations=False, hook=None, profile=False):
+    """ Method to start recording spans.
+
+    Parameters
+    ----------
+    track_allocations : bool
+        Record the net allocated bytes of every span (uses tracemalloc,
+        which slows python code down noticeably).
+    hook : callable
+        Called with every finished span record.
+    profile : bool
+        Run cProfile while tracing, see write_profile.
+    """
+    global _tracer
+    disable()
+    _tracer = _Tracer(track_allocations, hook, profile)
+    if track_allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _tracer.started_tracemalloc = True
+    if _tracer.profiler is not None:
+        _tracer.profiler.enable()
+
+
+def disable():
+    """ Method to stop recording, returns the records of the run."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is None:
+        return []
+    if tracer.profiler is not None:
+        tracer.profiler.disable()
+    if tracer.started_tracemalloc and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _last_run[:] = [tracer]
+    return tracer.records
+
+
+def is_enabled():
+    return _tracer is not None
+
+
+def span(name, **attrs):
+    """ Returns a context manager which records the stage name."""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _Span(tracer, name, attrs)
+
+
+def traced(name=None):
+    """ Decorator which records every call of a function as a span."""
+    def decorator(func):
+        span_name = name or func.__module__ + '.' + func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _Span(_tracer, span_name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_solver_stats(routing):
+    """ Method to attach the statistics of the routing solver to the
+    innermost open span.
+    """
+    tracer = _tracer
+    if tracer is None or not tracer.stack:
+        return
+    solver = routing.solver()
+    tracer.stack[-1].set(solver_wall_ms=solver.WallTime(),
+                         branches=solver.Branches(),
+                         failures=solver.Failures(),
+                         solutions=solver.Solutions())
+
+
+def get_records():
+    """ Returns the span records of the current (or last) run."""
+    tracer = _tracer or (_last_run[0] if _last_run else None)
+    return [] if tracer is None else list(tracer.records)
+
+
+def write_trace(a_file):
+    """ Method to write the span records as a json list."""
+    with open(a_file, 'w') as outfile:
+        json.dump(get_records(), outfile, indent=2, default=str)
+
+
+def write_chrome_trace(a_file):
+    """ Method to write the span records in the Chrome trace-event
+    format (load it in chrome://tracing or Perfetto).
+    """
+    events = []
+    for record in get_records():
+        args = dict(record['attrs'])
+        args['cpu_ms'] = record['cpu'] * 1000
+        for key in ('alloc_bytes', 'error'):
+            if key in record:
+                args[key] = record[key]
+        events.append({'name': record['name'], 'ph': 'X',
+                       'ts': record['start'] * 1e6,
+                       'dur': record['wall'] * 1e6,
+                       'pid': record['pid'], 'tid': record['tid'],
+                       'args': args})
+    with open(a_file, 'w') as outfile:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, outfile,
+                  default=str)
+
+
+def write_profile(a_file):
+    """ Method to dump the cProfile statistics of the run (see
+    enable(profile=True)), readable with the pstats module.
+    """
+    tracer = _tracer or (_last_run[0] if _last_run else None)
+    if tracer is None or tracer.profiler is None:
+        raise ValueError("tracing was not enabled with profile=True")
+    tracer.profiler.dump_stats(a_file)
+
+
+def _write_at_exit(a_file):
+    disable()
+    write_chrome_trace(a_file)
+
+
+if os.environ.get('LP_TRACE'):
+    enable()
+    atexit.register(_write_at_exit, os.environ['LP_TRACE'])
@@ -1,13 +1,12 @@
 """Vehicles Routing Problem (VRP)."""
 
 from __future__ import print_function
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
 import pdb
 import os
 import sys
 #sys.path.append("../LP_projects")
 import city_ops
+import optops
 import csv
 
 
@@ -22,26 +21,9 @@ def create_data_model(city_names):
 
 def print_solution(data, manager, routing, solution, city_names):
     """Prints solution on console."""
-    max_route_distance = 0
-    for vehicle_id in range(data['num_vehicles']):
-        path_list = []
-        index = routing.Start(vehicle_id)
-        plan_output = 'Route for vehicle {}:\n'.format(vehicle_id)
-        route_distance = 0
-        city_names_dict = create_city_names_dict(city_names)
-        while not routing.IsEnd(index):
-            plan_output += ' {} -> '.format(city_names_dict[manager.IndexToNode(index)])
-            path_list.append(city_names_dict[manager.IndexToNode(index)])
-            previous_index = index
-            index = solution.Value(routing.NextVar(index))
-            route_distance += routing.GetArcCostForVehicle(
-                previous_index, index, vehicle_id)
-        plan_output += ' {}\n'.format(city_names_dict[manager.IndexToNode(index)])
-        plan_output += 'Distance of the route: {}m\n'.format(route_distance)
-        print(plan_output)
-        max_route_distance = max(route_distance, max_route_distance)
-        path_list.append(city_names_dict[manager.IndexToNode(index)])
-    print('Maximum of the route distances: {}m'.format(max_route_distance))
+    routes = optops.get_route_set(data, manager, routing, solution)
+    print(routes.format_plan(create_city_names_dict(city_names)))
+    return routes
 
 
 
@@ -65,51 +47,31 @@ def read_cities_from_file(a_file):
 
 
 
-def main():
-    """Solve the CVRP problem."""
+def main(local_search_metaheuristic=None, budget=None):
+    """Solve the CVRP problem.
+
+    The search stops at the first local optimum unless a
+    local_search_metaheuristic (e.g. 'GUIDED_LOCAL_SEARCH') is given,
+    which then needs a budget (a search_budget.SearchBudget) to stop.
+    """
     # Instantiate the data problem.
     city_names = read_cities_from_file(sys.argv[1])
     data = create_data_model(city_names)
 
-    # Create the routing index manager.
-    manager = pywrapcp.RoutingIndexManager(len(data['distance_matrix']),
-                                           data['num_vehicles'], data['depot'])
-
-    # Create Routing Model.
-    routing = pywrapcp.RoutingModel(manager)
-
-
-    # Create and register a transit callback.
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-
-    # Define cost of each arc.
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-    # Add Distance constraint.
-    dimension_name = 'Distance'
-    routing.AddDimension(
-        transit_callback_index,
-        0,  # no slack
-        30000,  # vehicle maximum travel distance
-        True,  # start cumul to zero
-        dimension_name)
-    distance_dimension = routing.GetDimensionOrDie(dimension_name)
-    distance_dimension.SetGlobalSpanCostCoefficient(100)
-
-    # Setting first solution heuristic.
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-
-    # Solve the problem.
-    solution = routing.SolveWithParameters(search_parameters)
+    # Create the routing index manager and model.
+    manager, routing, transit_callback_index = optops.create_routing_model(
+        data, max_route_distance=30000)
+
+    # Setting first solution heuristic, and the metaheuristic if any.
+    search_parameters = optops.create_search_parameters(
+        'PATH_CHEAPEST_ARC', local_search_metaheuristic)
+
+    # Solve the problem, under the budget if one is given.
+    if budget is None:
+        solution = routing.SolveWithParameters(search_parameters)
+    else:
+        solution = budget.solve(routing, search_parameters)
+        print(budget.describe())
 
     # Print solution on console.
     if solution:
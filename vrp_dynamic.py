@@ -1,31 +1,35 @@
 """Vehicles Routing Problem (VRP)."""
 
 from __future__ import print_function
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
+import fleet_sweep
+from optops import GRID_DISTANCE_SCALE
 import optops
+import dynamic_session
+import solution_cache
+import solver_service
+import tracing
 import sys
 import pdb
 
 
+# vehicle maximum travel distance.
+MAX_ROUTE_DISTANCE = 3000
+GRID_FILE = r'C:\Users\Administrator\Documents\github_repos\LP_projects\grid_points.txt'
+MODEL_FILE = r'C:\Users\Administrator\Documents\github_repos\LP_projects\grid-model.json'
+MEDIA_DIR = r'C:\django-projects\vrp\media\\'
+# solved instances are kept in memory for the lifetime of the process
+# and on disk across restarts.
+SOLUTION_CACHE = solution_cache.SolutionCache(
+    r'C:\Users\Administrator\Documents\github_repos\LP_projects\solution_cache')
+# the warm solver service of submit_vrp_program, started on first use.
+SOLVER_SERVICE = None
+
+
 def print_solution(data, manager, routing, solution):
     """Prints solution on console."""
-    max_route_distance = 0
-    for vehicle_id in range(data['num_vehicles']):
-        index = routing.Start(vehicle_id)
-        plan_output = 'Route for vehicle {}:\n'.format(vehicle_id)
-        route_distance = 0
-        while not routing.IsEnd(index):
-            plan_output += ' {} -> '.format(manager.IndexToNode(index))
-            previous_index = index
-            index = solution.Value(routing.NextVar(index))
-            route_distance += routing.GetArcCostForVehicle(
-                previous_index, index, vehicle_id)
-        plan_output += '{}\n'.format(manager.IndexToNode(index))
-        plan_output += 'Distance of the route: {}m\n'.format(route_distance)
-        print(plan_output)
-        max_route_distance = max(route_distance, max_route_distance)
-    print('Maximum of the route distances: {}m'.format(max_route_distance))
+    routes = optops.get_route_set(data, manager, routing, solution)
+    print(routes.format_plan())
+    return routes
 
 
 def create_model(data_file):
@@ -33,130 +37,162 @@ def create_model(data_file):
     return data
 
 
-def create_grid_model(vehicle_num):
+def create_grid_model(vehicle_num, write_model=True):
     #points_matrix = optops.create_simple_grid(8, 8)
     #optops.write_grid_to_file(points_matrix, 'grid_points.txt')
-    points_matrix = optops.read_grid_from_file(r'C:\Users\Administrator\Documents\github_repos\LP_projects\grid_points.txt')
+    points_matrix = optops.read_grid_from_file(GRID_FILE)
     distance_matrix = optops.calc_matrix_euclidean_distance(points_matrix)
     data = optops.create_data_model(distance_matrix, vehicle_num)
-    optops.write_model_to_file(data, r'C:\Users\Administrator\Documents\github_repos\LP_projects\grid-model.json')
+    if write_model:
+        optops.write_model_to_file(data, MODEL_FILE)
     return data
 
 
 def print_matplotlib_grid(data, solution_paths):
     """ Method to be run only to print in django. single line call."""
-    points_matrix = optops.read_grid_from_file(r'C:\Users\Administrator\Documents\github_repos\LP_projects\grid_points.txt')
-    # print grid
-    optops.print_grid(points_matrix)
-    # then print the solution
-    optops.print_paths_to_grid(data, points_matrix, solution_paths)
-    optops.save_fig_to_file(r'C:\django-projects\vrp\media\\')
+    points_matrix = optops.read_grid_from_file(GRID_FILE)
+    # the grid and the solution are rendered headless, straight to file.
+    optops.render_routes_to_file(
+        points_matrix,
+        [solution_paths[v] for v in range(data['num_vehicles'])],
+        MEDIA_DIR + 'figure.png')
 
 
-def run_vrp_program(vehicle_num):
+def run_vrp_program(vehicle_num, use_cache=True):
+    """ Solves the grid VRP for vehicle_num vehicles and renders it.
+
+    Solutions are looked up in SOLUTION_CACHE first, so a repeated
+    request returns the stored routes (and restores the stored figure)
+    without solving again.
+    """
+    # Setting first solution heuristic.
+    search_parameters = optops.create_search_parameters('PATH_CHEAPEST_ARC')
+
+    # the key only hashes the grid file, a hit neither reads the grid
+    # nor builds its matrix.
+    with tracing.span('cache.key'):
+        key = solution_cache.file_key(GRID_FILE, vehicle_num,
+                                      scale=GRID_DISTANCE_SCALE,
+                                      max_route_distance=MAX_ROUTE_DISTANCE,
+                                      search_parameters=search_parameters)
+    if use_cache:
+        cached = SOLUTION_CACHE.get(key)
+        if cached is not None:
+            if not SOLUTION_CACHE.restore_figure(key,
+                                                 MEDIA_DIR + 'figure.png'):
+                print_matplotlib_grid({'num_vehicles': vehicle_num},
+                                      cached['routes'])
+            return cached['routes']
 
     # Instantiate the data problem.
     #data_file = sys.argv[1]
-    data = create_grid_model(vehicle_num)  # create_model(data_file)
-
-    # Create the routing index manager.
-    manager = pywrapcp.RoutingIndexManager(len(data['distance_matrix']),
-                                           data['num_vehicles'], data['depot'])
-
-    # Create Routing Model.
-    routing = pywrapcp.RoutingModel(manager)
-
-
-    # Create and register a transit callback.
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
-
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-
-    # Define cost of each arc.
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+    data = create_grid_model(vehicle_num, write_model=False)
+    optops.write_model_to_file(data, MODEL_FILE)
 
-    # Add Distance constraint.
-    dimension_name = 'Distance'
-    routing.AddDimension(
-        transit_callback_index,
-        0,  # no slack
-        3000,  # vehicle maximum travel distance
-        True,  # start cumul to zero
-        dimension_name)
-    distance_dimension = routing.GetDimensionOrDie(dimension_name)
-    distance_dimension.SetGlobalSpanCostCoefficient(100)
-
-    # Setting first solution heuristic.
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
+    # Create the routing index manager and model.
+    manager, routing, transit_callback_index = optops.create_routing_model(
+        data, scale=GRID_DISTANCE_SCALE,
+        max_route_distance=MAX_ROUTE_DISTANCE)
 
     # Solve the problem.
-    solution = routing.SolveWithParameters(search_parameters)
+    with tracing.span('search'):
+        solution = routing.SolveWithParameters(search_parameters)
+        tracing.record_solver_stats(routing)
 
     # Print solution on console.
     if solution:
-        print_solution(data, manager, routing, solution)
-        solution_paths = optops.get_all_routes(data, manager, routing, solution)
+        routes = print_solution(data, manager, routing, solution)
+        solution_paths = routes.to_dict()
         print_matplotlib_grid(data, solution_paths)
+        if use_cache:
+            SOLUTION_CACHE.put(key, solution_paths, solution.ObjectiveValue(),
+                               figure_file=MEDIA_DIR + 'figure.png')
         return solution_paths
 
 
-def main():
-    """Solve the CVRP problem."""
+def create_grid_session(vehicle_num, time_limit=0.2):
+    """ Returns a dynamic session of the grid (its first point is the
+    depot), so stops can be added and removed and re-planned
+    incrementally instead of solving the whole grid again.
+    """
+    points_matrix = optops.read_grid_from_file(GRID_FILE)
+    session = dynamic_session.DynamicSession(
+        points_matrix[0], vehicle_num, scale=GRID_DISTANCE_SCALE,
+        max_route_distance=MAX_ROUTE_DISTANCE, time_limit=time_limit)
+    session.add_stops((i, point) for i, point in
+                      enumerate(points_matrix[1:], 1))
+    return session
+
+
+def get_solver_service(num_workers=2):
+    """ Returns the solver service of the grid, starting it if needed."""
+    global SOLVER_SERVICE
+    if SOLVER_SERVICE is None:
+        SOLVER_SERVICE = solver_service.SolverService(
+            GRID_FILE, num_workers=num_workers, media_dir=MEDIA_DIR,
+            scale=GRID_DISTANCE_SCALE,
+            max_route_distance=MAX_ROUTE_DISTANCE)
+        SOLVER_SERVICE.start()
+    return SOLVER_SERVICE
+
+
+def submit_vrp_program(vehicle_num, time_limit=None):
+    """ Queues the grid VRP for vehicle_num vehicles on the solver
+    service and returns the job id at once, so the caller (the django
+    view) does not block. Poll it with get_solver_service().status.
+    """
+    return get_solver_service().submit(vehicle_num, time_limit)
+
+
+def sweep_vrp_program(vehicle_counts, max_route_distances=None,
+                      time_limit=10, num_workers=None):
+    """ Solves the grid VRP for every fleet size of vehicle_counts (and
+    every cap of max_route_distances, MAX_ROUTE_DISTANCE by default) in
+    parallel processes and prints the Pareto frontier of total distance,
+    longest route and vehicles used. Returns the sweep, see
+    fleet_sweep.sweep_fleet.
+    """
+    if max_route_distances is None:
+        max_route_distances = [MAX_ROUTE_DISTANCE]
+    data = create_grid_model(1, write_model=False)
+    sweep = fleet_sweep.sweep_fleet(
+        data, vehicle_counts, max_route_distances, num_workers=num_workers,
+        scale=GRID_DISTANCE_SCALE, time_limit=time_limit)
+    print(fleet_sweep.format_frontier(sweep['frontier']))
+    return sweep
+
+
+def main(local_search_metaheuristic=None, budget=None):
+    """Solve the CVRP problem.
+
+    The search stops at the first local optimum unless a
+    local_search_metaheuristic (e.g. 'GUIDED_LOCAL_SEARCH') is given,
+    which then needs a budget (a search_budget.SearchBudget) to stop.
+    """
     # Instantiate the data problem.
     #data_file = sys.argv[1]
     data = create_grid_model(3)  # create_model(data_file)
 
-    # Create the routing index manager.
-    manager = pywrapcp.RoutingIndexManager(len(data['distance_matrix']),
-                                           data['num_vehicles'], data['depot'])
-
-    # Create Routing Model.
-    routing = pywrapcp.RoutingModel(manager)
-
-
-    # Create and register a transit callback.
-    def distance_callback(from_index, to_index):
-        """Returns the distance between the two nodes."""
-        # Convert from routing variable Index to distance matrix NodeIndex.
-        from_node = manager.IndexToNode(from_index)
-        to_node = manager.IndexToNode(to_index)
-        return data['distance_matrix'][from_node][to_node]
+    # Create the routing index manager and model.
+    manager, routing, transit_callback_index = optops.create_routing_model(
+        data, scale=GRID_DISTANCE_SCALE,
+        max_route_distance=MAX_ROUTE_DISTANCE)
 
-    transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+    # Setting first solution heuristic, and the metaheuristic if any.
+    search_parameters = optops.create_search_parameters(
+        'PATH_CHEAPEST_ARC', local_search_metaheuristic)
 
-    # Define cost of each arc.
-    routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
-
-    # Add Distance constraint.
-    dimension_name = 'Distance'
-    routing.AddDimension(
-        transit_callback_index,
-        0,  # no slack
-        3000,  # vehicle maximum travel distance
-        True,  # start cumul to zero
-        dimension_name)
-    distance_dimension = routing.GetDimensionOrDie(dimension_name)
-    distance_dimension.SetGlobalSpanCostCoefficient(100)
-
-    # Setting first solution heuristic.
-    search_parameters = pywrapcp.DefaultRoutingSearchParameters()
-    search_parameters.first_solution_strategy = (
-        routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC)
-
-    # Solve the problem.
-    solution = routing.SolveWithParameters(search_parameters)
+    # Solve the problem, under the budget if one is given.
+    if budget is None:
+        solution = routing.SolveWithParameters(search_parameters)
+    else:
+        solution = budget.solve(routing, search_parameters)
+        print(budget.describe())
 
     # Print solution on console.
     if solution:
-        print_solution(data, manager, routing, solution)
-        solution_paths = optops.get_all_routes(data, manager, routing, solution)
+        routes = print_solution(data, manager, routing, solution)
+        solution_paths = routes.to_dict()
         print_matplotlib_grid(data, solution_paths)
 
 if __name__ == '__main__':